@@ -0,0 +1,24 @@
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, Field
+
+
+class ObserverFrameHeader(BaseModel):
+    """
+    Header of a preview frame, sent to observers as a binary message packed like `pack_binary_request`
+    """
+    type: str = "FRAME"
+    seq: int  # Frames previewed so far, a gap is a frame this observer skipped as it was behind or capped
+    timestamp: float  # `time.monotonic()` the frame was requested at
+    width: int
+    height: int
+
+
+class ObserverEvent(BaseModel):
+    """
+    Capture and recognition events, sent to observers as JSON text messages
+    """
+    type: str = "EVENT"
+    event: str
+    id: Optional[str] = None
+    data: Dict[str, Any] = Field(default_factory=dict)
@@ -1,3 +1,4 @@
+import struct
 from enum import Enum
 from typing import List, Union
 
@@ -7,6 +8,7 @@ from pydantic import BaseModel, Field, field_validator, ValidationError
 class SlaveWorkRequestType(str, Enum):
     Algorithm = "ALGORITHM"
     ImageRecognition = "IMAGE_RECOGNITION"
+    Cancel = "CANCEL"
 
 
 class SlaveObstacleDirection(str, Enum):
@@ -38,3 +40,43 @@ class SlaveWorkRequest(BaseModel):
     payload: Union[SlaveWorkRequestPayloadAlgo, SlaveWorkRequestPayloadImageRecognition]
 
 
+
+
+class SlaveCapability(str, Enum):
+    BinaryImages = "BINARY_IMAGES"  # Accepts image requests as binary frames, see `pack_binary_request`
+    Cancel = "CANCEL"  # Drops a request on `SlaveCancelRequest`, e.g. once another slave answered a hedged one
+
+
+class SlaveCapabilities(BaseModel):
+    """
+    Sent by a slave as its first message after connecting. Slaves that never send it get base64 JSON requests.
+    """
+    capabilities: List[str] = Field(default_factory=list)
+
+
+class SlaveCancelRequest(BaseModel):
+    """
+    Tells a slave to drop a request it has not answered yet, no response is expected
+    """
+    id: str
+    type: SlaveWorkRequestType = SlaveWorkRequestType.Cancel
+
+
+class SlaveBinaryImageHeader(BaseModel):
+    id: str
+    type: SlaveWorkRequestType = SlaveWorkRequestType.ImageRecognition
+    ignore_bullseye: bool = Field(default=False)
+
+
+# Binary frame: big endian u32 header length, UTF-8 JSON header, then the raw JPEG
+BINARY_HEADER_LENGTH = struct.Struct(">I")
+
+
+def pack_binary_request(header: BaseModel, payload: Union[bytes, memoryview]) -> bytes:
+    """
+    :param header: Request header, serialised as JSON
+    :param payload: Raw bytes following the header
+    :return: Single binary WebSocket message
+    """
+    header_json = header.model_dump_json().encode("utf-8")
+    return b"".join((BINARY_HEADER_LENGTH.pack(len(header_json)), header_json, payload))
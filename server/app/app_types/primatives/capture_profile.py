@@ -0,0 +1,34 @@
+from enum import Enum
+from typing import Optional, Tuple
+
+from pydantic import BaseModel, Field, field_validator
+
+
+class CaptureColour(str, Enum):
+    """
+    Colour format of the encoded image.
+    """
+    RGB = "RGB"
+    Grayscale = "L"
+
+
+class CaptureProfile(BaseModel):
+    """
+    How a captured frame is cropped, scaled and encoded before it is sent for recognition.
+    """
+    name: str
+    # Normalised (x0, y0, x1, y1) region of the frame to keep, (0, 0, 1, 1) keeps all of it
+    roi: Tuple[float, float, float, float] = (0.0, 0.0, 1.0, 1.0)
+    # Output size after cropping, the cropped size is kept if neither is set and the aspect ratio if only one is
+    width: Optional[int] = Field(default=None, gt=0)
+    height: Optional[int] = Field(default=None, gt=0)
+    quality: int = Field(default=70, ge=1, le=100)
+    colour: CaptureColour = CaptureColour.RGB
+
+    @field_validator("roi")
+    @classmethod
+    def validate_roi(cls, roi: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+        x0, y0, x1, y1 = roi
+        if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+            raise ValueError(f"ROI must be normalised (x0, y0, x1, y1) with x0 < x1 and y0 < y1, got {roi}")
+        return roi
@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app_types.primatives.obstacle_label import ObstacleLabel
 
@@ -8,3 +8,14 @@ from app_types.primatives.obstacle_label import ObstacleLabel
 class CvResponse(BaseModel):
     id: str
     label: Optional[ObstacleLabel]
+    confidence: Optional[float] = None  # Slaves that report it get their frames weighted in burst votes
+
+
+class CvQuorumResponse(CvResponse):
+    """
+    Label combined from several slaves' answers to the same image
+    """
+    requested: int = 0  # Slaves the image was sent to
+    responded: List[str] = Field(default_factory=list)  # Slaves that answered before the deadline
+    agreed: List[str] = Field(default_factory=list)  # Slaves that answered with the winning label
+    reached: bool = False  # Whether enough slaves answered, False if the deadline was hit first
@@ -38,3 +38,7 @@ class ObstacleLabel(str, Enum):
     Shape_Left = "LEFT"
     Shape_Right = "RIGHT"
     Unknown = "UNKNOWN"
+
+
+# Labels meaning nothing was recognised, not counted in votes nor cached
+ABSTAINING_LABELS = frozenset({ObstacleLabel.Unknown})
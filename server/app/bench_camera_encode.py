@@ -0,0 +1,103 @@
+"""
+Benchmark for encoding captured frames to JPEG, at full still resolution.
+Compares the old inline encode (fresh BytesIO, then base64 on the caller) with the encode pipeline.
+Every variant runs in a fresh process, so peak RSS is not shared between them.
+
+Usage:
+    python bench_camera_encode.py --width 4608 --height 2592 --frames 20
+"""
+import argparse
+import base64
+import io
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+from PIL import Image
+
+from modules.camera.encoder import EncodePipeline, PilJpegEncoder, TurboJpegEncoder, TurboJPEG
+
+
+def synthetic_frame(width: int, height: int) -> np.ndarray:
+    # Gradients with sensor-like noise, so the JPEG size is close to a real scene.
+    # Built in uint8 so generating it does not set the peak RSS being measured.
+    rng = np.random.default_rng(0)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    img[..., 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    img[..., 2] = img[..., 0] // 2 + img[..., 1] // 2
+    img += rng.integers(0, 16, size=img.shape, dtype=np.uint8)
+    return img
+
+
+def inline_encode(img: np.ndarray) -> str:
+    image_stream = io.BytesIO()
+    Image.fromarray(img).save(image_stream, format="JPEG", quality=70)
+    return base64.b64encode(image_stream.getvalue()).decode("utf-8")
+
+
+def run(variant: str, width: int, height: int, frames: int, results) -> None:
+    img = synthetic_frame(width, height)
+
+    pipeline = None
+    if variant == "inline":
+        encode = inline_encode
+    else:
+        encoder = TurboJpegEncoder() if variant == "turbojpeg" else PilJpegEncoder()
+        pipeline = EncodePipeline(encoder, quality=70)
+
+        def encode(frame: np.ndarray) -> str:
+            with pipeline.encode(frame) as jpeg:
+                return base64.b64encode(jpeg.data).decode("ascii")
+
+    # Warm up buffers and the encoder
+    encode(img)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        encode(img)
+    elapsed = time.perf_counter() - start
+
+    # Frames queued back to back, as when a burst is captured
+    pipelined = elapsed
+    if pipeline is not None:
+        start = time.perf_counter()
+        for future in [pipeline.submit(img) for _ in range(frames)]:
+            with future.result() as jpeg:
+                base64.b64encode(jpeg.data)
+        pipelined = time.perf_counter() - start
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results[variant] = (elapsed / frames * 1e3, pipelined / frames * 1e3, rss_after, rss_after - rss_before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPEG encode benchmark")
+    parser.add_argument("--width", type=int, default=4608)
+    parser.add_argument("--height", type=int, default=2592)
+    parser.add_argument("--frames", type=int, default=20)
+    args = parser.parse_args()
+
+    variants = ["inline", "pil"] + (["turbojpeg"] if TurboJPEG is not None else [])
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Manager().dict()
+    for variant in variants:
+        p = ctx.Process(target=run, args=(variant, args.width, args.height, args.frames, results))
+        p.start()
+        p.join()
+
+    print(f"{args.width}x{args.height}, {args.frames} frames")
+    print("ENCODER\t\tms/frame\tms/frame queued\tpeak RSS (KiB)\tgrowth after warm up (KiB)")
+    for variant in variants:
+        if variant not in results:
+            print(f"{variant}\t\tfailed")
+            continue
+        ms, queued_ms, rss, growth = results[variant]
+        print(f"{variant}\t\t{ms:.1f}\t\t{queued_ms:.1f}\t\t{rss}\t\t{growth}")
+
+
+if __name__ == "__main__":
+    main()
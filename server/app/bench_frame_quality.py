@@ -0,0 +1,64 @@
+"""
+Benchmark for scoring frame quality, at the resolutions the camera grabs and for several strides.
+Also checks that a blurred copy of the frame scores lower than the sharp one.
+
+Usage:
+    python bench_frame_quality.py --frames 50
+"""
+import argparse
+import time
+
+import numpy as np
+
+from modules.camera.quality import FrameScorer
+
+RESOLUTIONS = [(4608, 2592), (2304, 1296), (640, 480)]
+STEPS = [4, 8, 16]
+
+
+def synthetic_frame(width: int, height: int) -> np.ndarray:
+    # Edges of a checkerboard with sensor-like noise, built in uint8
+    rng = np.random.default_rng(0)
+    y, x = np.ogrid[:height, :width]
+    board = (((x // 32) + (y // 32)) % 2 * 160 + 40).astype(np.uint8)
+    img = np.repeat(board[..., None], 3, axis=2)
+    img += rng.integers(0, 16, size=img.shape, dtype=np.uint8)
+    return img
+
+
+def motion_blur(img: np.ndarray, length: int = 9) -> np.ndarray:
+    # Horizontal box blur, as left by the robot still moving during the exposure
+    acc = np.zeros(img.shape, dtype=np.uint16)
+    for i in range(length):
+        acc += np.roll(img, i - length // 2, axis=1)
+    return (acc // length).astype(np.uint8)
+
+
+def time_score(scorer: FrameScorer, img: np.ndarray, frames: int) -> float:
+    scorer.score(img)
+    start = time.perf_counter()
+    for _ in range(frames):
+        scorer.score(img)
+    return (time.perf_counter() - start) / frames * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame quality scoring benchmark")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    print("RESOLUTION\tSTEP\tms/frame\tSHARP\t\tBLURRED")
+    for width, height in RESOLUTIONS:
+        sharp = synthetic_frame(width, height)
+        blurred = motion_blur(sharp)
+        for step in STEPS:
+            scorer = FrameScorer(step=step)
+            ms = time_score(scorer, sharp, args.frames)
+            print(
+                f"{width}x{height}\t{step}\t{ms:.2f}\t\t"
+                f"{scorer.score(sharp).sharpness:.1f}\t\t{scorer.score(blurred).sharpness:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
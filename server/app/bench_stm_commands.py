@@ -0,0 +1,58 @@
+"""
+Microbenchmark for building and serialising STM command programs.
+Reports allocations and time per maneuver, for the 10 command bypass in task two.
+"""
+import time
+import tracemalloc
+
+from modules.serial.stm_commands import StmTurn, StmWiggle, StmStraight
+
+ITERATIONS = 10_000
+
+
+def bypass_maneuver(toggle_flip: int = 1, turn_speed: int = 40) -> list:
+    commands = [
+        StmTurn(angle=toggle_flip * 45, speed=turn_speed),
+        StmWiggle(),
+        StmTurn(angle=toggle_flip * -45, speed=turn_speed),
+        StmWiggle(),
+        StmStraight(distance=15, speed=turn_speed),
+        StmWiggle(),
+        StmTurn(angle=toggle_flip * -45, speed=turn_speed),
+        StmWiggle(),
+        StmTurn(angle=toggle_flip * 45, speed=turn_speed),
+        StmWiggle(),
+    ]
+    return [c.to_serial() for c in commands] + commands
+
+
+def main():
+    # Warm up any caches before measuring
+    bypass_maneuver()
+
+    # Blocks held by each built and serialised maneuver
+    tracemalloc.start()
+    start_blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+    maneuvers = [bypass_maneuver() for _ in range(ITERATIONS)]
+    end_blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+    del maneuvers
+
+    # Peak memory touched by a single maneuver
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    bypass_maneuver()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        bypass_maneuver()
+    elapsed = time.perf_counter() - start
+
+    print(f"Blocks per maneuver:\t{(end_blocks - start_blocks) / ITERATIONS:.1f}")
+    print(f"Peak bytes per maneuver:\t{peak - current}")
+    print(f"Time per maneuver:\t{elapsed / ITERATIONS * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ class Config:
         self.conf_threshold = 0.65
         self.task1_weights = task1_weights
         self.task2_weights = task2_weights
+        self.capture_profile = "full"  # capture profile for image recognition snaps, see modules/camera/profiles.py
 
 
 class IndoorsConfig(Config):
@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .configuration import (
+    CAMERA_BACKEND, CAMERA_REPLAY_SOURCE, CAMERA_REPLAY_MAX_FRAMES,
+    CAMERA_FAKE_FPS, CAMERA_FAKE_LATENCY, CAMERA_FAKE_RESOLUTION,
+)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+class CameraBackend(ABC):
+    """
+    Source of frames for the `Camera`. Frames are (H, W, 3) uint8 arrays.
+    Like Picamera2 configured with `queue=False`, a capture only returns a frame exposed after it was called.
+    """
+
+    name: str
+
+    @abstractmethod
+    def start(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def capture_array(self) -> np.ndarray:
+        """
+        Blocks until the next frame is ready
+        :return: The frame
+        """
+        raise NotImplementedError
+
+
+class PicameraBackend(CameraBackend):
+    """
+    The Pi camera, configured for still images
+    """
+
+    name = "picamera"
+
+    def __init__(self):
+        # Only importable on the Pi, so imported when the backend is used
+        import picamera2
+
+        self.cam = picamera2.Picamera2()
+
+        # Configure the camera for capturing still images
+        config = self.cam.create_still_configuration(queue=False)
+        self.cam.configure(config)
+
+    def start(self) -> None:
+        self.cam.start()
+
+    def stop(self) -> None:
+        self.cam.stop()
+
+    def capture_array(self) -> np.ndarray:
+        return self.cam.capture_array()
+
+
+class PacedBackend(CameraBackend, ABC):
+    """
+    Fake camera that delivers frame n at `start + n / fps + latency`, like a sensor running at a fixed frame rate.
+    A capture waits for the next frame exposed after it was called, then for the latency.
+    """
+
+    def __init__(self, fps: float, latency: float):
+        """
+        :param fps: Frames exposed per second
+        :param latency: Seconds from the end of an exposure until the frame is returned
+        """
+        self.fps = fps
+        self.latency = latency
+        self._started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = time.monotonic()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._started_at = None
+
+    def capture_array(self) -> np.ndarray:
+        started_at = self._started_at
+        if started_at is None:
+            raise RuntimeError(f"{self.name} camera has not been started")
+
+        now = time.monotonic()
+        n = int((now - started_at) * self.fps) + 1
+        ready_at = started_at + n / self.fps + self.latency
+        time.sleep(max(ready_at - now, 0))
+        return self.frame(n)
+
+    @abstractmethod
+    def frame(self, n: int) -> np.ndarray:
+        """
+        :param n: Index of the frame since the camera started
+        :return: The frame, must not be modified by the caller
+        """
+        raise NotImplementedError
+
+
+class ReplayBackend(PacedBackend):
+    """
+    Replays frames from a directory of images, in name order, or from a video file, looping at the end.
+    Frames are decoded up front, so decoding does not count towards the captures being profiled.
+    """
+
+    name = "replay"
+
+    logger = logging.getLogger("Replay Camera")
+
+    def __init__(
+            self,
+            source: str,
+            fps: float = 10.0,
+            latency: float = 0.05,
+            max_frames: int = 64,
+    ):
+        """
+        :param source: Directory of images or a video file
+        :param fps: Frames exposed per second
+        :param latency: Seconds from the end of an exposure until the frame is returned
+        :param max_frames: Frames loaded from the source at most, they are all kept in memory
+        """
+        super().__init__(fps, latency)
+
+        path = Path(source)
+        if path.is_dir():
+            self._frames = self._load_images(path, max_frames)
+        elif path.is_file():
+            self._frames = self._load_video(path, max_frames)
+        else:
+            raise FileNotFoundError(f"Replay source not found: {source}")
+
+        if not self._frames:
+            raise ValueError(f"No frames in replay source: {source}")
+        self.logger.info(f"Replaying {len(self._frames)} frame(s) from {source} at {fps} fps")
+
+    @staticmethod
+    def _load_images(path: Path, max_frames: int) -> List[np.ndarray]:
+        files = sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)[:max_frames]
+        return [np.asarray(Image.open(p).convert("RGB")) for p in files]
+
+    @staticmethod
+    def _load_video(path: Path, max_frames: int) -> List[np.ndarray]:
+        import cv2
+
+        frames = []
+        video = cv2.VideoCapture(str(path))
+        try:
+            while len(frames) < max_frames:
+                ok, bgr = video.read()
+                if not ok:
+                    break
+                frames.append(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+        finally:
+            video.release()
+        return frames
+
+    def frame(self, n: int) -> np.ndarray:
+        return self._frames[n % len(self._frames)]
+
+
+class SyntheticBackend(PacedBackend):
+    """
+    Generates a checkerboard that drifts across the frame with sensor-like noise.
+    A few frames are generated up front and cycled, so generating them does not count towards the captures.
+    """
+
+    name = "synthetic"
+
+    VARIANTS = 8  # distinct frames generated
+    SQUARE = 64  # size of a checkerboard square, in pixels
+
+    def __init__(self, resolution: Tuple[int, int] = (4608, 2592), fps: float = 10.0, latency: float = 0.05):
+        """
+        :param resolution: (width, height) of the frames
+        :param fps: Frames exposed per second
+        :param latency: Seconds from the end of an exposure until the frame is returned
+        """
+        super().__init__(fps, latency)
+        width, height = resolution
+
+        rng = np.random.default_rng(0)
+        y, x = np.ogrid[:height, :width]
+        self._frames = []
+        for i in range(self.VARIANTS):
+            shift = i * self.SQUARE // self.VARIANTS
+            board = (((x + shift) // self.SQUARE + y // self.SQUARE) % 2 * 160 + 40).astype(np.uint8)
+            img = np.repeat(board[..., None], 3, axis=2)
+            img += rng.integers(0, 16, size=img.shape, dtype=np.uint8)
+            self._frames.append(img)
+
+    def frame(self, n: int) -> np.ndarray:
+        return self._frames[n % self.VARIANTS]
+
+
+def _parse_resolution(resolution: str) -> Tuple[int, int]:
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+
+def create_backend(name: Optional[str] = None) -> CameraBackend:
+    """
+    :param name: picamera, replay or synthetic, CAMERA_BACKEND if not set
+    :return: Backend configured from the camera configuration
+    """
+    name = name or CAMERA_BACKEND
+    if name == PicameraBackend.name:
+        return PicameraBackend()
+    if name == ReplayBackend.name:
+        return ReplayBackend(
+            CAMERA_REPLAY_SOURCE, CAMERA_FAKE_FPS, CAMERA_FAKE_LATENCY, CAMERA_REPLAY_MAX_FRAMES
+        )
+    if name == SyntheticBackend.name:
+        return SyntheticBackend(_parse_resolution(CAMERA_FAKE_RESOLUTION), CAMERA_FAKE_FPS, CAMERA_FAKE_LATENCY)
+    raise ValueError(f"Unknown camera backend: {name}")
@@ -1,103 +1,387 @@
 import base64
 import io
 import logging
+import os
 import threading
-import picamera2
-from PIL import Image
+import time
+from collections import deque
+from typing import Optional, Deque, Union, List
+
+import numpy as np
+from app_types.primatives.capture_profile import CaptureProfile
 from utils.metaclass.singleton import Singleton
-import time  # Importing time to generate timestamp
-import os  # Importing os to use os.getlogin for user home directory
+from .configuration import (
+    CAMERA_STREAMING, FRAME_TIMEOUT, FRAME_RING_SIZE, ENCODE_WORKERS, JPEG_QUALITY,
+    GRAB_RETRY_DELAY, GRAB_RETRY_MAX_DELAY, GRAB_MAX_FAILURES,
+    QUALITY_STEP, MIN_SHARPNESS, MAX_CLIPPED, MIN_LUMINANCE, MAX_LUMINANCE, QUALITY_MAX_SKIP,
+)
+from .backends import CameraBackend, create_backend
+from .encoder import EncodePipeline
+from .profiles import apply_profile, get_profile
+from .quality import FrameQuality, FrameScorer
+
+
+class CameraFrame:
+    """
+    A grabbed frame, the `time.monotonic()` it was requested at and its quality score.
+    The camera only returns frames exposed after a request, so the frame shows the scene after its timestamp.
+    """
+
+    def __init__(self, image: np.ndarray, timestamp: float, quality: FrameQuality):
+        self.image = image
+        self.timestamp = timestamp
+        self.quality = quality
+
+    @property
+    def sharpness(self) -> float:
+        return self.quality.sharpness
 
 
 class Camera(metaclass=Singleton):
     """
     This class handles all camera interaction.
-    Basically just reads from the camera (hopefully)
+    While streaming, the camera stays started and a grabber thread keeps the latest frame,
+    so a capture does not pay for sensor start-up and AE/AWB settling.
     """
 
     logger = logging.getLogger("Camera")
 
-    def __init__(self):
-        # Initialize Picamera2
-        self.logger.info("Starting Picamera!")
-        self.cam = picamera2.Picamera2()
+    def __init__(self, backend: Optional[CameraBackend] = None):
+        """
+        :param backend: Optional source of frames, the CAMERA_BACKEND one if not set
+        """
+        self.cam = backend or create_backend()
+        self.logger.info(f"Camera has been configured with the {self.cam.name} backend!")
 
         self.lock = threading.Lock()
 
-        # Configure the camera for capturing still images
-        config = self.cam.create_still_configuration(queue=False)
+        self.encoder = EncodePipeline(workers=ENCODE_WORKERS, quality=JPEG_QUALITY)
+        self.scorer = FrameScorer(
+            step=QUALITY_STEP,
+            min_sharpness=MIN_SHARPNESS,
+            max_clipped=MAX_CLIPPED,
+            min_luminance=MIN_LUMINANCE,
+            max_luminance=MAX_LUMINANCE,
+        )
 
-        # Configure and start the camera
-        self.cam.configure(config)
-        # self.cam.start()
-        self.logger.info("Camera has been configured!")
+        # Most recent frames, oldest first
+        self._frames: Deque[CameraFrame] = deque(maxlen=FRAME_RING_SIZE)
+        self._frame_count = 0  # Frames grabbed since streaming started
+        self._frame_ready = threading.Condition()
+        self._streaming = False
+        self._grabber: Optional[threading.Thread] = None
+        self._grabber_pid: Optional[int] = None
+        self._grab_error: Optional[Exception] = None  # Why the grabber gave up, raised to captures waiting on it
+
+        if CAMERA_STREAMING:
+            self.start_streaming()
 
     def __del__(self):
         try:
             self.logger.info("Attempting to close camera()")
-            self.cam.stop()
+            self.stop_streaming()
         except Exception:
             self.logger.info("Unable to stop camera, is it running?")
 
-    def capture(self) -> str:
+    """
+    STREAMING
+    """
+
+    @property
+    def streaming(self) -> bool:
+        return self._streaming
+
+    @classmethod
+    def running(cls) -> Optional["Camera"]:
         """
-        Method to read the image of the camera as a np array
-        :return: Base64 image
+        Looks up the camera without creating it, which would start the sensor
+        :return: The camera if it is created and streaming, else None
         """
+        camera = Singleton._instances.get(cls)
+        return camera if camera is not None and camera.streaming else None
 
-        # with self.lock:
-
-        self.logger.info("Starting camera!")
+    def start_streaming(self) -> None:
+        """
+        Starts the camera and the grabber thread, if not already running in this process
+        :return: None
+        """
+        with self.lock:
+            if self._streaming and self._grabber_pid == os.getpid() and self._grabber.is_alive():
+                return
 
-        self.cam.start()  # this is the crux, picam2 doesn't throw errors if it is not start()'ed
+            if not self._streaming:
+                self.logger.info("Starting camera!")
+                self.cam.start()
+                self._streaming = True
+                self._grab_error = None
 
-        self.logger.info("Capturing image!")
+            # Threads do not survive a fork, so a child process starts its own grabber
+            self._grabber_pid = os.getpid()
+            self._grabber = threading.Thread(target=self._grab_loop, name="Camera-Grabber", daemon=True)
+            self._grabber.start()
 
-        # Create a BytesIO object to store the image in memory
-        image_stream = io.BytesIO()
+    def stop_streaming(self) -> None:
+        """
+        Stops the grabber thread and the camera, to save power while no captures are expected
+        :return: None
+        """
+        with self.lock:
+            if not self._streaming:
+                return
+            self._streaming = False
+            grabber = self._grabber
 
-        self.logger.info("Created bytes array")
+        if grabber is not None and grabber.is_alive() and grabber is not threading.current_thread():
+            grabber.join(timeout=FRAME_TIMEOUT)
 
-        # Capture the image in JPEG format
-        img = self.cam.capture_array()
-        self.logger.info(f"Image! {img}")
-        self.logger.info("Image has been captured as np.Array!")
+        self.logger.info("Stopping camera!")
         self.cam.stop()
+        with self._frame_ready:
+            self._frames.clear()
+
+    def _grab_loop(self) -> None:
+        """
+        [Grabber Thread] Keeps the ring of recent frames filled while streaming
+        :return: None
+        """
+        failures = 0
+        while self._streaming and self._grabber_pid == os.getpid():
+            requested_at = time.monotonic()
+            try:
+                img = self.cam.capture_array()
+            except Exception as e:
+                failures += 1
+                if failures >= GRAB_MAX_FAILURES:
+                    self.logger.error(f"Unable to grab {failures} frames in a row, stopping the stream: {e}")
+                    with self._frame_ready:
+                        self._grab_error = e
+                        self._frame_ready.notify_all()
+                    self.stop_streaming()
+                    return
+                self.logger.warning(f"Unable to grab frame ({failures}/{GRAB_MAX_FAILURES}): {e}")
+                # Backed off, so a camera that keeps failing does not spin a core and flood the log
+                time.sleep(min(GRAB_RETRY_DELAY * 2 ** (failures - 1), GRAB_RETRY_MAX_DELAY))
+                continue
+            failures = 0
+
+            # Scored here, off the capturing thread and outside the lock
+            frame = CameraFrame(img, requested_at, self.scorer.score(img))
+            with self._frame_ready:
+                self._frames.append(frame)
+                self._frame_count += 1
+                self._frame_ready.notify_all()
 
-        pil_img = Image.fromarray(img)
-        pil_img.save(image_stream, format="JPEG", quality=70)
+    def _wait_for_frame(self, predicate, timeout: float) -> None:
+        # Must hold self._frame_ready
+        if self._frame_ready.wait_for(lambda: predicate() or self._grab_error is not None, timeout) and predicate():
+            return
+        self._raise_grab_error()
+        raise TimeoutError(f"No frame from camera within {timeout}s")
 
-        return base64.b64encode(image_stream.getvalue()).decode("utf-8")
+    def _raise_grab_error(self) -> None:
+        if self._grab_error is not None:
+            raise RuntimeError("Camera stopped streaming after failing to grab frames") from self._grab_error
 
-    def capture_file(self) -> io.BytesIO:
+    def frame_after(self, timestamp: float, timeout: float = FRAME_TIMEOUT) -> CameraFrame:
         """
-        Method to capture an image, save it to a byte stream, and return the byte stream.
-        :return: BytesIO stream of the captured image
+        Method to get the first acceptable frame showing the scene after a moment, e.g. once the STM acknowledged a stop.
+        Returns straight from the ring if it was already grabbed, otherwise waits for it.
+        :param timestamp: `time.monotonic()` of the moment, from any process
+        :param timeout: Seconds to wait for the frame
+        :return: Earliest acceptable frame at or after the timestamp, the sharpest one if none were
+        """
+        return self.frames_after(timestamp, 1, timeout)[0]
+
+    def frames_after(self, timestamp: float, k: int, timeout: float = FRAME_TIMEOUT) -> List[CameraFrame]:
+        """
+        Method to get the first k acceptable frames after a moment, waiting for any that have not been grabbed yet.
+        Frames rejected by the scorer, e.g. blurred while the robot settles, are skipped for the next ones,
+        up to QUALITY_MAX_SKIP of them. Past that, the sharpest frames are used instead.
+        :param timestamp: `time.monotonic()` of the moment
+        :param k: Number of frames, at most FRAME_RING_SIZE
+        :param timeout: Seconds to wait for the frames
+        :return: k distinct frames, oldest first
+        """
+        assert 0 < k <= FRAME_RING_SIZE, f"Burst must be 1 to {FRAME_RING_SIZE} frames"
+
+        if not self._streaming:
+            return [self._grab_once() for _ in range(k)]
+
+        self.start_streaming()
+        # The ring only holds FRAME_RING_SIZE frames, so never wait for more candidates than it can keep
+        max_candidates = min(k + QUALITY_MAX_SKIP, FRAME_RING_SIZE)
+        candidates = lambda: [f for f in self._frames if f.timestamp >= timestamp]
+        accepted = lambda: [f for f in candidates() if self.scorer.acceptable(f.quality)]
+
+        with self._frame_ready:
+            self._frame_ready.wait_for(
+                lambda: len(accepted()) >= k or len(candidates()) >= max_candidates or self._grab_error is not None,
+                timeout,
+            )
+            frames, good = candidates(), accepted()
+
+        if len(good) >= k:
+            return good[:k]
+        if len(frames) < k:
+            self._raise_grab_error()
+            raise TimeoutError(f"No frame from camera within {timeout}s")
+
+        self.logger.warning(
+            f"{len(frames) - len(good)} of {len(frames)} frame(s) rejected, "
+            f"using the sharpest: {[f.quality for f in frames]}"
+        )
+        sharpest = sorted(frames, key=lambda f: f.sharpness, reverse=True)[:k]
+        return sorted(sharpest, key=lambda f: f.timestamp)
+
+    def sharpest(self, k: int = FRAME_RING_SIZE, timeout: float = FRAME_TIMEOUT) -> CameraFrame:
+        """
+        Method to get the sharpest of the most recent frames, e.g. to skip one blurred by vibration
+        :param k: Number of recent frames to pick from
+        :param timeout: Seconds to wait if no frame has been grabbed yet
+        :return: Frame with the highest sharpness
+        """
+        if not self._streaming:
+            return self._grab_once()
+
+        self.start_streaming()
+        with self._frame_ready:
+            self._wait_for_frame(lambda: len(self._frames) > 0, timeout)
+            candidates = list(self._frames)[-k:]
+        return max(candidates, key=lambda f: f.sharpness)
+
+    def _grab_once(self) -> CameraFrame:
+        with self.lock:
+            requested_at = time.monotonic()
+            self.cam.start()  # this is the crux, picam2 doesn't throw errors if it is not start()'ed
+            img = self.cam.capture_array()
+            self.cam.stop()
+        return CameraFrame(img, requested_at, self.scorer.score(img))
+
+    def peek_frame(self) -> Optional[CameraFrame]:
+        """
+        Method to get the most recent frame without waiting, and without starting the camera for it
+        :return: Latest frame, None if not streaming or nothing has been grabbed yet
+        """
+        if not self._streaming:
+            return None
+        with self._frame_ready:
+            return self._frames[-1] if self._frames else None
+
+    def latest_frame(self, fresh: bool = False, timeout: float = FRAME_TIMEOUT) -> np.ndarray:
+        """
+        Method to get the most recent acceptable frame, starting and stopping the camera for it if not streaming.
+        If the latest frame is rejected by the scorer, waits for the next ones.
+        :param fresh: Wait for the next frame instead of returning the latest, e.g. when retrying a capture
+        :param timeout: Seconds to wait if no frame has been grabbed yet
+        :return: Frame as a np array
+        """
+        if not self._streaming:
+            return self._grab_once().image
+
+        self.start_streaming()
+        with self._frame_ready:
+            latest = self._frames[-1].timestamp if self._frames and not fresh else time.monotonic()
+        return self.frames_after(latest, 1, timeout)[0].image
+
+    """
+    CAPTURE
+    """
+
+    def _select_frame(self, fresh: bool, after: Optional[float]) -> np.ndarray:
+        if after is not None:
+            return self.frame_after(after).image
+        return self.latest_frame(fresh)
+
+    def _prepare(self, img: np.ndarray, profile: CaptureProfile) -> np.ndarray:
+        prepared = apply_profile(img, profile)
+        self.logger.info(f"Image captured: {img.shape}, {profile.name} profile: {prepared.shape}")
+        return prepared
+
+    def capture(
+            self,
+            fresh: bool = False,
+            after: Optional[float] = None,
+            profile: Union[str, CaptureProfile, None] = None,
+    ) -> str:
         """
+        Method to read the latest image of the camera
+        :param fresh: Wait for the next frame instead of returning the latest
+        :param after: Optional `time.monotonic()`, to use the first frame after it instead
+        :param profile: Optional capture profile or its name, the full frame if not set
+        :return: Base64 image
+        """
+        self.logger.info("Capturing image!")
 
-        self.logger.info("Starting camera!")
+        profile = get_profile(profile)
+        img = self._prepare(self._select_frame(fresh, after), profile)
 
-        self.cam.start()  # Ensure the camera is started
+        with self.encoder.encode(img, profile.quality) as jpeg:
+            return base64.b64encode(jpeg.data).decode("ascii")
 
+    def capture_jpeg(
+            self,
+            fresh: bool = False,
+            after: Optional[float] = None,
+            profile: Union[str, CaptureProfile, None] = None,
+    ) -> bytes:
+        """
+        Method to capture an image as raw JPEG bytes, for binary frames to slaves
+        :param fresh: Wait for the next frame instead of returning the latest
+        :param after: Optional `time.monotonic()`, to use the first frame after it instead
+        :param profile: Optional capture profile or its name, the full frame if not set
+        :return: JPEG bytes
+        """
         self.logger.info("Capturing image!")
 
-        # Capture the image in numpy array format
-        img = self.cam.capture_array()
-        self.logger.info(f"Image captured: {img.shape}")
+        profile = get_profile(profile)
+        img = self._prepare(self._select_frame(fresh, after), profile)
 
-        self.cam.stop()
+        with self.encoder.encode(img, profile.quality) as jpeg:
+            return jpeg.tobytes()
+
+    def capture_burst(
+            self,
+            k: int,
+            after: Optional[float] = None,
+            profile: Union[str, CaptureProfile, None] = None,
+    ) -> List[bytes]:
+        """
+        Method to capture k consecutive frames as JPEG bytes, encoded in parallel, for voting on their labels
+        :param k: Number of frames, at most FRAME_RING_SIZE
+        :param after: Optional `time.monotonic()` the frames must follow, now if not set
+        :param profile: Optional capture profile or its name, the full frame if not set
+        :return: JPEG bytes per frame, oldest first
+        """
+        self.logger.info(f"Capturing burst of {k} images!")
 
-        # Create a BytesIO object to store the image in memory
-        image_stream = io.BytesIO()
+        profile = get_profile(profile)
+        frames = self.frames_after(after if after is not None else time.monotonic(), k)
+        futures = [self.encoder.submit(self._prepare(f.image, profile), profile.quality) for f in frames]
 
-        # Convert the numpy array to a PIL image
-        pil_img = Image.fromarray(img)
+        jpegs = []
+        for future in futures:
+            with future.result() as jpeg:
+                jpegs.append(jpeg.tobytes())
+        return jpegs
 
-        # Save the image to the BytesIO stream
-        pil_img.save(image_stream, format="JPEG", quality=70)
+    def capture_file(
+            self,
+            fresh: bool = False,
+            after: Optional[float] = None,
+            profile: Union[str, CaptureProfile, None] = None,
+    ) -> io.BytesIO:
+        """
+        Method to capture an image, save it to a byte stream, and return the byte stream.
+        :param fresh: Wait for the next frame instead of returning the latest
+        :param after: Optional `time.monotonic()`, to use the first frame after it instead
+        :param profile: Optional capture profile or its name, the full frame if not set
+        :return: BytesIO stream of the captured image, positioned at the start
+        """
+        self.logger.info("Capturing image!")
 
-        # Reset the stream position to the beginning so it can be read
-        image_stream.seek(0)
+        profile = get_profile(profile)
+        img = self._prepare(self._select_frame(fresh, after), profile)
 
-        # Return the image stream
-        return image_stream
+        # The stream outlives the pooled buffer, so this is the one copy
+        with self.encoder.encode(img, profile.quality) as jpeg:
+            return io.BytesIO(jpeg.data)
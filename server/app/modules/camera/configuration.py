@@ -0,0 +1,30 @@
+import os
+
+# CAMERA SETTINGS
+
+CAMERA_BACKEND = os.getenv("CAMERA_BACKEND", "picamera")  # picamera, or replay / synthetic to run without a Pi
+CAMERA_STREAMING = os.getenv("CAMERA_STREAMING", "1") == "1"  # keep the camera running and grabbing frames in the background
+FRAME_TIMEOUT = 2.0  # seconds to wait for the first frame after the camera starts
+FRAME_RING_SIZE = 8  # recent frames kept, to pick the first after a stop or the sharpest
+ENCODE_WORKERS = 2  # frames JPEG encoded in parallel, off the capturing thread
+JPEG_QUALITY = 70
+GRAB_RETRY_DELAY = 0.05  # seconds to back off after a failed grab, doubled on each failure in a row
+GRAB_RETRY_MAX_DELAY = 1.0  # longest back off between failed grabs
+GRAB_MAX_FAILURES = 10  # failed grabs in a row before streaming stops and waiting captures fail
+
+# FRAME QUALITY
+
+QUALITY_STEP = 8  # stride of the pixels scored, 8 scores 1/64 of a frame
+MIN_SHARPNESS = 50.0  # Laplacian variance below which a frame is treated as motion blurred
+MAX_CLIPPED = 0.05  # fraction of blown out pixels above which a frame is overexposed
+MIN_LUMINANCE = 40.0  # mean luma range of a usable exposure
+MAX_LUMINANCE = 220.0
+QUALITY_MAX_SKIP = 3  # rejected frames to wait past before settling for the sharpest
+
+# FAKE CAMERAS
+
+CAMERA_REPLAY_SOURCE = os.getenv("CAMERA_REPLAY_SOURCE", "")  # directory of images or a video file to replay
+CAMERA_REPLAY_MAX_FRAMES = int(os.getenv("CAMERA_REPLAY_MAX_FRAMES", "64"))  # frames loaded into memory at most
+CAMERA_FAKE_FPS = float(os.getenv("CAMERA_FAKE_FPS", "10"))  # frames exposed per second
+CAMERA_FAKE_LATENCY = float(os.getenv("CAMERA_FAKE_LATENCY", "0.05"))  # seconds from exposure until a frame is returned
+CAMERA_FAKE_RESOLUTION = os.getenv("CAMERA_FAKE_RESOLUTION", "4608x2592")  # synthetic frame size, WIDTHxHEIGHT
@@ -0,0 +1,218 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_GRAY, TJSAMP_420
+except ImportError:  # libjpeg-turbo bindings are optional
+    TurboJPEG = None
+
+
+class JpegBuffer:
+    """
+    Growable, reusable output buffer that PIL can save into like a file.
+    Only grows, so once warmed up it is never reallocated for frames of the same size.
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._size = 0
+
+    def reset(self) -> None:
+        self._size = 0
+
+    def write(self, data) -> int:
+        n = len(data)
+        end = self._size + n
+        if end > len(self._buffer):
+            self._buffer.extend(bytes(max(end - len(self._buffer), len(self._buffer) // 2)))
+        self._buffer[self._size:end] = data
+        self._size = end
+        return n
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self) -> None:
+        pass
+
+    def view(self) -> memoryview:
+        """
+        :return: View of the bytes written, invalidated once the buffer is reused
+        """
+        return memoryview(self._buffer)[:self._size]
+
+
+class JpegEncoder(ABC):
+    """
+    Encodes RGB frames to JPEG.
+    """
+
+    name: str
+
+    @abstractmethod
+    def encode(self, img: np.ndarray, quality: int, out: JpegBuffer) -> memoryview:
+        """
+        :param img: (H, W, 3) RGB or (H, W) grayscale frame
+        :param quality: JPEG quality, 1 - 100
+        :param out: Buffer to encode into, if the encoder supports it
+        :return: View of the encoded JPEG
+        """
+        raise NotImplementedError
+
+
+class PilJpegEncoder(JpegEncoder):
+    """
+    Encodes with Pillow, straight into the reusable buffer. Pillow releases the GIL while encoding.
+    """
+
+    name = "pil"
+
+    def encode(self, img: np.ndarray, quality: int, out: JpegBuffer) -> memoryview:
+        out.reset()
+        Image.fromarray(img).save(out, format="JPEG", quality=quality)
+        return out.view()
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """
+    Encodes with libjpeg-turbo through PyTurboJPEG, which returns its own bytes instead of using the buffer.
+    """
+
+    name = "turbojpeg"
+
+    def __init__(self):
+        if TurboJPEG is None:
+            raise ImportError("PyTurboJPEG is not installed")
+        self._turbo = TurboJPEG()
+
+    def encode(self, img: np.ndarray, quality: int, out: JpegBuffer) -> memoryview:
+        if img.ndim == 2:
+            encoded = self._turbo.encode(
+                img[..., None], quality=quality, pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY
+            )
+        else:
+            # 4:2:0 like Pillow's default
+            encoded = self._turbo.encode(img, quality=quality, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+        return memoryview(encoded)
+
+
+def default_encoder() -> JpegEncoder:
+    """
+    :return: libjpeg-turbo encoder if its bindings and library are available, Pillow otherwise
+    """
+    if TurboJPEG is not None:
+        try:
+            return TurboJpegEncoder()
+        except (ImportError, OSError, RuntimeError):
+            # Bindings installed without the shared library
+            pass
+    return PilJpegEncoder()
+
+
+class EncodedFrame:
+    """
+    An encoded JPEG backed by a pooled buffer. Release it, or use it as a context manager, once the bytes are sent.
+    """
+
+    def __init__(self, data: memoryview, buffer: JpegBuffer, pool: "EncodePipeline"):
+        self._data = data
+        self._buffer = buffer
+        self._pool = pool
+
+    @property
+    def data(self) -> memoryview:
+        if self._data is None:
+            raise ValueError("Encoded frame has been released")
+        return self._data
+
+    def tobytes(self) -> bytes:
+        return self.data.tobytes()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def release(self) -> None:
+        if self._data is None:
+            return
+        self._data.release()
+        self._data = None
+        self._pool._return_buffer(self._buffer)
+
+    def __enter__(self) -> "EncodedFrame":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class EncodePipeline:
+    """
+    Worker pool that encodes frames to JPEG off the caller's thread, into a pool of preallocated buffers.
+    """
+
+    logger = logging.getLogger("Encode Pipeline")
+
+    def __init__(
+            self,
+            encoder: Optional[JpegEncoder] = None,
+            workers: int = 2,
+            quality: int = 70,
+            buffer_size: int = 2 * 1024 * 1024,
+    ):
+        """
+        :param encoder: Encoder to use, libjpeg-turbo when available if not set
+        :param workers: Frames encoded in parallel
+        :param quality: JPEG quality, 1 - 100
+        :param buffer_size: Initial size of each output buffer, buffers grow if a frame does not fit
+        """
+        self.encoder = encoder or default_encoder()
+        self.quality = quality
+        self._buffer_size = buffer_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="JPEG-Encoder")
+
+        # Two per worker, so a worker can fill one while the last is still being sent
+        self._free: List[JpegBuffer] = [JpegBuffer(buffer_size) for _ in range(2 * workers)]
+        self._free_lock = threading.Lock()
+
+        self.logger.info(f"Encoding with {self.encoder.name} on {workers} worker(s)")
+
+    def _take_buffer(self) -> JpegBuffer:
+        with self._free_lock:
+            if self._free:
+                return self._free.pop()
+        # Callers are holding every buffer, rather than block them allocate another
+        self.logger.debug("Buffer pool exhausted, allocating another")
+        return JpegBuffer(self._buffer_size)
+
+    def _return_buffer(self, buffer: JpegBuffer) -> None:
+        with self._free_lock:
+            self._free.append(buffer)
+
+    def _encode(self, img: np.ndarray, quality: int) -> EncodedFrame:
+        buffer = self._take_buffer()
+        try:
+            return EncodedFrame(self.encoder.encode(img, quality, buffer), buffer, self)
+        except Exception:
+            self._return_buffer(buffer)
+            raise
+
+    def submit(self, img: np.ndarray, quality: Optional[int] = None) -> Future:
+        """
+        Queues a frame to be encoded
+        :param img: (H, W, 3) RGB or (H, W) grayscale frame, must not be modified until encoded
+        :param quality: Optional JPEG quality, the pipeline's default if not set
+        :return: Future completed with the `EncodedFrame`
+        """
+        return self._executor.submit(self._encode, img, quality or self.quality)
+
+    def encode(self, img: np.ndarray, quality: Optional[int] = None) -> EncodedFrame:
+        """
+        Encodes a frame on the pool and waits for it
+        """
+        return self.submit(img, quality).result()
@@ -0,0 +1,89 @@
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+from app_types.primatives.capture_profile import CaptureProfile, CaptureColour
+
+# Named profiles selectable per capture
+CAPTURE_PROFILES: Dict[str, CaptureProfile] = {
+    p.name: p for p in [
+        # Full still frame, as captured before profiles existed
+        CaptureProfile(name="full"),
+        # Obstacle straight ahead at close up distance only fills the middle of the frame
+        CaptureProfile(name="centre", roi=(0.2, 0.1, 0.8, 0.9), width=1280),
+        # Small and cheap, for previews and quick retries
+        CaptureProfile(name="preview", width=640, quality=60),
+        CaptureProfile(name="preview_gray", width=640, quality=60, colour=CaptureColour.Grayscale),
+    ]
+}
+
+DEFAULT_PROFILE = "full"
+
+
+def get_profile(profile: Union[str, CaptureProfile, None] = None) -> CaptureProfile:
+    """
+    :param profile: Profile, or the name of one in CAPTURE_PROFILES, the default profile if not set
+    :return: Capture profile
+    """
+    if isinstance(profile, CaptureProfile):
+        return profile
+    name = profile or DEFAULT_PROFILE
+    if name not in CAPTURE_PROFILES:
+        raise KeyError(f"Unknown capture profile {name}, expected one of {list(CAPTURE_PROFILES)}")
+    return CAPTURE_PROFILES[name]
+
+
+def _output_size(height: int, width: int, profile: CaptureProfile) -> Tuple[int, int]:
+    # Frames are only ever shrunk, upscaling adds bytes without detail
+    if profile.width and profile.height:
+        return min(profile.height, height), min(profile.width, width)
+    if profile.width and profile.width < width:
+        return max(1, round(height * profile.width / width)), profile.width
+    if profile.height and profile.height < height:
+        return profile.height, max(1, round(width * profile.height / height))
+    return height, width
+
+
+def apply_profile(img: np.ndarray, profile: Union[str, CaptureProfile, None] = None) -> np.ndarray:
+    """
+    Crops, downscales and converts a frame for a profile, without leaving NumPy.
+    Downscaling box filters by the largest whole factor, then samples the nearest pixel to reach the exact size.
+    :param img: (H, W, 3) RGB frame
+    :param profile: Profile or its name
+    :return: Contiguous (h, w, 3) RGB or (h, w) grayscale uint8 frame, the frame itself if nothing changes
+    """
+    profile = get_profile(profile)
+
+    # Crop, a view of the frame
+    h, w = img.shape[:2]
+    x0, y0, x1, y1 = profile.roi
+    img = img[round(y0 * h):round(y1 * h), round(x0 * w):round(x1 * w)]
+
+    h, w = img.shape[:2]
+    out_h, out_w = _output_size(h, w, profile)
+
+    # Box filter by a whole factor; 16 bit sums do not overflow for factors up to 16
+    factor = min(h // out_h, w // out_w, 16)
+    if factor >= 2:
+        h, w = h // factor, w // factor
+        # Separable: sum whole rows of each box first, as they are contiguous, then the columns
+        rows = np.zeros((h, w * factor) + img.shape[2:], dtype=np.uint16)
+        for dy in range(factor):
+            rows += img[dy:h * factor:factor, :w * factor]
+        total = np.zeros((h, w) + img.shape[2:], dtype=np.uint16)
+        for dx in range(factor):
+            total += rows[:, dx::factor]
+        img = (total // (factor * factor)).astype(np.uint8)
+
+    # Nearest neighbour for the remaining, less than 2x, scale
+    if (h, w) != (out_h, out_w):
+        rows = (np.arange(out_h) * h // out_h)[:, None]
+        cols = np.arange(out_w) * w // out_w
+        img = img[rows, cols]
+
+    if profile.colour == CaptureColour.Grayscale and img.ndim == 3:
+        # ITU-R BT.601 luma in fixed point
+        weights = np.array([77, 150, 29], dtype=np.uint16)
+        img = ((img[..., :3].astype(np.uint16) * weights).sum(axis=2, dtype=np.uint16) >> 8).astype(np.uint8)
+
+    return np.ascontiguousarray(img)
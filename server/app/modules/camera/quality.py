@@ -0,0 +1,100 @@
+import numpy as np
+
+
+class FrameQuality:
+    """
+    Quality of a frame, measured on a downsampled luma copy.
+    """
+
+    __slots__ = ("sharpness", "clipped", "luminance")
+
+    def __init__(self, sharpness: float, clipped: float, luminance: float):
+        """
+        :param sharpness: Variance of the Laplacian, higher is sharper; motion blur drives it towards 0
+        :param clipped: Fraction of pixels with blown out highlights, in [0, 1]
+        :param luminance: Mean luma, in [0, 255]
+        """
+        self.sharpness = sharpness
+        self.clipped = clipped
+        self.luminance = luminance
+
+    def __repr__(self) -> str:
+        return (
+            f"FrameQuality(sharpness={self.sharpness:.1f}, clipped={self.clipped:.3f}, "
+            f"luminance={self.luminance:.1f})"
+        )
+
+
+class FrameScorer:
+    """
+    Vectorised scorer that decides if a frame is good enough to send for recognition.
+    Only every `step`th pixel is scored, so the cost is a fraction of a full frame pass.
+    """
+
+    CLIP_LEVEL = 250  # luma at or above this counts as clipped
+
+    def __init__(
+            self,
+            step: int = 8,
+            min_sharpness: float = 50.0,
+            max_clipped: float = 0.05,
+            min_luminance: float = 40.0,
+            max_luminance: float = 220.0,
+    ):
+        """
+        :param step: Stride of the pixels scored, 8 scores 1/64 of the frame
+        :param min_sharpness: Laplacian variance below which a frame is treated as blurred
+        :param max_clipped: Fraction of clipped pixels above which a frame is overexposed
+        :param min_luminance: Mean luma below which a frame is underexposed
+        :param max_luminance: Mean luma above which a frame is overexposed
+        """
+        self.step = step
+        self.min_sharpness = min_sharpness
+        self.max_clipped = max_clipped
+        self.min_luminance = min_luminance
+        self.max_luminance = max_luminance
+
+    @staticmethod
+    def _luma(view: np.ndarray) -> np.ndarray:
+        if view.ndim == 2:
+            return view.astype(np.int32)
+        # ITU-R BT.601 luma in fixed point
+        return (
+            view[..., 0].astype(np.int32) * 77
+            + view[..., 1].astype(np.int32) * 150
+            + view[..., 2].astype(np.int32) * 29
+        ) >> 8
+
+    def score(self, img: np.ndarray) -> FrameQuality:
+        """
+        :param img: (H, W, 3) RGB or (H, W) grayscale uint8 frame
+        :return: Quality of the frame
+        """
+        h, w = img.shape[:2]
+        s = self.step
+
+        # Laplacian at full resolution, so fine motion blur still shows, but only at every step'th pixel.
+        # All five are strided views of the same shape, so no full size copy is made.
+        # Green carries most of the luma and all of the detail on a Bayer sensor, so it stands in for luma here.
+        g = img[..., 1] if img.ndim == 3 else img
+        laplacian = (
+            g[0:h - 2:s, 1:w - 1:s].astype(np.int16)
+            + g[2:h:s, 1:w - 1:s]
+            + g[1:h - 1:s, 0:w - 2:s]
+            + g[1:h - 1:s, 2:w:s]
+            - 4 * g[1:h - 1:s, 1:w - 1:s].astype(np.int16)
+        )
+        luma = self._luma(img[1:h - 1:s, 1:w - 1:s])
+
+        return FrameQuality(
+            sharpness=float(laplacian.var()),
+            clipped=float(np.count_nonzero(luma >= self.CLIP_LEVEL)) / luma.size,
+            luminance=float(luma.mean()),
+        )
+
+    def acceptable(self, quality: FrameQuality) -> bool:
+        return (
+            quality.sharpness >= self.min_sharpness
+            and quality.clipped <= self.max_clipped
+            and self.min_luminance <= quality.luminance <= self.max_luminance
+        )
@@ -1,6 +1,6 @@
 import logging
 from collections.abc import Callable
-from typing import Literal, List
+from typing import Literal, List, Optional
 import time
 import math
 
@@ -12,6 +12,7 @@ from app_types.primatives.command import (
     MoveInstruction,
     TurnInstruction,
     AlgoCommandResponse,
+    Command,
 )
 from app_types.primatives.cv import CvResponse
 from app_types.primatives.obstacle_label import ObstacleLabel
@@ -20,6 +21,7 @@ from utils.instructions import Instructions
 from modules.camera.camera import Camera
 
 from modules.web_server.connection_manager import ConnectionManager
+from modules.web_server.quorum import QuorumPolicy
 from utils.metaclass.singleton import Singleton
 
 
@@ -103,14 +105,32 @@ class GameState(metaclass=Singleton):
     """
 
     def capture_and_process_image(
-        self, callback: Callable[[CvResponse], None] = lambda x: print(x)
+        self,
+        callback: Callable[[CvResponse], None] = lambda x: print(x),
+        profile: Optional[str] = None,
+        quorum: Optional[QuorumPolicy] = None,
     ) -> None:
+        """
+        :param callback: callback function that takes `CvResponse` as the only arg, and returns None.
+        :param profile: Optional name of the capture profile, the full frame if not set
+        :param quorum: Optional policy to have several slaves agree on the label, see `QuorumPolicy`
+        """
         self.logger.info("Capturing image!")
-        image_b64 = Camera().capture()
-        self.logger.info("Captured image as b64!")
-        self.connection_manager.slave_request_cv(image_b64, callback)
+        image = Camera().capture_jpeg(profile=profile)
+        self.logger.info("Captured image as JPEG!")
+        self.connection_manager.slave_request_cv(image, callback, quorum=quorum)
         return
 
+    def capture_label(self, profile: Optional[str] = None, quorum: Optional[QuorumPolicy] = None) -> CvResponse:
+        """
+        Blocking version of `capture_and_process_image`, must not be called from the server's event loop
+        :param profile: Optional name of the capture profile, the full frame if not set
+        :param quorum: Optional policy to have several slaves agree on the label, see `QuorumPolicy`
+        :return: Recognised label, UNKNOWN if no slave answered in time
+        """
+        image = Camera().capture_jpeg(profile=profile)
+        return self.connection_manager.request_cv_blocking(image, quorum=quorum)
+
     def _update_obstacle_label_after_cv(
         self, obstacle_id: int, cv_response: CvResponse
     ) -> None:
@@ -138,9 +158,9 @@ class GameState(metaclass=Singleton):
         #     AndroidMessage("TARGET", f"{obstacle_index},{cv_response.label.value}")
         # )
 
-    def capture_and_update_label(self, obstacle_id: int) -> None:
+    def capture_and_update_label(self, obstacle_id: int, profile: Optional[str] = None) -> None:
         self.capture_and_process_image(
-            lambda res: self._update_obstacle_label_after_cv(obstacle_id, res)
+            lambda res: self._update_obstacle_label_after_cv(obstacle_id, res), profile
         )
 
     """
@@ -167,6 +187,19 @@ class GameState(metaclass=Singleton):
         )
         return self.instruction
 
+    def plan(self, *obstacles: Obstacle) -> List[Command]:
+        """
+        Blocking version of `set_obstacles`, must not be called from the server's event loop
+        :param obstacles: List[Obstacle]
+        :return: Commands planned by the algo server, also added to the instructions
+        :raises asyncio.TimeoutError: If no slave answered in time
+        """
+        self.obstacles = list(obstacles)
+        self.logger.info("Requesting for commands from algo server!")
+        response = self.connection_manager.request_algo_blocking(self.obstacles)
+        self._algo_response_callback(response)
+        return response.commands
+
     """
     Methods related to task 2.
     """
@@ -1,5 +1,6 @@
-__all__ = ["Android", "Link", "STM"]
+__all__ = ["Android", "Link", "STM", "AsyncSTM"]
 
 from .link import Link
 from .stm32 import STM
+from .stm_async import AsyncSTM
 from .android import Android
@@ -7,7 +7,10 @@ import time
 from pathlib import Path
 from typing import Optional, Union
 
-import bluetooth
+try:
+    import bluetooth
+except ImportError:  # PyBluez only builds where libbluetooth is installed
+    bluetooth = None
 
 # from modules.gamestate import GameState
 from modules.serial import STM
@@ -89,6 +92,9 @@ class Android(metaclass=Singleton):
         """
         Connect to Andriod by Bluetooth
         """
+        if bluetooth is None:
+            raise ImportError("PyBluez is not installed")
+
         print("Bluetooth Connection Started")
         try:
             # Make RPi discoverable by the Android tablet to complete pairing
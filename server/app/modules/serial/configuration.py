@@ -1,3 +1,5 @@
+import os
+
 # STM32 BOARD SERIAL CONNECTION
 # ~ SERIAL_PORT = "ABC"  # stm32
 # ~ BAUD_RATE = 0
@@ -8,8 +10,19 @@
 
 # ROBOT SETTINGS
 
-SERIAL_PORT = "/dev/ttyUSB0"  # stm32
+SERIAL_PORT = os.getenv("STM_SERIAL_PORT", "/dev/ttyUSB0")  # stm32, overridden to point at the simulator
 BAUD_RATE = 115200
+READ_TIMEOUT = 0.1  # seconds a blocking read waits before the reader re-checks the link
+RECEIVE_QUEUE_SIZE = 64  # max replies buffered before the oldest is dropped
+STM_COMMAND_WINDOW = 16  # commands allowed in flight, the firmware queues at least 16 back-to-back commands
+STM_PEEPHOLE_OPTIMIZER = True  # fuse and drop redundant commands in programs before they are sent
+STM_COLLAPSE_WIGGLES = False  # let the optimizer merge runs of wiggles, off as tasks repeat them on purpose
+STM_TELEMETRY_PERIOD_MS = 0  # ms between streamed sensor samples, 0 keeps using measure toggles
+TELEMETRY_BUFFER_SIZE = 4096  # streamed samples kept in memory
+STM_ACK_TIMEOUT = 3.0  # seconds allowed per command for its acknowledgement, on top of the time it moves for
+STM_ACK_TIMEOUT_PER_CM = 0.1  # seconds allowed per cm of a straight or move, slow enough for the lowest speeds
+STM_ACK_TIMEOUT_PER_DEGREE = 0.05  # seconds allowed per degree of a turn
+STM_ACK_TIMEOUT_OPEN_ENDED = 30.0  # seconds allowed for moves that drive until a sensor reading, e.g. side hugs
 
 # API DETAILS
 #API_IP = '192.168.7.16'  # IP address of laptop
@@ -1,11 +1,29 @@
+import itertools
 import logging
 import math
-from datetime import datetime, timedelta
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 from utils.metaclass.singleton import Singleton
-from .configuration import BAUD_RATE, SERIAL_PORT
+from .configuration import (
+    BAUD_RATE,
+    SERIAL_PORT,
+    READ_TIMEOUT,
+    RECEIVE_QUEUE_SIZE,
+    STM_COMMAND_WINDOW,
+    STM_PEEPHOLE_OPTIMIZER,
+    STM_COLLAPSE_WIGGLES,
+    TELEMETRY_BUFFER_SIZE,
+    STM_ACK_TIMEOUT,
+    STM_ACK_TIMEOUT_PER_CM,
+    STM_ACK_TIMEOUT_PER_DEGREE,
+    STM_ACK_TIMEOUT_OPEN_ENDED,
+)
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Deque, Callable
 
 # from modules.gamestate import GameState
 import time
@@ -14,7 +32,84 @@ import time
 
 import serial
 
-from .stm_commands import StmCommand
+from .stm_commands import (
+    StmCommand,
+    StmProgram,
+    StmMove,
+    StmStraight,
+    StmTurn,
+    StmMoveToDistance,
+    StmSideHug,
+    StmMoveUntilSideObstacle,
+)
+from .stm_metrics import StmLinkMetrics
+from .stm_optimizer import StmPeepholeOptimizer
+from .stm_replies import (
+    StmFrameDecoder,
+    StmReply,
+    StmAck,
+    StmDistance,
+    StmStop,
+    StmMarker,
+    StmUnknownReply,
+    StmTelemetrySample,
+)
+from .telemetry import TelemetryBuffer
+
+
+def ack_timeout(*stm_commands: StmCommand) -> float:
+    """
+    Generous bound on how long the STM takes to acknowledge commands run back to back,
+    so a lost acknowledgement fails the wait instead of hanging it
+    :param stm_commands: Commands, in order
+    :return: Seconds
+    """
+    total = 0.0
+    for c in stm_commands:
+        total += STM_ACK_TIMEOUT
+        if isinstance(c, (StmMoveToDistance, StmSideHug, StmMoveUntilSideObstacle)):
+            total += STM_ACK_TIMEOUT_OPEN_ENDED
+        elif isinstance(c, StmTurn):
+            total += abs(c.angle) * STM_ACK_TIMEOUT_PER_DEGREE
+        elif isinstance(c, (StmStraight, StmMove)):
+            total += abs(c.distance) * STM_ACK_TIMEOUT_PER_CM
+            total += abs(getattr(c, "angle", 0)) * STM_ACK_TIMEOUT_PER_DEGREE
+    return total
+
+
+class StmReplyMismatch(Exception):
+    """
+    Raised for an in-flight command whose reply never came, found when a later command's reply arrived first
+    """
+
+
+class StmInFlightCommand:
+    """
+    A command that has been written to the STM and is waiting for its reply.
+    """
+
+    def __init__(self, seq: int, command: StmCommand):
+        """
+        :param seq: Sequence id, increasing in the order commands are written
+        :param command: Command that was sent
+        """
+        self.seq = seq
+        self.command = command
+        self.flag = command.flag
+        self.future: Future = Future()
+        self.sent_at: float = 0.0  # Monotonic time the command was written
+
+    def matches(self, reply: StmReply) -> bool:
+        """
+        Checks if the reply is the one this command expects
+        :param reply: Reply received from the STM
+        :return: True if the reply type (and flag, for acks) matches
+        """
+        if self.flag == "D":
+            return isinstance(reply, StmDistance)
+        if self.flag == "S":
+            return isinstance(reply, StmStop)
+        return isinstance(reply, StmAck) and reply.flag == self.flag
 
 
 class STM(metaclass=Singleton):
@@ -23,81 +118,395 @@ class STM(metaclass=Singleton):
         Constructor for STMLink.
         """
         self.serial_link = None
-        self.received = []
+        self.received: queue.Queue = queue.Queue(maxsize=RECEIVE_QUEUE_SIZE)
         self.logger = logging.getLogger("STM")
+        self.optimizer = StmPeepholeOptimizer(enabled=STM_PEEPHOLE_OPTIMIZER, collapse_wiggles=STM_COLLAPSE_WIGGLES)
+        self.telemetry = TelemetryBuffer(TELEMETRY_BUFFER_SIZE)
+        self.metrics = StmLinkMetrics()
+
+        self._reader: Optional[threading.Thread] = None
+        self._reader_pid: Optional[int] = None
+        self._reader_lock = threading.Lock()
+
+        # Credit based send window, the STM replies to commands in the order they are written
+        self._window = threading.BoundedSemaphore(STM_COMMAND_WINDOW)
+        self._in_flight: Deque[StmInFlightCommand] = deque()
+        self._in_flight_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._last_ack_at = 0.0
+        # Replies still owed to raw frames written by send(), they arrive before any later command's
+        self._raw_outstanding = 0
+
+        # Called on the reader thread with every reply, must not block
+        self._listeners: List[Callable[[StmReply], None]] = []
+
+    def connect(self, port: Optional[str] = None):
+        """Connect to STM32 using serial UART connection, given the serial port and the baud rate
 
-    def connect(self):
-        """Connect to STM32 using serial UART connection, given the serial port and the baud rate"""
-        self.serial_link = serial.Serial(SERIAL_PORT, BAUD_RATE)
+        Args:
+            port: Optional serial port to use instead of SERIAL_PORT, e.g. the simulator's pty
+        """
+        if self.serial_link is not None:
+            self.logger.info("Already connected to STM32")
+            return
+        # Reads block for at most READ_TIMEOUT, so the reader thread sleeps in the kernel instead of polling
+        self.serial_link = serial.Serial(port or SERIAL_PORT, BAUD_RATE, timeout=READ_TIMEOUT)
         print("Connected to STM32")
 
     def disconnect(self):
         """Disconnect from STM32 by closing the serial link that was opened during connect()"""
         self.serial_link.close()
         self.serial_link = None
+        self._reset_window(ConnectionError("Disconnected from STM32"))
+        self.logger.info(self.metrics.report())
         print("Disconnected from STM32")
 
-    def send(self, message: str) -> None:
-        """Send a message to STM32, utf-8 encoded
+    """
+    READER
+    """
+
+    def _ensure_reader(self) -> None:
+        """
+        Starts the reader thread for the current process if it is not already running.
+        The reader is started lazily, as Task1RPI forks its child processes after connect(),
+        and threads do not survive a fork.
+        :return: None
+        """
+        with self._reader_lock:
+            if (
+                self._reader is not None
+                and self._reader.is_alive()
+                and self._reader_pid == os.getpid()
+            ):
+                return
+
+            if self._reader_pid != os.getpid():
+                # Replies queued and commands sent by the parent process are not ours to consume
+                self.received = queue.Queue(maxsize=RECEIVE_QUEUE_SIZE)
+                self._in_flight_lock = threading.Lock()
+                self._reset_window()
+                self.metrics = StmLinkMetrics()
+
+            self._reader_pid = os.getpid()
+            self._reader = threading.Thread(
+                target=self._read_loop, name="STM-Reader", daemon=True
+            )
+            self._reader.start()
+
+    def _read_loop(self) -> None:
+        """
+        [Reader Thread] Blocks on the serial port, decodes complete frames and pushes them into the receive queue.
+        Exits once the link it was started with is closed or replaced.
+        :return: None
+        """
+        link = self.serial_link
+        decoder = StmFrameDecoder()
+        while link is not None and self.serial_link is link:
+            try:
+                chunk = link.read(max(1, link.in_waiting))
+            except (OSError, TypeError) as e:
+                # pyserial raises TypeError when the port is closed under a pending read
+                self.logger.warning(f"STM reader stopped: {e}")
+                return
+
+            if not chunk:
+                continue
+            self.metrics.record_read(len(chunk))
+
+            for reply in decoder.feed(chunk):
+                if isinstance(reply, StmTelemetrySample):
+                    self.telemetry.append(reply.received_at, reply.front, reply.left, reply.right, reply.odometer)
+                    continue
+
+                self.logger.info(f"Received: {reply.raw}")
+                self._notify_listeners(reply)
+                if not self._complete_in_flight(reply):
+                    self._push_received(reply)
+
+    def add_listener(self, listener: Callable[[StmReply], None]) -> None:
+        """
+        Registers a callback for every reply received, including those that complete an in-flight command.
+        :param listener: Called on the reader thread, so it must hand the reply off without blocking
+        :return: None
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[StmReply], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify_listeners(self, reply: StmReply) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(reply)
+            except Exception as e:
+                self.logger.warning(f"Removing failed reply listener: {e}")
+                self.remove_listener(listener)
+
+    def _push_received(self, reply: StmReply) -> None:
+        """
+        Adds a reply to the bounded receive queue, dropping the oldest entry if nobody is consuming.
+        :param reply: Reply decoded from the STM
+        :return: None
+        """
+        while True:
+            try:
+                self.received.put_nowait(reply)
+                return
+            except queue.Full:
+                try:
+                    dropped = self.received.get_nowait()
+                    self.logger.warning(f"Receive queue full, dropping: {dropped.raw}")
+                except queue.Empty:
+                    pass
+
+    """
+    SEND WINDOW
+    """
+
+    def _complete_in_flight(self, reply: StmReply) -> bool:
+        """
+        Completes the oldest in-flight command with the reply, returning its window credit.
+        If the reply is for a later command, the replies to the ones before it were lost,
+        so they are failed with `StmReplyMismatch` and the window resyncs on the command that matches.
+        A reply matching no in-flight command is left for `wait_reply`.
+        :param reply: Reply received from the STM
+        :return: True if the reply was consumed by an in-flight command
+        """
+        if isinstance(reply, (StmMarker, StmUnknownReply)):
+            return False
+
+        with self._in_flight_lock:
+            if self._raw_outstanding > 0:
+                self._raw_outstanding -= 1
+                return False
+            if not self._in_flight:
+                return False
+            index = next((i for i, p in enumerate(self._in_flight) if p.matches(reply)), None)
+            if index is None:
+                self.logger.warning(f"Reply {reply.raw} matches no in-flight command, passing it on")
+                return False
+            skipped = [self._in_flight.popleft() for _ in range(index)]
+            pending = self._in_flight.popleft()
+
+        for lost in skipped:
+            self.logger.warning(f"No reply to command #{lost.seq} ({lost.flag}) before {reply.raw}, resyncing")
+            self._window.release()
+            lost.future.set_exception(
+                StmReplyMismatch(f"Reply {reply.raw} is for command #{pending.seq}, not #{lost.seq} ({lost.flag})")
+            )
+
+        # The STM runs one command at a time, so it starts on this one once it is written and the last one is done
+        started_at = max(pending.sent_at, self._last_ack_at)
+        self._last_ack_at = reply.received_at
+        self.metrics.record_command(
+            pending.flag,
+            sent_at=pending.sent_at,
+            acked_at=reply.received_at,
+            started_at=started_at,
+            bytes_written=len(pending.command.to_bytes()),
+            bytes_read=len(reply.raw) + 1,
+        )
+
+        self._window.release()
+        pending.future.set_result(reply)
+        return True
+
+    def _reset_window(self, error: Optional[Exception] = None) -> None:
+        """
+        Drops all in-flight commands and restores the full send window.
+        :param error: Exception to fail the pending futures with, left pending if not set
+        :return: None
+        """
+        with self._in_flight_lock:
+            dropped = list(self._in_flight)
+            self._in_flight.clear()
+            self._raw_outstanding = 0
+
+        for pending in dropped:
+            self._window.release()
+            if error is not None:
+                pending.future.set_exception(error)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        :return: Number of commands sent that have not been acknowledged yet
+        """
+        return len(self._in_flight)
+
+    def submit(self, *stm_commands: StmCommand, timeout: Optional[float] = None) -> List[Future]:
+        """
+        Writes commands to the STM as soon as the send window has credit, without waiting for their replies.
+        All commands that have credit are framed together and written to the link in a single write.
+        :param stm_commands: Commands to be sent to the STM, in order
+        :param timeout: Optional total seconds to wait for window credit, commands not sent by then are dropped
+        :return: One future per command sent, completed with its `StmReply`
+        """
+        self._ensure_reader()
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        futures: List[Future] = []
+        i = 0
+        while i < len(stm_commands):
+            # Block for one credit, then take whatever else is free so the batch goes out as one frame
+            wait = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            if not self._window.acquire(timeout=wait):
+                self.logger.warning(
+                    f"Window full for {timeout}s, dropping {len(stm_commands) - i} unsent command(s)"
+                )
+                break
+
+            batch = [stm_commands[i]]
+            i += 1
+            while i < len(stm_commands) and self._window.acquire(blocking=False):
+                batch.append(stm_commands[i])
+                i += 1
+
+            pending = [StmInFlightCommand(next(self._seq), c) for c in batch]
+            sent_at = time.monotonic()
+            for p in pending:
+                p.sent_at = sent_at
+            with self._in_flight_lock:
+                self._in_flight.extend(pending)
+            self._write(b"".join(c.to_bytes() for c in batch))
+            futures.extend(p.future for p in pending)
+
+        return futures
+
+    """
+    SENDING
+    """
+
+    def _write(self, data: bytes) -> None:
+        """Write already encoded frames to STM32
 
         Args:
-            message (str): message to send
+            data (bytes): one or more newline terminated frames
         """
-        self.serial_link.write(bytes(message, "utf-8"))
-        self.logger.info(f"Sent to STM32: {str(message).rstrip()}")
+        self.serial_link.write(data)
+        self.metrics.record_write(len(data))
+        self.logger.info(f"Sent to STM32: {' '.join(str(data, 'utf-8').split())}")
 
-    def send_stm_command(self, *stm_commands:StmCommand) -> None:
+    def send(self, message: str) -> bool:
+        """Send a raw message to STM32, utf-8 encoded, outside the send window.
+        Its reply is left for wait_reply(). Refused while window commands are in flight,
+        as the reply would then arrive among theirs and could not be told apart.
+
+        Args:
+            message (str): message to send
+
+        Returns:
+            bool: False if the message was refused
+        """
+        # No reader is started here, a process that only writes, like Task1's command follower,
+        # would otherwise read the port too and steal replies from the process consuming them
+        with self._in_flight_lock:
+            if self._in_flight:
+                self.logger.warning(
+                    f"Refusing raw write of {message.strip()}, {len(self._in_flight)} command(s) in flight"
+                )
+                return False
+            # Markers are not replied to
+            if not message.startswith("M"):
+                self._raw_outstanding += message.count("\n")
+        self._write(bytes(message, "utf-8"))
+        return True
+
+    def send_stm_command(self, *stm_commands:StmCommand) -> List[Future]:
         """
         Function to take StmCommand super classes
         :param stm_commands: Commands to be sent to the STM
-        :return:
+        :return: Futures completed with the reply to each command
         """
-        for c in stm_commands:
-            self.send(c.to_serial())
+        return self.submit(*stm_commands)
 
-    def send_stm_command_and_wait(self, *stm_commands:StmCommand) -> None:
+    def send_stm_command_and_wait(
+            self, *stm_commands:StmCommand, timeout: Optional[float] = None
+    ) -> List[Optional[StmReply]]:
         """
-        A more "sync" version of send_stm_command
+        A more "sync" version of send_stm_command.
+        Up to STM_COMMAND_WINDOW commands are kept in flight, instead of waiting a round trip for each.
         :param stm_commands:
-        :return:
+        :param timeout: Optional total seconds to wait for all acknowledgements, `ack_timeout` of the commands if not set
+        :return: Reply to each command, None for those not acknowledged before the timeout
         """
+        if timeout is None:
+            timeout = ack_timeout(*stm_commands)
+        deadline = time.monotonic() + timeout
+        remaining = lambda: max(deadline - time.monotonic(), 0)
 
-        for c in stm_commands:
-            self.send(c.to_serial())
-            self.wait_receive()
+        futures = self.submit(*stm_commands, timeout=remaining())
+
+        replies: List[Optional[StmReply]] = [None] * len(stm_commands)
+        for i, (c, f) in enumerate(zip(stm_commands, futures)):
+            try:
+                replies[i] = f.result(timeout=remaining())
+            except FutureTimeoutError:
+                self.logger.warning(f"Timed out waiting for acknowledgement of {c.to_serial().strip()}")
+                break
+            except StmReplyMismatch as e:
+                self.logger.warning(f"Lost acknowledgement of {c.to_serial().strip()}: {e}")
 
-    def send_cmd(self, flag, speed, angle, val):
-        """Send command and wait for acknowledge."""
+        return replies
+
+    def execute(self, program: StmProgram, timeout: Optional[float] = None) -> List[Optional[StmReply]]:
+        """
+        Runs a whole program on the STM, written to the link in as few writes as the send window allows.
+        The program is passed through the peephole optimizer first, so there may be fewer replies than commands.
+        :param program: Commands to run, in order
+        :param timeout: Optional total seconds to wait for all acknowledgements, `ack_timeout` of the commands if not set
+        :return: Reply to each command sent, None for those not acknowledged before the timeout
+        """
+        commands = self.optimizer.optimize(program.commands)
+        self.logger.info(f"Executing program of {len(commands)} command(s)")
+        return self.send_stm_command_and_wait(*commands, timeout=timeout)
+
+    def send_cmd(self, flag, speed, angle, val) -> bool:
+        """Send command, its acknowledgement is left for wait_reply().
+
+        Returns:
+            bool: False if it was refused, see send()
+        """
         cmd = flag
         if flag not in ["S", "D", "M"]:
             cmd += f"{speed}|{round(angle, 2)}|{round(val, 2)}"
         cmd += "\n"
-        self.send(cmd)
+        return self.send(cmd)
 
-    def wait_receive(self, timeout:Optional[int] = None) -> Optional[str]:
-        """Receive a message from STM32, utf-8 decoded
+    def wait_reply(self, timeout:Optional[float] = None) -> Optional[StmReply]:
+        """Receive the next complete reply frame from STM32
 
         Args:
-            timeout: Optional[int]>0: Seconds before timeout
+            timeout: Optional[float]>0: Seconds before timeout
 
         Returns:
-            Optional[str]: message received
+            Optional[StmReply]: typed reply received, None on timeout
         """
 
         if timeout:
             assert timeout>=0, "Timeout >= 0!"
-        else:
-            timeout = 0
 
-        cut_off = datetime.now() + timedelta(seconds=timeout)
+        self._ensure_reader()
 
+        try:
+            # Queue.get waits on a monotonic deadline, and blocks indefinitely without a timeout
+            return self.received.get(timeout=timeout or None)
+        except queue.Empty:
+            return None
 
+    def wait_receive(self, timeout:Optional[float] = None) -> Optional[str]:
+        """Receive a message from STM32, utf-8 decoded
+
+        Args:
+            timeout: Optional[float]>0: Seconds before timeout
 
-        while True and ((timeout and datetime.now()<cut_off) or not timeout):
-            if self.serial_link.in_waiting > 0:
-                payload = str(self.serial_link.read_all(), "utf-8")
-                self.logger.info(f"Received: {payload.strip()}")
-                return payload
+        Returns:
+            Optional[str]: a single frame received, without its terminator. None on timeout
+        """
+        reply = self.wait_reply(timeout)
+        return reply.raw if reply is not None else None
 
     def run_task_1(self):
         """Run the STM32 module."""
@@ -107,26 +516,23 @@ class STM(metaclass=Singleton):
         while True:
             message_rcv = None
             try:
-                message_rcv = self.wait_receive()
+                reply = self.wait_reply()
+                message_rcv = reply.raw
                 self.gamestate
                 print("Message received from STM: ", message_rcv)
-                if "fS" in message_rcv:
+                if isinstance(reply, StmStop):
                     self.gamestate.set_stm_stop(
                         True
                     )  # Finished stopping, can start delay to recognise image
                     print("Setting STM Stopped to true")
-                if message_rcv[0] == "f":
+                if isinstance(reply, StmAck):
                     # Finished command, send to android
-                    message_split = message_rcv[1:].split(
-                        "|"
-                    )  # Ignore the 'f' at the start
-                    cmd_speed = message_split[0]
-                    turning_degree = message_split[1]
-                    distance = message_split[2].strip()
+                    turning_degree = reply.angle
+                    distance = f"{reply.distance:g}"
 
-                    cmd = cmd_speed[0]  # Command (t/T)
+                    cmd = reply.flag  # Command (t/T)
 
-                    if turning_degree == f"-{self.drive_angle}":
+                    if turning_degree == -self.drive_angle:
                         # Turn left
                         if cmd == "t":
                             # Backward left
@@ -134,7 +540,7 @@ class STM(metaclass=Singleton):
                         elif cmd == "T":
                             # Forward left
                             msg = "TURN,FORWARD_LEFT,0"
-                    elif turning_degree == f"{self.drive_angle}":
+                    elif turning_degree == self.drive_angle:
                         # Turn right
                         if cmd == "t":
                             # Backward right
@@ -142,7 +548,7 @@ class STM(metaclass=Singleton):
                         elif cmd == "T":
                             # Forward right
                             msg = "TURN,FORWARD_RIGHT,0"
-                    elif turning_degree == "0":
+                    elif turning_degree == 0:
                         if cmd == "t":
                             # Backward
                             msg = "MOVE,BACKWARD," + distance
@@ -177,82 +583,76 @@ class STM(metaclass=Singleton):
 
         while True:
             try:
-                messages = self.stm.wait_receive()
-                print(f"all messages: {messages}")
-                for message_rcv in messages.split("\n"):
-                    if len(message_rcv) == 0:
-                        continue
-                    print("Message received from STM: ", message_rcv)
-                    if "M" in message_rcv:
-                        if self.gamestate.num_M == 0:
-                            time.sleep(0.25)
-                            self.pc.send("SEEN")
-                        elif self.gamestate.num_M == 1:
-                            self.gamestate.stop()
-
-                        self.num_M += 1
-                    elif "D" in message_rcv:
-                        dist_val_str = (
-                            message_rcv.replace("fD", "").replace("\0", "").strip()
-                        )
-                        if len(dist_val_str) == 0:
-                            # Robot is beginning drive towards obstacle, take in latest_image then decide what to do
-                            if self.gamestate.num_obstacle == 1:  # First Obstacle
-                                if (
-                                    self.gamestate.get_last_image()
-                                    == self.gamestate.RIGHT_ARROW_ID
-                                ):  # RIGHT ARROW
-                                    print("Right arrow detected")
-                                    self.gamestate.callback_obstacle1(True)
-
-                                elif (
-                                    self.gamestate.get_last_image()
-                                    == self.gamestate.LEFT_ARROW_ID
-                                ):  # LEFT ARROW
-                                    print("Left arrow detected")
-                                    self.gamestate.callback_obstacle1(False)
-
-                                else:
-                                    # set to trigger on next arrow found.
-                                    self.gamestate.on_arrow_callback = (
-                                        self.gamestate.callback_obstacle1
-                                    )
-
-                            elif self.gamestate.num_obstacle == 2:  # Second Obstacle
-                                if (
-                                    self.gamestate.get_last_image()
-                                    == self.gamestate.RIGHT_ARROW_ID
-                                ):  # RIGHT ARROW
-                                    print("Right arrow detected")
-                                    self.gamestate.callback_obstacle2(True)
-
-                                elif (
-                                    self.gamestate.get_last_image()
-                                    == self.gamestate.LEFT_ARROW_ID
-                                ):  # LEFT ARROW
-                                    print("Left arrow detected")
-                                    self.gamestate.callback_obstacle2(False)
-
-                                else:
-                                    # set to trigger on next arrow found.
-                                    self.gamestate.on_arrow_callback = (
-                                        self.gamestate.callback_obstacle2
-                                    )
-
-                            self.gamestate.num_obstacle += 1
-                        else:
-                            # Robot has finished tracking distance; save accordingly
-                            dist_val = float(dist_val_str)
-
-                            # set distances in order.
-                            with self.gamestate.lock:
-                                if self.gamestate.obstacle_dist1 is None:
-                                    self.gamestate.obstacle_dist1 = dist_val
-                                elif self.gamestate.obstacle_dist2 is None:
-                                    self.gamestate.obstacle_dist2 = dist_val
-                                elif self.gamestate.wall_dist is None:
-                                    self.gamestate.wall_dist = dist_val + 22.5
-                                    self.gamestate.wall_complete = True
+                reply = self.wait_reply()
+                message_rcv = reply.raw
+                print("Message received from STM: ", message_rcv)
+                if isinstance(reply, StmMarker):
+                    if self.gamestate.num_M == 0:
+                        time.sleep(0.25)
+                        self.pc.send("SEEN")
+                    elif self.gamestate.num_M == 1:
+                        self.gamestate.stop()
+
+                    self.num_M += 1
+                elif isinstance(reply, StmDistance):
+                    if reply.distance is None:
+                        # Robot is beginning drive towards obstacle, take in latest_image then decide what to do
+                        if self.gamestate.num_obstacle == 1:  # First Obstacle
+                            if (
+                                self.gamestate.get_last_image()
+                                == self.gamestate.RIGHT_ARROW_ID
+                            ):  # RIGHT ARROW
+                                print("Right arrow detected")
+                                self.gamestate.callback_obstacle1(True)
+
+                            elif (
+                                self.gamestate.get_last_image()
+                                == self.gamestate.LEFT_ARROW_ID
+                            ):  # LEFT ARROW
+                                print("Left arrow detected")
+                                self.gamestate.callback_obstacle1(False)
+
+                            else:
+                                # set to trigger on next arrow found.
+                                self.gamestate.on_arrow_callback = (
+                                    self.gamestate.callback_obstacle1
+                                )
+
+                        elif self.gamestate.num_obstacle == 2:  # Second Obstacle
+                            if (
+                                self.gamestate.get_last_image()
+                                == self.gamestate.RIGHT_ARROW_ID
+                            ):  # RIGHT ARROW
+                                print("Right arrow detected")
+                                self.gamestate.callback_obstacle2(True)
+
+                            elif (
+                                self.gamestate.get_last_image()
+                                == self.gamestate.LEFT_ARROW_ID
+                            ):  # LEFT ARROW
+                                print("Left arrow detected")
+                                self.gamestate.callback_obstacle2(False)
+
+                            else:
+                                # set to trigger on next arrow found.
+                                self.gamestate.on_arrow_callback = (
+                                    self.gamestate.callback_obstacle2
+                                )
+
+                        self.gamestate.num_obstacle += 1
+                    else:
+                        # Robot has finished tracking distance; save accordingly
+                        dist_val = reply.distance
+
+                        # set distances in order.
+                        with self.gamestate.lock:
+                            if self.gamestate.obstacle_dist1 is None:
+                                self.gamestate.obstacle_dist1 = dist_val
+                            elif self.gamestate.obstacle_dist2 is None:
+                                self.gamestate.obstacle_dist2 = dist_val
+                            elif self.gamestate.wall_dist is None:
+                                self.gamestate.wall_dist = dist_val + 22.5
+                                self.gamestate.wall_complete = True
 
             except OSError as e:
                 print(f"Error in receiving STM data: {e}")
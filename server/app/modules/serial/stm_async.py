@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+from utils.metaclass.singleton import Singleton
+from .configuration import RECEIVE_QUEUE_SIZE
+from .stm32 import STM, StmReplyMismatch, ack_timeout
+from .stm_commands import StmCommand, StmProgram
+from .stm_replies import StmReply
+
+
+class AsyncSTM(metaclass=Singleton):
+    """
+    asyncio client for the STM link, sharing the connection and send window of the blocking `STM`.
+    Writes run on a single writer thread so they keep their order and never block the event loop,
+    and acknowledgements are awaited through the futures completed by the reader thread.
+    """
+
+    logger = logging.getLogger("Async STM")
+
+    def __init__(self):
+        self.stm = STM()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="STM-Writer")
+
+    def connect(self, port: Optional[str] = None) -> None:
+        self.stm.connect(port)
+
+    async def _submit(self, *stm_commands: StmCommand, timeout: Optional[float] = None) -> List[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        futures = await loop.run_in_executor(
+            self._writer, lambda: self.stm.submit(*stm_commands, timeout=timeout)
+        )
+        return [asyncio.wrap_future(f, loop=loop) for f in futures]
+
+    async def send(self, stm_command: StmCommand, timeout: Optional[float] = None) -> Optional[StmReply]:
+        """
+        Sends a single command and waits for its acknowledgement
+        :param stm_command: Command to send
+        :param timeout: Optional seconds to wait for the acknowledgement, `ack_timeout` of the command if not set
+        :return: Reply to the command, None if it was not acknowledged before the timeout
+        """
+        replies = await self.send_many(stm_command, timeout=timeout)
+        return replies[0]
+
+    async def send_many(self, *stm_commands: StmCommand, timeout: Optional[float] = None) -> List[Optional[StmReply]]:
+        """
+        Async version of `STM.send_stm_command_and_wait`
+        :param stm_commands: Commands to send, in order
+        :param timeout: Optional total seconds to wait for all acknowledgements, `ack_timeout` of the commands if not set
+        :return: Reply to each command, None for those not acknowledged before the timeout
+        """
+        loop = asyncio.get_running_loop()
+        if timeout is None:
+            timeout = ack_timeout(*stm_commands)
+        deadline = loop.time() + timeout
+        remaining = lambda: max(deadline - loop.time(), 0)
+
+        futures = await self._submit(*stm_commands, timeout=remaining())
+
+        replies: List[Optional[StmReply]] = [None] * len(stm_commands)
+        for i, (c, f) in enumerate(zip(stm_commands, futures)):
+            try:
+                # Shielded, so a timeout here does not cancel the command's future under the reader thread
+                replies[i] = await asyncio.wait_for(asyncio.shield(f), remaining())
+            except asyncio.TimeoutError:
+                self.logger.warning(f"Timed out waiting for acknowledgement of {c.to_serial().strip()}")
+                break
+            except StmReplyMismatch as e:
+                self.logger.warning(f"Lost acknowledgement of {c.to_serial().strip()}: {e}")
+
+        return replies
+
+    async def execute(self, program: StmProgram, timeout: Optional[float] = None) -> List[Optional[StmReply]]:
+        """
+        Async version of `STM.execute`, the program is passed through the peephole optimizer first
+        :param program: Commands to run, in order
+        :param timeout: Optional total seconds to wait for all acknowledgements, `ack_timeout` of the commands if not set
+        :return: Reply to each command sent
+        """
+        commands = self.stm.optimizer.optimize(program.commands)
+        self.logger.info(f"Executing program of {len(commands)} command(s)")
+        return await self.send_many(*commands, timeout=timeout)
+
+    async def send_cmd(self, flag, speed, angle, val) -> bool:
+        """
+        Async version of `STM.send_cmd`, writes a raw frame without waiting for its acknowledgement
+        :return: False if it was refused, as commands are in flight
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self.stm.send_cmd, flag, speed, angle, val)
+
+    async def replies(self) -> AsyncIterator[StmReply]:
+        """
+        Yields every reply received from the STM while iterating, including acknowledgements.
+        If the consumer falls behind, the oldest replies are dropped.
+        """
+        self.stm._ensure_reader()
+        loop = asyncio.get_running_loop()
+        received: asyncio.Queue = asyncio.Queue(maxsize=RECEIVE_QUEUE_SIZE)
+
+        def push(reply: StmReply) -> None:
+            if received.full():
+                dropped = received.get_nowait()
+                self.logger.warning(f"Reply iterator full, dropping: {dropped.raw}")
+            received.put_nowait(reply)
+
+        # [Reader Thread] hand the reply over to the event loop
+        listener = lambda reply: loop.call_soon_threadsafe(push, reply)
+
+        self.stm.add_listener(listener)
+        try:
+            while True:
+                yield await received.get()
+        finally:
+            self.stm.remove_listener(listener)
@@ -1,35 +1,91 @@
 from abc import ABC, abstractmethod
-from typing import Literal
+from functools import lru_cache
+from typing import Literal, List, Iterator, Dict, Tuple
+
+
+@lru_cache(maxsize=512, typed=True)
+def _encode_frame(flag: str, speed, angle, value) -> str:
+    """
+    Interned table of encoded frames, `{FLAG}{SPEED}|{ANGLE}|{VALUE}\\n`.
+    Typed, as 45 and 45.0 serialise differently.
+    """
+    return f"{flag}{speed}|{angle}|{value}\n"
 
 
 class StmCommand(ABC):
+    """
+    Immutable command to the STM. The serialised frame is computed once and cached on the instance.
+    """
+
+    __slots__ = ("_serial", "_bytes")
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def _set(self, **fields) -> None:
+        for key, value in fields.items():
+            object.__setattr__(self, key, value)
 
     @abstractmethod
+    def _serialise(self) -> str:
+        """
+        Method to build the string to be sent to the STM, called once per instance
+        :return:
+        """
+        raise NotImplementedError
+
     def to_serial(self) -> str:
         """
         Method to serialise the method into a string to be sent to the STM
         :return:
         """
-        raise NotImplementedError
+        try:
+            return self._serial
+        except AttributeError:
+            object.__setattr__(self, "_serial", self._serialise())
+            return self._serial
+
+    def to_bytes(self) -> bytes:
+        """
+        Method to serialise the command into the bytes written to the link
+        :return:
+        """
+        try:
+            return self._bytes
+        except AttributeError:
+            object.__setattr__(self, "_bytes", self.to_serial().encode("utf-8"))
+            return self._bytes
+
+    @property
+    def flag(self) -> str:
+        return self.to_serial()[0]
 
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_serial() == other.to_serial()
+
+    def __hash__(self) -> int:
+        return hash((type(self), self.to_serial()))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_serial().strip()})"
 
 
 class StmMoveToDistance(StmCommand):
 
+    __slots__ = ("distance", "forward", "speed")
+
     def __init__(self, distance: int, forward:bool=True, speed:int=40):
         """
         :param distance: Distance to move to.
         :param forward: True if the robot should move forward to specified distance
         :param speed: Speed the robot should move
         """
-        self.distance = distance
-        self.forward = forward
-        self.speed = speed
+        self._set(distance=distance, forward=forward, speed=speed)
 
-    def to_serial(self) -> str:
+    def _serialise(self) -> str:
         flag = "W" if self.forward else "w"
         # "W/w{SPEED}|{ANGLE}|{DISTANCE}
-        return f"{flag}{round(self.speed,2)}|0|{round(self.distance,2)}\n"
+        return _encode_frame(flag, round(self.speed, 2), 0, round(self.distance, 2))
 
 
 class StmMove(StmCommand):
@@ -37,6 +93,8 @@ class StmMove(StmCommand):
     Command to move forward
     """
 
+    __slots__ = ("distance", "forward", "angle", "speed")
+
     def __init__(
             self,
             distance: int,
@@ -44,74 +102,137 @@ class StmMove(StmCommand):
             angle: int = 0,
             speed: int = 55
     ):
-        self.distance = distance
-        self.forward = forward
-        self.angle = angle
-        self.speed = speed
+        self._set(distance=distance, forward=forward, angle=angle, speed=speed)
 
-    def to_serial(self) -> str:
+    def _serialise(self) -> str:
         flag = "T" if self.forward else "t"
         # "T/t{SPEED}|{ANGLE}|{DISTANCE}
-        return f"{flag}{self.speed}|{round(self.angle,2)}|{round(self.distance,2)}\n"
+        return _encode_frame(flag, self.speed, round(self.angle, 2), round(self.distance, 2))
 
 
 class StmWiggle(StmCommand):
+    """
+    Command to re-centre the servo. Every StmWiggle() is the same interned instance.
+    """
 
-    def to_serial(self) -> str:
+    __slots__ = ()
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def _serialise(self) -> str:
         return StmMove(0, angle=-45, speed=0).to_serial()
 
 
+# Max distinct instances kept per interned command class
+INTERN_LIMIT = 256
+
+
 class StmTurn(StmCommand):
+    """
+    Turn at full servo lock by the given angle. Instances are interned, as tasks reuse a handful of turns.
+    """
 
-    def __init__(
-            self,
+    __slots__ = ("angle", "speed", "forward")
+
+    _interned: Dict[Tuple, "StmTurn"] = {}
+
+    def __new__(
+            cls,
             angle: int,
             speed: int,
             forward: bool = True
     ):
-        self.angle = angle
-        self.speed = speed
-        self.forward = forward
+        key = (type(angle), angle, type(speed), speed, forward)
+        self = cls._interned.get(key)
+        if self is None:
+            self = super().__new__(cls)
+            self._set(angle=angle, speed=speed, forward=forward)
+            if len(cls._interned) < INTERN_LIMIT:
+                cls._interned[key] = self
+        return self
 
-    def to_serial(self) -> str:
+    def _serialise(self) -> str:
 
         servo_angle = 0
+        angle = self.angle
 
-        if self.angle != 0:
-            if self.angle < 0:
+        if angle != 0:
+            if angle < 0:
                 servo_angle = -25
             else:
                 servo_angle = 25
-                self.angle = 0.98 * self.angle
+                angle = 0.98 * angle
 
         # the resultant angle is scaled due to servo issues
-        return StmMove(distance=int(1.00*(abs(self.angle))), angle=servo_angle, speed=self.speed).to_serial()
+        return StmMove(
+            distance=int(1.00*(abs(angle))), angle=servo_angle, speed=self.speed, forward=self.forward
+        ).to_serial()
 
 
 class StmStraight(StmCommand):
+    """
+    Move in a straight line. Instances are interned, as tasks reuse a handful of distances.
+    """
 
-    def __init__(
-            self,
+    __slots__ = ("distance", "speed", "forward")
+
+    _interned: Dict[Tuple, "StmStraight"] = {}
+
+    def __new__(
+            cls,
             distance: int,
             speed: int,
             forward: bool = True
     ):
-        self.distance = distance
-        self.speed = speed
-        self.forward = forward
-
-    def to_serial(self) -> str:
+        key = (type(distance), distance, type(speed), speed, forward)
+        self = cls._interned.get(key)
+        if self is None:
+            self = super().__new__(cls)
+            self._set(distance=distance, speed=speed, forward=forward)
+            if len(cls._interned) < INTERN_LIMIT:
+                cls._interned[key] = self
+        return self
+
+    def _serialise(self) -> str:
         return StmMove(distance=self.distance, angle=0, speed=self.speed, forward=self.forward).to_serial()
 
 
 class StmToggleMeasure(StmCommand):
 
-    def to_serial(self) -> str:
+    __slots__ = ()
+
+    def _serialise(self) -> str:
         return "D\n"
 
 
+class StmTelemetry(StmCommand):
+    """
+    Command to start streaming telemetry samples every period, or stop streaming with a period of 0
+    """
+
+    __slots__ = ("period_ms",)
+
+    def __init__(self, period_ms: int):
+        """
+        :param period_ms: Milliseconds between samples, 0 stops streaming
+        """
+        assert period_ms >= 0, "Period must not be negative!"
+        self._set(period_ms=period_ms)
+
+    def _serialise(self) -> str:
+        # "X0|0|{PERIOD}", acknowledged like a move
+        return _encode_frame("X", 0, 0, self.period_ms)
+
+
 class StmSideHug(StmCommand):
 
+    __slots__ = ("side", "threshold", "speed", "forward")
+
     def __init__(
             self,
             side: Literal["left", "right"],
@@ -129,12 +250,9 @@ class StmSideHug(StmCommand):
 
         assert threshold > 0, "Threshold value must be positive!"
 
-        self.side = side
-        self.threshold = threshold
-        self.speed = speed
-        self.forward = forward
+        self._set(side=side, threshold=threshold, speed=speed, forward=forward)
 
-    def to_serial(self) -> str:
+    def _serialise(self) -> str:
 
         flag = "L" if self.side == "left" else "R"
         if not self.forward:
@@ -142,11 +260,13 @@ class StmSideHug(StmCommand):
 
         # format
         # flag, speed, angle, threshold distance
-        return f"{flag}{self.speed}|0|{self.threshold}\n"
+        return _encode_frame(flag, self.speed, 0, self.threshold)
 
 
 class StmMoveUntilSideObstacle(StmCommand):
 
+    __slots__ = ("side", "threshold", "speed", "forward")
+
     def __init__(
             self,
             side: Literal["left", "right"],
@@ -164,30 +284,38 @@ class StmMoveUntilSideObstacle(StmCommand):
 
         assert threshold > 0, "Threshold value must be positive!"
 
-        self.side = side
-        self.threshold = -threshold
-        self.speed = speed
-        self.forward = forward
+        self._set(side=side, threshold=-threshold, speed=speed, forward=forward)
 
-    def to_serial(self) -> str:
+    def _serialise(self) -> str:
         flag = "L" if self.side == "left" else "R"
         if not self.forward:
             flag = flag.lower()
 
         # format
         # flag, speed, angle, threshold distance
-        return f"{flag}{self.speed}|0|{self.threshold}\n"
-
-
-
-
-
-
-
+        return _encode_frame(flag, self.speed, 0, self.threshold)
 
 
+class StmProgram:
+    """
+    Ordered sequence of commands that is framed and written to the STM together.
+    """
 
+    def __init__(self, *commands: StmCommand):
+        self.commands: List[StmCommand] = list(commands)
 
+    def __iter__(self) -> Iterator[StmCommand]:
+        return iter(self.commands)
 
+    def __len__(self) -> int:
+        return len(self.commands)
 
+    def to_serial(self) -> str:
+        """
+        Method to serialise the whole program into a single frame, identical to the concatenated commands
+        :return:
+        """
+        return "".join(c.to_serial() for c in self.commands)
 
+    def to_bytes(self) -> bytes:
+        return b"".join(c.to_bytes() for c in self.commands)
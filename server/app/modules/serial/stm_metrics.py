@@ -0,0 +1,205 @@
+import threading
+import time
+from textwrap import dedent
+from typing import Dict, List, Optional
+
+
+class LogHistogram:
+    """
+    Fixed size HDR style histogram of non-negative integers.
+    Buckets are linear up to 2^bits, then each power of two is split into 2^(bits-1) sub-buckets,
+    so every recorded value is kept within a relative error of 2^-(bits-1).
+    """
+
+    def __init__(self, highest: int, bits: int = 4):
+        """
+        :param highest: Largest value that can be told apart, larger values are clamped to it
+        :param bits: Precision of each bucket, 4 keeps values within 12.5%
+        """
+        self._bits = bits
+        self._sub_count = 1 << bits
+        self._half = self._sub_count >> 1
+        self._highest = highest
+        self._counts: List[int] = [0] * (self._index(highest) + 1)
+
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self._bits
+        return self._sub_count + (shift - 1) * self._half + ((value >> shift) - self._half)
+
+    def _upper(self, index: int) -> int:
+        # Largest value that falls in the bucket
+        if index < self._sub_count:
+            return index
+        shift, sub = divmod(index - self._sub_count, self._half)
+        shift += 1
+        return ((sub + self._half + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        value = min(max(int(value), 0), self._highest)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p: float) -> int:
+        """
+        :param p: Percentile in [0, 100]
+        :return: Upper bound of the bucket holding the percentile, 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self) -> None:
+        self._counts = [0] * len(self._counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "min": self.min or 0,
+            "mean": round(self.mean, 1),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max or 0,
+        }
+
+
+class StmCommandMetrics:
+    """
+    Histograms for every command sent with a single flag.
+    - latency: write to acknowledgement, including time queued behind earlier commands in the send window
+    - service: time the STM spent on the command alone, from the later of its write and the previous acknowledgement
+    """
+
+    MAX_MICROSECONDS = 120_000_000
+    MAX_BYTES = 4096
+
+    def __init__(self):
+        self.latency_us = LogHistogram(self.MAX_MICROSECONDS)
+        self.service_us = LogHistogram(self.MAX_MICROSECONDS)
+        self.bytes_written = LogHistogram(self.MAX_BYTES)
+        self.bytes_read = LogHistogram(self.MAX_BYTES)
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_us": self.latency_us.snapshot(),
+            "service_us": self.service_us.snapshot(),
+            "bytes_written": self.bytes_written.snapshot(),
+            "bytes_read": self.bytes_read.snapshot(),
+        }
+
+
+class StmLinkMetrics:
+    """
+    Per flag command metrics and byte totals for the STM link. Thread safe, the reader thread records acknowledgements.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands: Dict[str, StmCommandMetrics] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._commands.clear()
+            self.started_at = time.monotonic()
+            self.bytes_written = 0
+            self.bytes_read = 0
+            self.writes = 0
+
+    def record_write(self, n_bytes: int) -> None:
+        with self._lock:
+            self.bytes_written += n_bytes
+            self.writes += 1
+
+    def record_read(self, n_bytes: int) -> None:
+        with self._lock:
+            self.bytes_read += n_bytes
+
+    def record_command(
+            self,
+            flag: str,
+            sent_at: float,
+            acked_at: float,
+            started_at: float,
+            bytes_written: int,
+            bytes_read: int,
+    ) -> None:
+        """
+        Records a command that has been acknowledged
+        :param flag: Flag of the command sent
+        :param sent_at: Monotonic time the command was written
+        :param acked_at: Monotonic time its acknowledgement was received
+        :param started_at: Monotonic time the STM started on it, the later of sent_at and the previous acknowledgement
+        :param bytes_written: Size of the command frame
+        :param bytes_read: Size of the acknowledgement frame
+        """
+        with self._lock:
+            metrics = self._commands.get(flag)
+            if metrics is None:
+                metrics = self._commands[flag] = StmCommandMetrics()
+            metrics.latency_us.record((acked_at - sent_at) * 1e6)
+            metrics.service_us.record((acked_at - started_at) * 1e6)
+            metrics.bytes_written.record(bytes_written)
+            metrics.bytes_read.record(bytes_read)
+
+    def snapshot(self) -> dict:
+        """
+        :return: Copy of all metrics since the last reset, safe to serialise to JSON
+        """
+        with self._lock:
+            return {
+                "elapsed_s": round(time.monotonic() - self.started_at, 3),
+                "writes": self.writes,
+                "bytes_written": self.bytes_written,
+                "bytes_read": self.bytes_read,
+                "commands": {flag: m.snapshot() for flag, m in sorted(self._commands.items())},
+            }
+
+    def report(self) -> str:
+        """
+        :return: Table of the snapshot, slowest primitives first by total service time
+        """
+        snapshot = self.snapshot()
+        rows = sorted(
+            snapshot["commands"].items(),
+            key=lambda item: item[1]["service_us"]["mean"] * item[1]["service_us"]["count"],
+            reverse=True,
+        )
+        lines = [
+            f"{flag}\t{m['service_us']['count']}\t"
+            f"{m['service_us']['mean'] * m['service_us']['count'] / 1e6:.2f}s\t"
+            f"{m['service_us']['p50'] / 1e3:.1f}/{m['service_us']['p99'] / 1e3:.1f}ms\t"
+            f"{m['latency_us']['p50'] / 1e3:.1f}/{m['latency_us']['p99'] / 1e3:.1f}ms"
+            for flag, m in rows
+        ]
+        return dedent(f"""
+            [[[\tSTM LINK METRICS\t]]]
+            ELAPSED:\t\t{snapshot['elapsed_s']}s
+            WRITES:\t\t{snapshot['writes']} ({snapshot['bytes_written']} bytes)
+            READ:\t\t{snapshot['bytes_read']} bytes
+            FLAG\tCOUNT\tTOTAL\tSERVICE p50/p99\tLATENCY p50/p99
+        """) + "\n".join(lines)
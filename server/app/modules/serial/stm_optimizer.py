@@ -0,0 +1,70 @@
+import logging
+from typing import List, Sequence
+
+from .stm_commands import StmCommand, StmStraight, StmTurn, StmWiggle, StmMove
+
+
+class StmPeepholeOptimizer:
+    """
+    Rewrites a command stream into fewer commands with the same end pose, each saving an ack round trip.
+    - Adjacent straights in the same direction and speed are fused into one
+    - Runs of servo re-centres are collapsed into one, only if collapse_wiggles is set,
+      as tasks send several wiggles in a row on purpose
+    - Moves and turns of zero length are dropped
+    Any other command (distance measurement, side hugging, ...) is a barrier that nothing is moved across.
+    """
+
+    logger = logging.getLogger("STM Optimizer")
+
+    def __init__(self, enabled: bool = True, collapse_wiggles: bool = False):
+        self.enabled = enabled
+        self.collapse_wiggles = collapse_wiggles
+        self.saved = 0  # Commands saved since the last reset()
+
+    def reset(self) -> None:
+        self.saved = 0
+
+    @staticmethod
+    def _is_zero_length(command: StmCommand) -> bool:
+        if isinstance(command, StmStraight):
+            return command.distance == 0
+        if isinstance(command, StmTurn):
+            return command.angle == 0
+        if isinstance(command, StmMove):
+            return command.distance == 0 and command.angle == 0
+        return False
+
+    def optimize(self, commands: Sequence[StmCommand]) -> List[StmCommand]:
+        """
+        :param commands: Commands in the order they would be sent
+        :return: Optimised commands, or the same commands if the optimizer is disabled
+        """
+        if not self.enabled:
+            return list(commands)
+
+        optimized: List[StmCommand] = []
+        for c in commands:
+            if self._is_zero_length(c):
+                continue
+
+            prev = optimized[-1] if optimized else None
+
+            if self.collapse_wiggles and isinstance(c, StmWiggle) and isinstance(prev, StmWiggle):
+                continue
+
+            if (
+                isinstance(c, StmStraight)
+                and isinstance(prev, StmStraight)
+                and prev.forward == c.forward
+                and prev.speed == c.speed
+            ):
+                optimized[-1] = StmStraight(distance=prev.distance + c.distance, speed=c.speed, forward=c.forward)
+                continue
+
+            optimized.append(c)
+
+        saved = len(commands) - len(optimized)
+        if saved:
+            self.logger.info(f"Reduced {len(commands)} commands to {len(optimized)}")
+        self.saved += saved
+        return optimized
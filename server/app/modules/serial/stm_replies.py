@@ -0,0 +1,228 @@
+import logging
+import re
+import time
+from typing import List, Optional
+
+
+class StmReply:
+    """
+    A single newline-terminated frame received from the STM.
+    """
+
+    def __init__(self, raw: str):
+        """
+        :param raw: Frame as received, without the line terminator
+        """
+        self.raw = raw
+        self.received_at = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.raw!r})"
+
+
+class StmAck(StmReply):
+    """
+    Acknowledgement of a completed movement command, `f{FLAG}{SPEED}|{ANGLE}|{DISTANCE}`; e.g. `fT55|-25|90`
+    """
+
+    def __init__(self, raw: str, flag: str, speed: float, angle: float, distance: float):
+        super().__init__(raw)
+        self.flag = flag
+        self.speed = speed
+        self.angle = angle
+        self.distance = distance
+
+
+class StmDistance(StmReply):
+    """
+    Reply to a distance measurement toggle, `fD{DISTANCE}`.
+    The distance is empty when measuring starts, and set to the distance covered when it ends.
+    """
+
+    def __init__(self, raw: str, distance: Optional[float]):
+        super().__init__(raw)
+        self.distance = distance
+
+
+class StmStop(StmReply):
+    """
+    Acknowledgement that the robot has come to a stop, `fS`
+    """
+
+
+class StmMarker(StmReply):
+    """
+    Marker frame, `M`
+    """
+
+
+class StmTelemetrySample(StmReply):
+    """
+    Streamed sensor sample, `X{FRONT}|{LEFT}|{RIGHT}|{ODOMETER}`, sent while telemetry is enabled
+    """
+
+    def __init__(self, raw: str, front: float, left: float, right: float, odometer: float):
+        super().__init__(raw)
+        self.front = front
+        self.left = left
+        self.right = right
+        self.odometer = odometer
+
+
+class StmUnknownReply(StmReply):
+    """
+    Frame that does not match any known reply
+    """
+
+
+_NUMBER = r"-?\d+(?:\.\d+)?"
+
+ACK_PATTERN = re.compile(rf"^f([A-Za-z])({_NUMBER})\|({_NUMBER})\|({_NUMBER})$")
+DISTANCE_PATTERN = re.compile(rf"^fD({_NUMBER})?$")
+STOP_PATTERN = re.compile(r"^fS")
+MARKER_PATTERN = re.compile(r"^f?M")
+TELEMETRY_PATTERN = re.compile(rf"^X({_NUMBER})\|({_NUMBER})\|({_NUMBER})\|({_NUMBER})$")
+
+
+def parse_reply(line: str) -> StmReply:
+    """
+    Parses a single frame into its typed reply
+    :param line: Frame without the line terminator
+    :return: StmReply subclass matching the frame
+    """
+    if match := TELEMETRY_PATTERN.match(line):
+        return StmTelemetrySample(line, *map(float, match.groups()))
+
+    if match := ACK_PATTERN.match(line):
+        flag, speed, angle, distance = match.groups()
+        return StmAck(line, flag, float(speed), float(angle), float(distance))
+
+    if match := DISTANCE_PATTERN.match(line):
+        distance = match.group(1)
+        return StmDistance(line, float(distance) if distance is not None else None)
+
+    if STOP_PATTERN.match(line):
+        return StmStop(line)
+
+    if MARKER_PATTERN.match(line):
+        return StmMarker(line)
+
+    return StmUnknownReply(line)
+
+
+class ByteRingBuffer:
+    """
+    Fixed capacity FIFO of bytes backed by a single preallocated bytearray.
+    """
+
+    def __init__(self, capacity: int):
+        assert capacity > 0, "Capacity must be positive!"
+        self._buffer = bytearray(capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def free(self) -> int:
+        return self._capacity - self._size
+
+    def write(self, data: bytes) -> None:
+        """
+        Appends data to the end of the buffer
+        :param data: Bytes to append, must fit within the free space
+        :return: None
+        """
+        n = len(data)
+        if n > self.free:
+            raise OverflowError(f"Cannot write {n} bytes, only {self.free} free")
+
+        end = (self._start + self._size) % self._capacity
+        first = min(n, self._capacity - end)
+        self._buffer[end:end + first] = data[:first]
+        self._buffer[:n - first] = data[first:]
+        self._size += n
+
+    def find(self, byte: bytes) -> int:
+        """
+        Finds the first occurrence of a single byte
+        :param byte: Byte to search for
+        :return: Offset from the start of the buffer, -1 if not found
+        """
+        end = self._start + self._size
+        if end <= self._capacity:
+            i = self._buffer.find(byte, self._start, end)
+            return i - self._start if i >= 0 else -1
+
+        i = self._buffer.find(byte, self._start, self._capacity)
+        if i >= 0:
+            return i - self._start
+
+        i = self._buffer.find(byte, 0, end - self._capacity)
+        return self._capacity - self._start + i if i >= 0 else -1
+
+    def read(self, n: int) -> bytes:
+        """
+        Removes and returns up to n bytes from the start of the buffer
+        :param n: Number of bytes to read
+        :return: Bytes read
+        """
+        n = min(n, self._size)
+        first = min(n, self._capacity - self._start)
+        data = bytes(self._buffer[self._start:self._start + first]) + bytes(self._buffer[:n - first])
+
+        self._start = (self._start + n) % self._capacity
+        self._size -= n
+        if self._size == 0:
+            self._start = 0
+        return data
+
+    def clear(self) -> None:
+        self._start = 0
+        self._size = 0
+
+
+class StmFrameDecoder:
+    """
+    Incremental decoder that turns the raw serial byte stream into complete reply frames.
+    Partial frames are held until their terminator arrives, so a frame is never split or merged with the next.
+    """
+
+    logger = logging.getLogger("STM Decoder")
+
+    TERMINATOR = b"\n"
+
+    def __init__(self, capacity: int = 4096):
+        """
+        :param capacity: Max bytes a single unterminated frame may occupy
+        """
+        self._ring = ByteRingBuffer(capacity)
+
+    def feed(self, data: bytes) -> List[StmReply]:
+        """
+        Consumes bytes read from the serial link
+        :param data: Bytes in the order they were received
+        :return: Replies completed by this chunk, in order
+        """
+        replies: List[StmReply] = []
+        view = memoryview(data)
+
+        while view:
+            if self._ring.free == 0:
+                # A frame this long is line noise, not a reply
+                self.logger.warning(f"Discarding {len(self._ring)} bytes without a terminator")
+                self._ring.clear()
+
+            n = min(len(view), self._ring.free)
+            self._ring.write(view[:n])
+            view = view[n:]
+
+            while (i := self._ring.find(self.TERMINATOR)) >= 0:
+                frame = self._ring.read(i + 1)
+                line = frame.decode("utf-8", errors="replace").replace("\0", "").strip()
+                if line:
+                    replies.append(parse_reply(line))
+
+        return replies
@@ -0,0 +1,356 @@
+"""
+Simulated STM32 on a pseudo-terminal, for running the STM link and tasks without the robot.
+
+Usage:
+    python -m modules.serial.stm_simulator --time-scale 0.05
+then point STM_SERIAL_PORT at the printed port, or pass it to STM().connect(port=...).
+"""
+import argparse
+import logging
+import math
+import os
+import re
+import threading
+import time
+import tty
+from typing import List, Optional, Tuple
+
+Rect = Tuple[float, float, float, float]  # (x0, y0, x1, y1) in cm
+
+
+class SimArena:
+    """
+    Walled arena with rectangular obstacles, in cm. The origin is the bottom left corner, +y is north.
+    """
+
+    def __init__(
+            self,
+            width: float = 200,
+            height: float = 400,
+            obstacles: Optional[List[Rect]] = None,
+            start: Tuple[float, float, float] = (100, 20, 0),
+    ):
+        """
+        :param width: Width of the arena along x
+        :param height: Height of the arena along y
+        :param obstacles: Obstacles as (x0, y0, x1, y1) rectangles
+        :param start: Starting pose of the robot as (x, y, heading), heading in degrees clockwise from north
+        """
+        self.width = width
+        self.height = height
+        self.obstacles: List[Rect] = obstacles if obstacles is not None else [(85, 120, 115, 130)]
+        self.start = start
+
+    def ray_distance(self, x: float, y: float, heading: float, max_range: float = 500) -> float:
+        """
+        Distance from (x, y) to the first obstacle or wall along the heading
+        :param heading: Degrees clockwise from north
+        :param max_range: Distance returned when nothing is hit
+        :return: Distance in cm
+        """
+        dx = math.sin(math.radians(heading))
+        dy = math.cos(math.radians(heading))
+
+        nearest = max_range
+        for rect in [*self.obstacles, (-1e9, -1e9, 0, 1e9), (self.width, -1e9, 1e9, 1e9),
+                     (-1e9, -1e9, 1e9, 0), (-1e9, self.height, 1e9, 1e9)]:
+            hit = self._ray_rect(x, y, dx, dy, rect)
+            if hit is not None and hit < nearest:
+                nearest = hit
+        return nearest
+
+    @staticmethod
+    def _ray_rect(x: float, y: float, dx: float, dy: float, rect: Rect) -> Optional[float]:
+        # Slab intersection of a ray against an axis aligned rectangle
+        t_min, t_max = 0.0, math.inf
+        for origin, direction, lo, hi in ((x, dx, rect[0], rect[2]), (y, dy, rect[1], rect[3])):
+            if abs(direction) < 1e-9:
+                if origin < lo or origin > hi:
+                    return None
+                continue
+            t0, t1 = (lo - origin) / direction, (hi - origin) / direction
+            t_min, t_max = max(t_min, min(t0, t1)), min(t_max, max(t0, t1))
+            if t_min > t_max:
+                return None
+        return t_min
+
+
+class SimKinematics:
+    """
+    Timing and geometry model of the robot.
+    """
+
+    def __init__(
+            self,
+            cm_per_speed: float = 0.5,
+            turn_radius: float = 40,
+            servo_time: float = 0.15,
+            stop_time: float = 0.2,
+            side_sensor_offset: float = 0,
+    ):
+        """
+        :param cm_per_speed: Velocity in cm/s per unit of the speed field
+        :param turn_radius: Radius of the arc driven at full servo lock, in cm
+        :param servo_time: Seconds to move the servo, paid by every command
+        :param stop_time: Seconds for the robot to come to rest on `S`
+        :param side_sensor_offset: Distance of the IR sensors behind the front sensor, in cm
+        """
+        self.cm_per_speed = cm_per_speed
+        self.turn_radius = turn_radius
+        self.servo_time = servo_time
+        self.stop_time = stop_time
+        self.side_sensor_offset = side_sensor_offset
+
+    def velocity(self, speed: float) -> float:
+        return max(speed, 1) * self.cm_per_speed
+
+
+class StmSimulator:
+    """
+    Speaks the STM serial protocol on a pseudo-terminal, replying with acknowledgements timed by `SimKinematics`.
+    """
+
+    logger = logging.getLogger("STM Simulator")
+
+    COMMAND_PATTERN = re.compile(r"^([TtWwLlRrX])(-?[\d.]+)\|(-?[\d.]+)\|(-?[\d.]+)$")
+    HUG_STEP = 1.0  # cm travelled between side sensor checks
+    MAX_HUG_DISTANCE = 400
+
+    def __init__(
+            self,
+            arena: Optional[SimArena] = None,
+            kinematics: Optional[SimKinematics] = None,
+            time_scale: float = 1.0,
+    ):
+        """
+        :param arena: Arena to drive in
+        :param kinematics: Timing model
+        :param time_scale: Multiplier on every simulated delay, 0 replies instantly
+        """
+        self.arena = arena or SimArena()
+        self.kinematics = kinematics or SimKinematics()
+        self.time_scale = time_scale
+
+        self.x, self.y, self.heading = self.arena.start
+        self.odometer = 0.0
+        self.measure_start: Optional[float] = None
+        self.telemetry_period = 0.0  # ms between streamed samples, 0 when not streaming
+
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = threading.Event()
+        self.port: Optional[str] = None
+
+    def start(self) -> str:
+        """
+        Opens the pseudo-terminal pair and starts serving commands
+        :return: Path of the serial port to connect to
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._running.set()
+        self._thread = threading.Thread(target=self._serve, name="STM-Simulator", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Simulated STM listening on {self.port}")
+        return self.port
+
+    def stop(self) -> None:
+        self._running.clear()
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    """
+    SENSORS
+    """
+
+    def front_distance(self) -> float:
+        return self.arena.ray_distance(self.x, self.y, self.heading)
+
+    def side_distance(self, side: str) -> float:
+        offset = -self.kinematics.side_sensor_offset
+        sx = self.x + offset * math.sin(math.radians(self.heading))
+        sy = self.y + offset * math.cos(math.radians(self.heading))
+        return self.arena.ray_distance(sx, sy, self.heading + (90 if side == "R" else -90))
+
+    def _emit_telemetry(self) -> None:
+        """
+        Streams a sensor sample, `X{FRONT}|{LEFT}|{RIGHT}|{ODOMETER}`, if telemetry is enabled
+        """
+        if self.telemetry_period <= 0 or self._master is None:
+            return
+        frame = (
+            f"X{self.front_distance():.1f}|{self.side_distance('L'):.1f}|"
+            f"{self.side_distance('R'):.1f}|{self.odometer:.1f}\n"
+        )
+        os.write(self._master, frame.encode("utf-8"))
+
+    """
+    MOTION
+    """
+
+    def _sleep(self, seconds: float) -> None:
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _drive(self, distance: float) -> float:
+        """
+        Drives straight, negative distances reverse. The robot stops short of anything in its way.
+        :return: Distance actually driven
+        """
+        clearance = self.arena.ray_distance(self.x, self.y, self.heading + (0 if distance >= 0 else 180))
+        distance = math.copysign(min(abs(distance), clearance), distance)
+
+        self.x += distance * math.sin(math.radians(self.heading))
+        self.y += distance * math.cos(math.radians(self.heading))
+        self.odometer += abs(distance)
+        return abs(distance)
+
+    def _turn(self, degrees: float, servo_angle: float, forward: bool) -> float:
+        """
+        Drives an arc at full servo lock
+        :return: Arc length driven
+        """
+        r = self.kinematics.turn_radius
+        theta = math.radians(degrees)
+        # Turning right moves the centre of rotation to the right of the robot
+        side = 1 if servo_angle > 0 else -1
+        direction = 1 if forward else -1
+        h = math.radians(self.heading)
+        cx, cy = self.x + side * r * math.cos(h), self.y - side * r * math.sin(h)
+
+        self.heading = (self.heading + side * direction * degrees) % 360
+        h = math.radians(self.heading)
+        self.x, self.y = cx - side * r * math.cos(h), cy + side * r * math.sin(h)
+
+        arc = r * theta
+        self.odometer += arc
+        return arc
+
+    def _hug(self, side: str, threshold: float, forward: bool, speed: float) -> float:
+        """
+        Drives until the side sensor reads >= threshold, or < |threshold| if the threshold is negative.
+        Telemetry is streamed every period while driving.
+        :return: Distance driven
+        """
+        until_clear = threshold > 0
+        limit = abs(threshold)
+        step = self.HUG_STEP if forward else -self.HUG_STEP
+        driven = 0.0
+        step_time = self.HUG_STEP / self.kinematics.velocity(speed)
+        since_sample = math.inf
+        while driven < self.MAX_HUG_DISTANCE:
+            if since_sample * 1000 >= self.telemetry_period > 0:
+                self._emit_telemetry()
+                since_sample = 0.0
+            reading = self.side_distance(side)
+            if (reading >= limit) if until_clear else (reading < limit):
+                break
+            moved = self._drive(step)
+            if moved == 0:
+                break
+            driven += moved
+            if self.telemetry_period > 0:
+                # Pace the drive so samples are spread over it as on the robot
+                self._sleep(step_time)
+                since_sample += step_time
+        self._emit_telemetry()
+        return driven
+
+    """
+    PROTOCOL
+    """
+
+    def handle(self, line: str) -> List[str]:
+        """
+        Executes a single command, updating the pose
+        :param line: Command without its terminator
+        :return: Reply frames, without terminators
+        """
+        if line == "D":
+            if self.measure_start is None:
+                self.measure_start = self.odometer
+                return ["fD"]
+            travelled = self.odometer - self.measure_start
+            self.measure_start = None
+            return [f"fD{travelled:.2f}"]
+
+        if line == "S":
+            self._sleep(self.kinematics.stop_time)
+            return ["fS"]
+
+        match = self.COMMAND_PATTERN.match(line)
+        if not match:
+            self.logger.warning(f"Ignoring unknown command: {line}")
+            return []
+
+        flag, speed, angle, value = match.group(1), float(match.group(2)), float(match.group(3)), float(match.group(4))
+        forward = flag.isupper()
+        travelled = 0.0
+
+        if flag == "X":
+            self.telemetry_period = value
+            return [f"f{line}"]
+
+        if flag in "Tt":
+            if speed == 0:
+                pass  # Servo only, e.g. StmWiggle
+            elif angle == 0:
+                travelled = self._drive(value if forward else -value)
+            else:
+                travelled = self._turn(value, angle, forward)
+        elif flag in "Ww":
+            front = self.front_distance()
+            travelled = max(front - value, 0) if forward else max(value - front, 0)
+            travelled = self._drive(travelled if forward else -travelled)
+        elif flag in "LlRr":
+            travelled = self._hug(flag.upper(), value, forward, speed)
+            if self.telemetry_period > 0:
+                travelled = 0  # Already paced while streaming
+
+        self._sleep(self.kinematics.servo_time + travelled / self.kinematics.velocity(speed))
+        return [f"f{line}"]
+
+    def _serve(self) -> None:
+        """
+        [Simulator Thread] Reads commands off the pty and executes them one at a time, like the firmware.
+        """
+        buffer = b""
+        while self._running.is_set():
+            try:
+                chunk = os.read(self._master, 1024)
+            except OSError:
+                return
+            buffer += chunk
+            while b"\n" in buffer:
+                raw, buffer = buffer.split(b"\n", 1)
+                line = raw.decode("utf-8", errors="replace").strip()
+                if not line:
+                    continue
+                for reply in self.handle(line):
+                    os.write(self._master, f"{reply}\n".encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated STM32 on a pseudo-terminal")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier on simulated delays, 0 is instant")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = StmSimulator(time_scale=args.time_scale)
+    port = simulator.start()
+    print(f"export STM_SERIAL_PORT={port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import threading
+from typing import Literal, Optional, Tuple
+
+import numpy as np
+
+
+class TelemetryBuffer:
+    """
+    Preallocated ring buffer of timestamped STM telemetry samples.
+    Each row is (time, front, left, right, odometer); time is `time.monotonic()` on receipt, distances are in cm.
+    """
+
+    TIME, FRONT, LEFT, RIGHT, ODOMETER = range(5)
+
+    def __init__(self, capacity: int = 4096):
+        """
+        :param capacity: Samples kept before the oldest are overwritten
+        """
+        self._data = np.zeros((capacity, 5), dtype=np.float64)
+        self._capacity = capacity
+        self._count = 0  # Total samples ever appended
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self._count, self._capacity)
+
+    def append(self, timestamp: float, front: float, left: float, right: float, odometer: float) -> None:
+        with self._lock:
+            self._data[self._count % self._capacity] = (timestamp, front, left, right, odometer)
+            self._count += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._count = 0
+
+    def window(self, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """
+        Samples received within [start, end], oldest first
+        :param start: Optional monotonic time of the first sample
+        :param end: Optional monotonic time of the last sample
+        :return: Copy of the matching rows
+        """
+        with self._lock:
+            if self._count <= self._capacity:
+                samples = self._data[:self._count].copy()
+            else:
+                head = self._count % self._capacity
+                samples = np.concatenate((self._data[head:], self._data[:head]))
+
+        times = samples[:, self.TIME]
+        mask = np.ones(len(samples), dtype=bool)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        return samples[mask]
+
+    def distance_travelled(self, start: float, end: float) -> float:
+        """
+        Odometer distance covered between two times, interpolated between samples
+        :return: Distance in cm, 0 if there are no samples
+        """
+        samples = self.window()
+        if len(samples) == 0:
+            return 0.0
+        odometer = np.interp((start, end), samples[:, self.TIME], samples[:, self.ODOMETER])
+        return float(odometer[1] - odometer[0])
+
+    def obstacle_edges(
+            self,
+            side: Literal["left", "right", "front"],
+            threshold: float,
+            start: Optional[float] = None,
+            end: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Finds where an obstacle comes into and out of range of a sensor.
+        Edges are placed by linearly interpolating the odometer to where the reading crosses the threshold.
+        :param side: Sensor to use
+        :param threshold: Readings below this are treated as the obstacle
+        :return: (N, 2) array of (start, end) odometer readings, an edge outside the window is clamped to it
+        """
+        samples = self.window(start, end)
+        if len(samples) == 0:
+            return np.empty((0, 2))
+
+        column = {"front": self.FRONT, "left": self.LEFT, "right": self.RIGHT}[side]
+        readings = samples[:, column]
+        odometer = samples[:, self.ODOMETER]
+
+        inside = readings < threshold
+        changes = np.flatnonzero(np.diff(inside.astype(np.int8))) + 1
+
+        # Interpolate the crossing between the last sample on one side and the first on the other
+        before, after = changes - 1, changes
+        span = readings[after] - readings[before]
+        fraction = np.divide(
+            threshold - readings[before], span, out=np.zeros_like(span), where=span != 0
+        )
+        crossings = odometer[before] + fraction * (odometer[after] - odometer[before])
+
+        rising = inside[after]
+        starts = crossings[rising]
+        ends = crossings[~rising]
+
+        if inside[0]:
+            starts = np.concatenate(([odometer[0]], starts))
+        if inside[-1]:
+            ends = np.concatenate((ends, [odometer[-1]]))
+
+        return np.column_stack((starts, ends))
+
+    def obstacle_span(
+            self,
+            side: Literal["left", "right", "front"],
+            threshold: float,
+            start: Optional[float] = None,
+            end: Optional[float] = None,
+    ) -> Optional[Tuple[float, float]]:
+        """
+        The widest obstacle seen by a sensor within the window
+        :return: (start, end) odometer readings, None if nothing was in range
+        """
+        edges = self.obstacle_edges(side, threshold, start, end)
+        if len(edges) == 0:
+            return None
+        widest = int(np.argmax(edges[:, 1] - edges[:, 0]))
+        return float(edges[widest, 0]), float(edges[widest, 1])
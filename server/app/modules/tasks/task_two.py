@@ -2,21 +2,21 @@ import logging
 import math
 import time
 from textwrap import dedent
-from typing import Literal, Callable
-
-from scipy.special.cython_special import spence
+from typing import Literal, Callable, Optional
 
 from app_types.primatives.cv import CvResponse
 from app_types.primatives.obstacle_label import ObstacleLabel
 from modules.camera.camera import Camera
 from modules.serial import STM
+from modules.serial.configuration import STM_TELEMETRY_PERIOD_MS
+from modules.serial.stm_replies import StmReply, StmDistance
 from modules.serial.stm_commands import (
     StmMoveToDistance,
     StmMove,
     StmWiggle,
     StmToggleMeasure,
     StmTurn,
-    StmStraight, StmSideHug, StmMoveUntilSideObstacle,
+    StmStraight, StmSideHug, StmMoveUntilSideObstacle, StmProgram, StmTelemetry,
 )
 from modules.web_server.connection_manager import ConnectionManager
 from utils.metaclass.singleton import Singleton
@@ -36,6 +36,10 @@ class TaskTwoRunner(metaclass=Singleton):
         OBSTACLE_WIDTH: int
 
         STEP_THREE_CLOSEUP_DISTANCE: int = 33  # Distance for the robot to MOVE_FORWARD to the second obstacle
+        STEP_ONE_CAPTURE_PROFILE: str = "centre"  # Capture profile for the first obstacle's arrow
+        STEP_THREE_CAPTURE_PROFILE: str = "centre"  # Capture profile for the second obstacle's arrow
+        CV_BURST_SIZE: int = 3  # Frames sent per arrow recognition, their labels are voted on
+        CV_RETRIES: int = 1  # Bursts retried when no arrow is voted for
         FALLBACK_STEP_THREE_DISTANCE: int = 80
 
         def __init__(self):
@@ -66,6 +70,9 @@ class TaskTwoRunner(metaclass=Singleton):
         """
         self.distance_to_backtrack: int = 0
 
+        # Bursts retried for the current arrow
+        self.cv_retries: int = 0
+
     """
     HELPER METHODS
     """
@@ -84,63 +91,120 @@ class TaskTwoRunner(metaclass=Singleton):
         """
         self.stm.send_stm_command_and_wait(StmWiggle())
 
-    def _move_forward_to_distance(self, distance: int) -> None:
+    def _move_forward_to_distance(self, distance: int) -> Optional[StmReply]:
         """
         Move forward until the "front_distance_threshold"
-        :return:
+        :return: Acknowledgement of the move
         """
-        self.stm.send_stm_command_and_wait(StmMoveToDistance(distance=distance))
+        return self.stm.send_stm_command_and_wait(StmMoveToDistance(distance=distance))[0]
 
-    def _handle_distance_result(self, payload: str) -> int:
+    def _handle_distance_result(self, reply: Optional[StmReply]) -> int:
         """
-        Function to parse the returned string, calculate the proper offset
-        :param payload: should be in the format of `fD{distance}`; e.g. `fD150.24`
+        Function to extract the distance covered from the STM reply
+        :param reply: should be a `StmDistance` frame; e.g. `fD150.24`
         :return:
         """
-        self.logger.info(f"Received: {payload}")
-        try:
-            dist_str = payload.replace("fD", "").strip()
-            self.logger.debug(f"Attempting to parse this as distance: [{dist_str}]")
-            return int(dist_str.split(".")[0])
-        except Exception:
+        self.logger.info(f"Received: {reply}")
+        if not isinstance(reply, StmDistance) or reply.distance is None:
             self.logger.warning("Unable to parse distance! Returning 0!")
             return 0
+        return int(reply.distance)
+
+    def _handle_telemetry_span(self, side: Literal["left", "right"], threshold: int, start: float, end: float) -> int:
+        """
+        Function to extract the length of an obstacle from the telemetry streamed while passing it
+        :param side: Side sensor facing the obstacle
+        :param threshold: Readings below this are the obstacle
+        :param start: Monotonic time the robot started passing the obstacle
+        :param end: Monotonic time the robot finished passing the obstacle
+        :return:
+        """
+        span = self.stm.telemetry.obstacle_span(side, threshold, start, end)
+        if span is None:
+            self.logger.warning("No obstacle in telemetry! Returning 0!")
+            return 0
+        self.logger.info(f"Obstacle seen from {span[0]:.1f} to {span[1]:.1f}")
+        return int(span[1] - span[0])
 
 
 
-    def _move_backwards_to_distance(self, distance: int) -> None:
+    def _move_backwards_to_distance(self, distance: int) -> Optional[StmReply]:
         """
         Move backwards until a safe distance to maneuver.
         Assumes that the robot is already at front_distance_threshold
-        :return:
+        :return: Acknowledgement of the move
+        """
+        return self.stm.send_stm_command_and_wait(StmMoveToDistance(distance, forward=False))[0]
+
+    def _request_arrow(
+            self,
+            reply: Optional[StmReply],
+            profile: Optional[str],
+            callback: Callable[[CvResponse], None],
+            use_cache: bool = True,
+    ) -> None:
         """
-        self.stm.send_stm_command_and_wait(StmMoveToDistance(distance, forward=False))
+        Captures a burst of the first frames after the robot stopped, rather than ones grabbed while still moving,
+        and sends them for recognition together
+        :param reply: Acknowledgement of the last move, now if it was not received
+        :param profile: Optional name of the capture profile
+        :param callback: Step to call with the voted `CvResponse`
+        :param use_cache: Answer frames from the CV cache, off for retries that must reach the slaves
+        :return: None
+        """
+        images = Camera().capture_burst(
+            self.config.CV_BURST_SIZE,
+            after=reply.received_at if reply is not None else time.monotonic(),
+            profile=profile,
+        )
+        # The step waiting on the result names the obstacle, so near-duplicate frames of it share cached answers.
+        # The robot waits on the answer, so slow slaves are hedged.
+        self.cm.slave_request_cv_burst(
+            images,
+            callback,
+            ignore_bullseye=True,
+            cache_context=(profile, callback.__name__) if use_cache else None,
+            hedge=True,
+        )
 
-    def _bypass_obstacle(self, direction: Literal["left", "right"]) -> None:
+    def _retry_arrow(self, profile: Optional[str], callback: Callable[[CvResponse], None]) -> bool:
+        """
+        Sends a new burst if retries are left, as the robot has not moved since the last one.
+        Its frames are near-duplicates of the failed burst, so they skip the cache and go to the slaves.
+        :return: True if a retry was sent
+        """
+        if self.cv_retries >= self.config.CV_RETRIES:
+            return False
+        self.cv_retries += 1
+        self.logger.info(f"Retrying arrow recognition ({self.cv_retries}/{self.config.CV_RETRIES})")
+        self._request_arrow(None, profile, callback, use_cache=False)
+        return True
+
+    @staticmethod
+    def bypass_program(direction: Literal["left", "right"], speed: int) -> StmProgram:
+        """
+        :param direction: Side to pass the first obstacle on
+        :param speed: Speed of every turn and straight
+        :return: S-shaped swerve around the obstacle, ending parallel to where it started
+        """
         toggle_flip = 1 if direction == "right" else -1
 
-        commands = [
-                StmTurn(angle=toggle_flip * 45, speed=self.config.turn_speed),
+        return StmProgram(
+                StmTurn(angle=toggle_flip * 45, speed=speed),
                 StmWiggle(),
-                StmTurn(angle=toggle_flip * -45, speed=self.config.turn_speed),
+                StmTurn(angle=toggle_flip * -45, speed=speed),
                 StmWiggle(),
-                StmStraight(distance=15, speed=self.config.turn_speed),
+                StmStraight(distance=15, speed=speed),
                 StmWiggle(),
-                StmTurn(angle=toggle_flip * -45, speed=self.config.turn_speed),
+                StmTurn(angle=toggle_flip * -45, speed=speed),
                 StmWiggle(),
-                StmTurn(angle=toggle_flip * 45, speed=self.config.turn_speed),
+                StmTurn(angle=toggle_flip * 45, speed=speed),
                 StmWiggle(),
-            ]
-
-        self.stm.send_stm_command(
-            *commands
-        )
-
-        self.logger.info("Catching leftover commands")
-
-        while self.stm.wait_receive(3):
-            pass
+            )
 
+    def _bypass_obstacle(self, direction: Literal["left", "right"]) -> None:
+        # Acks are matched to their commands, so the next step starts as soon as the last one lands
+        self.stm.execute(self.bypass_program(direction, self.config.turn_speed))
 
         self.distance_to_backtrack += self.config.BYPASS_DISTANCE
         self._log_tracked_distances("bypass obstacle")
@@ -156,7 +220,11 @@ class TaskTwoRunner(metaclass=Singleton):
 
         hug_side:Literal["left","right"] = "left" if direction != "left" else "right"
 
-        commands = [
+        # Stream samples while passing the obstacle instead of toggling the STM's own measurement
+        use_telemetry = STM_TELEMETRY_PERIOD_MS > 0
+
+        program = StmProgram(
+                *([StmTelemetry(STM_TELEMETRY_PERIOD_MS)] if use_telemetry else []),
                 StmTurn(angle=toggle_flip * -90, speed=self.config.turn_speed),
                 StmWiggle(),
                 StmWiggle(),
@@ -168,26 +236,39 @@ class TaskTwoRunner(metaclass=Singleton):
                 StmWiggle(),
                 StmWiggle(),
                 StmSideHug(hug_side, threshold=60, speed=self.config.turn_speed, forward=False),
-                StmMoveUntilSideObstacle(side=hug_side, threshold=60, speed=self.config.turn_speed)
-            ]
-
-        self.stm.send_stm_command_and_wait(*commands)
-
-        # Start measuring distance of the obstacle
-        self.stm.send_stm_command(StmToggleMeasure())
-        self.stm.wait_receive()
-
-        # Move to end of obstacle
-        self.stm.send_stm_command_and_wait(StmSideHug(hug_side, threshold=60, speed=self.config.turn_speed))
-
-        # Get distance covered
-        self.stm.send_stm_command(StmToggleMeasure())
-        width = self._handle_distance_result(self.stm.wait_receive())
+                StmMoveUntilSideObstacle(side=hug_side, threshold=60, speed=self.config.turn_speed),
+            )
+        if use_telemetry:
+            # Move to end of obstacle
+            program.commands.append(StmSideHug(hug_side, threshold=60, speed=self.config.turn_speed))
+        else:
+            program.commands.extend([
+                # Start measuring distance of the obstacle
+                StmToggleMeasure(),
+                # Move to end of obstacle
+                StmSideHug(hug_side, threshold=60, speed=self.config.turn_speed),
+                # Get distance covered
+                StmToggleMeasure(),
+            ])
+
+        replies = self.stm.execute(program)
+
+        if use_telemetry:
+            # Obstacle is alongside from when the robot reaches it until the hug ends
+            passed_at, hugged_at = replies[-2], replies[-1]
+            if passed_at is None or hugged_at is None:
+                self.logger.warning("Missing acknowledgement while passing obstacle!")
+                width = 0
+            else:
+                width = self._handle_telemetry_span(hug_side, 60, passed_at.received_at, hugged_at.received_at)
+        else:
+            width = self._handle_distance_result(replies[-1])
         self.config.OBSTACLE_WIDTH = width
         self._log_tracked_distances("go around obstacle")
 
         # Right turn
-        self.stm.send_stm_command_and_wait(*[
+        self.stm.execute(StmProgram(
+            *([StmTelemetry(0)] if use_telemetry else []),
             StmWiggle(),
             StmTurn(angle=toggle_flip * 90, speed=self.config.turn_speed),
             StmWiggle(),
@@ -195,7 +276,7 @@ class TaskTwoRunner(metaclass=Singleton):
             StmWiggle(),
             StmWiggle(),
             StmWiggle(),
-        ])
+        ))
 
 
 
@@ -228,10 +309,11 @@ class TaskTwoRunner(metaclass=Singleton):
 
 
         # Move to obstacle
-        self._move_forward_to_distance(50)
+        stopped = self._move_forward_to_distance(50)
 
         # Send CV request and pass step two as callback
-        self.cm.slave_request_cv(Camera().capture(), self._step_two, ignore_bullseye=True)
+        self.cv_retries = 0
+        self._request_arrow(stopped, self.config.STEP_ONE_CAPTURE_PROFILE, self._step_two)
 
     def _step_two(self, response: CvResponse) -> None:
         """
@@ -245,8 +327,9 @@ class TaskTwoRunner(metaclass=Singleton):
         self.logger.info("Executing STEP TWO")
 
         if response.label not in [ObstacleLabel.Shape_Left, ObstacleLabel.Shape_Right]:
+            if self._retry_arrow(self.config.STEP_ONE_CAPTURE_PROFILE, self._step_two):
+                return
             self.logger.error("Direction arrow not captured!")
-            # self.cm.slave_request_cv(Camera().capture(), self._step_two, ignore_bullseye=True)
         else:
             direction: Literal["left", "right"] = (
                 "left" if response.label == ObstacleLabel.Shape_Left else "right"
@@ -268,14 +351,12 @@ class TaskTwoRunner(metaclass=Singleton):
         # Move to threshold distance
         self.stm.send_stm_command_and_wait(StmStraight(5, 30, False))
 
-        self.stm.send_stm_command(StmToggleMeasure())
-        self.stm.wait_receive()
+        self.stm.send_stm_command_and_wait(StmToggleMeasure())
 
         self._move_forward_to_distance(self.config.STEP_THREE_CLOSEUP_DISTANCE)
 
         # Record distance between both obstacles
-        self.stm.send_stm_command(StmToggleMeasure())
-        distance_moved = self._handle_distance_result(self.stm.wait_receive())
+        distance_moved = self._handle_distance_result(*self.stm.send_stm_command_and_wait(StmToggleMeasure()))
         self.distance_to_backtrack += distance_moved
         self._log_tracked_distances("After tracking step three")
 
@@ -287,10 +368,11 @@ class TaskTwoRunner(metaclass=Singleton):
         self._log_tracked_distances("step three close up distance")
 
         # Move back to safe turning distance
-        self._move_backwards_to_distance(30)
+        stopped = self._move_backwards_to_distance(30)
 
         # Capture image and send callback
-        self.cm.slave_request_cv(Camera().capture(), self._step_four, ignore_bullseye=True)
+        self.cv_retries = 0
+        self._request_arrow(stopped, self.config.STEP_THREE_CAPTURE_PROFILE, self._step_four)
 
     def _step_four(self, response: CvResponse) -> None:
         """
@@ -303,8 +385,9 @@ class TaskTwoRunner(metaclass=Singleton):
         self.logger.info("Executing STEP FOUR")
 
         if response.label not in [ObstacleLabel.Shape_Left, ObstacleLabel.Shape_Right]:
+            if self._retry_arrow(self.config.STEP_THREE_CAPTURE_PROFILE, self._step_four):
+                return
             self.logger.error("Direction arrow not captured!")
-            # self.cm.slave_request_cv(Camera().capture(), self._step_four, ignore_bullseye=True)
         else:
             direction: Literal["left", "right"] = (
                 "left" if response.label == ObstacleLabel.Shape_Left else "right"
@@ -341,8 +424,8 @@ class TaskTwoRunner(metaclass=Singleton):
         self.logger.info(f"OFFSET DISTANCE: {offset_distance}")
         self.logger.info(f"BACKTRACK: {backtrack_distance}")
 
-        self.stm.send_stm_command(
-            *[
+        self.stm.execute(
+            StmProgram(
                 StmWiggle(),
                 # Move backtrack distance
                 StmStraight(
@@ -363,15 +446,21 @@ class TaskTwoRunner(metaclass=Singleton):
                 StmWiggle(),
                 # Close into car park
                 StmMoveToDistance(distance=20),
-            ]
+            )
         )
 
+        self._complete()
+
     def _complete(self) -> None:
         """
         Method to send the complete message to the android
         :return:
         """
         self.logger.info("Executing COMPLETE")
+        self.logger.info(f"Peephole optimizer saved {self.stm.optimizer.saved} command(s) this run")
+        self.logger.info(self.stm.metrics.report())
+        self.logger.info(f"CV cache: {self.cm.cv_cache.snapshot()}")
+        Camera().stop_streaming()
         self.end_callback()
         # self.android.send(AndroidMessage("status", "finish"))
 
@@ -385,5 +474,9 @@ class TaskTwoRunner(metaclass=Singleton):
         self.config = self.ConfigManeuver()
 
         self.end_callback = callback
+        self.stm.optimizer.reset()
+        self.stm.metrics.reset()
+        self.cm.cv_cache.clear()
+        Camera().start_streaming()
         self._step_one()
         # self._test()
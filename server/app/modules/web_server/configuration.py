@@ -0,0 +1,35 @@
+# SLAVE REQUEST SETTINGS
+
+CV_CACHE_SIZE = 32  # recent frames whose CV results are kept
+CV_CACHE_HASH_SIZE = 16  # side of the perceptual hash, 16 gives 256 bits
+CV_CACHE_THRESHOLD = 10  # max differing hash bits for a frame to reuse a cached result
+CV_CACHE_MAX_AGE = 30.0  # seconds a cached result can be reused for
+
+# OBSERVER SETTINGS
+
+PREVIEW_PROFILE = "preview"  # capture profile of the live preview sent to observers
+OBSERVER_MAX_FPS = 5.0  # default preview frames per second per observer, overridden by ?fps= on /ws/observe
+OBSERVER_MAX_KBPS = 2000  # default preview bandwidth per observer, overridden by ?kbps=, 0 for no cap
+OBSERVER_EVENT_QUEUE = 64  # events kept for an observer that falls behind, the oldest are dropped
+
+# DISPATCH SETTINGS
+
+SLAVE_MAX_IN_FLIGHT = 2  # requests a slave works on at once, the rest are queued for the first free slave
+SLAVE_LATENCY_ALPHA = 0.3  # weight of the newest response time in each slave's latency average
+SLAVE_LATENCY_WINDOW = 64  # recent response times kept per slave for percentiles
+HEDGE_PERCENTILE = 95  # a hedged request goes to a second slave once the first is slower than this percentile
+HEDGE_DEFAULT_DELAY = 1.0  # seconds before hedging on a slave with too few response times
+HEDGE_MIN_DELAY = 0.05  # seconds always waited before hedging
+HEDGE_MIN_SAMPLES = 5  # response times needed before the percentile is used
+
+# QUORUM SETTINGS
+
+CV_QUORUM_K = 2  # answers combined for a quorum CV request
+CV_QUORUM_N = 3  # slaves a quorum CV request is sent to, fewer if fewer are free
+CV_QUORUM_DEADLINE = 1.5  # seconds a quorum CV request waits for k answers before combining what it has
+
+# TIMEOUT SETTINGS
+
+CV_REQUEST_TIMEOUT = 10.0  # seconds a CV request waits for a slave, then its callback gets an UNKNOWN label
+ALGO_REQUEST_TIMEOUT = 30.0  # seconds an algo request waits for a slave
+MAX_PENDING_RESPONSES = 256  # requests awaiting an answer, the oldest expires early once reached
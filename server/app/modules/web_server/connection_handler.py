@@ -2,6 +2,7 @@ import logging
 
 from fastapi import WebSocket, WebSocketDisconnect
 
+from app_types.data.slave_models import SlaveCapabilities
 from app_types.primatives.cv import CvResponse
 from app_types.primatives.command import AlgoCommandResponse
 from modules.web_server.connection_manager import ConnectionManager
@@ -18,15 +19,18 @@ async def connection_handler(websocket: WebSocket):
         while True:
             data = await websocket.receive_json()
             logger.info(f"Received: {data}")
-            
+
+            if "capabilities" in data.keys():
+                logger.info("Parsing data as SlaveCapabilities")
+                ConnectionManager().set_capabilities(websocket, SlaveCapabilities.model_validate(data))
             if "label" in data.keys():
                 logger.info("Parsing data as CvResponse")
                 cvRes = CvResponse.model_validate(data)
-                ConnectionManager().handle_cv_response_callback(cvRes)
+                ConnectionManager().handle_cv_response_callback(cvRes, websocket)
             if "commands" in data.keys():
                 logger.info("Parsing data as AlgoCommandResponse")
                 algoRes = AlgoCommandResponse.model_validate(data)
-                ConnectionManager().handle_algo_response_callback(algoRes)
+                ConnectionManager().handle_algo_response_callback(algoRes, websocket)
 
             # await websocket.send_text(data)
     except WebSocketDisconnect:
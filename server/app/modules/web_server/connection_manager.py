@@ -1,8 +1,11 @@
 import asyncio
+import base64
 import logging
+import threading
 from asyncio import Future
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
-from typing import List, Optional, Dict, Set, Coroutine, Callable, Union
+from typing import List, Optional, Dict, Set, Coroutine, Callable, Union, Hashable, Tuple
 from uuid import uuid4
 
 from fastapi import WebSocket
@@ -13,48 +16,234 @@ from app_types.data.slave_models import (
     SlaveWorkRequestType,
     SlaveWorkRequestPayloadAlgo,
     SlaveWorkRequestPayloadImageRecognition,
+    SlaveCapabilities,
+    SlaveCapability,
+    SlaveBinaryImageHeader,
+    SlaveCancelRequest,
+    pack_binary_request,
 )
 from app_types.obstacle import Obstacle
 from app_types.primatives.command import Command, AlgoCommandResponse
-from app_types.primatives.cv import CvResponse
-from app_types.primatives.obstacle_label import ObstacleLabel
+from app_types.primatives.cv import CvResponse, CvQuorumResponse
+from app_types.primatives.obstacle_label import ObstacleLabel, ABSTAINING_LABELS
+from utils.deadlines import DeadlineScheduler
 from utils.metaclass.singleton import Singleton
+from utils.perceptual_cache import PerceptualCache, dhash
+from utils.voting import weighted_vote
+from .configuration import (
+    CV_CACHE_SIZE, CV_CACHE_HASH_SIZE, CV_CACHE_THRESHOLD, CV_CACHE_MAX_AGE, OBSERVER_MAX_FPS, OBSERVER_MAX_KBPS,
+    SLAVE_MAX_IN_FLIGHT, SLAVE_LATENCY_ALPHA, SLAVE_LATENCY_WINDOW,
+    HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES,
+    CV_REQUEST_TIMEOUT, ALGO_REQUEST_TIMEOUT, MAX_PENDING_RESPONSES,
+)
+from .dispatcher import SlaveDispatcher
+from .observers import ObserverHub
+from .quorum import QuorumCollector, QuorumPolicy
 from pydantic import ValidationError
 
 
 class ConnectionManager(metaclass=Singleton):
     connections: List[WebSocket] = []
     observers: List[WebSocket] = []
+    capabilities: Dict[WebSocket, Set[str]] = {}
     logger = logging.getLogger("Connection Manager")
     pending_responses: Dict[
         str, Callable[[Union[AlgoCommandResponse, CvResponse]], None]
     ] = {}
+    # Called with the request id instead of the callback, if a request is not answered in time
+    timeout_handlers: Dict[str, Callable[[str], None]] = {}
+    # Requests whose callback must not block, and runs on the event loop instead of the callback thread
+    loop_callbacks: Set[str] = set()
 
     def __init__(self):
         self.loop = asyncio.get_event_loop()  # Store the main event loop
+        # Callbacks drive the robot with blocking STM calls, so they run in order off the event loop
+        self._callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="CM-Callback")
+        # Results of recent frames, so near-duplicates sent from the same pose skip the slaves
+        self.cv_cache: PerceptualCache[CvResponse] = PerceptualCache(
+            CV_CACHE_SIZE, CV_CACHE_THRESHOLD, CV_CACHE_MAX_AGE
+        )
+        # Live preview and capture events for observers
+        self.observer_hub = ObserverHub()
+        # Picks the slave for each request, only touched on self.loop
+        self.dispatcher = SlaveDispatcher(
+            SLAVE_MAX_IN_FLIGHT,
+            SLAVE_LATENCY_ALPHA,
+            cancel=self._cancel_slave_request,
+            hedge_percentile=HEDGE_PERCENTILE,
+            hedge_default_delay=HEDGE_DEFAULT_DELAY,
+            hedge_min_delay=HEDGE_MIN_DELAY,
+            hedge_min_samples=HEDGE_MIN_SAMPLES,
+            window=SLAVE_LATENCY_WINDOW,
+        )
+        # Quorum requests still collecting answers, only touched on self.loop
+        self.quorums: Dict[str, QuorumCollector] = {}
+        # Every pending request expires, so lost requests neither leak nor keep their caller waiting
+        self.deadlines = DeadlineScheduler(self._expire_request, self.loop)
+        self.timeouts = 0
+        self.evicted = 0
 
     async def connect(self, websocket: WebSocket) -> None:
         logging.getLogger().info(
             "Adding websocket to all connections in ConnectionManager"
         )
+        # Slave sockets belong to the server's loop, so requests from other threads are sent on it
+        self.loop = asyncio.get_running_loop()
+        self.deadlines.bind(self.loop)
         self.connections.append(websocket)
+        await self.dispatcher.add(websocket)
 
-    async def observer(self, websocket: WebSocket) -> None:
-        logging.getLogger().info("Adding websocket to observers in ConnectionManager")
+    async def observer(
+            self, websocket: WebSocket, fps: float = OBSERVER_MAX_FPS, kbps: float = OBSERVER_MAX_KBPS
+    ) -> None:
+        """
+        :param websocket: Observer's socket
+        :param fps: Max preview frames per second sent to it
+        :param kbps: Max preview kilobits per second sent to it, 0 for no cap
+        """
+        logging.getLogger().info(f"Adding websocket to observers in ConnectionManager, {fps} fps, {kbps} kbps")
         self.observers.append(websocket)
+        await self.observer_hub.add(websocket, fps, kbps)
 
     def remove_connection(self, websocket: WebSocket) -> None:
         logging.getLogger().info("Removing websocket connection from ConnectionManager")
         self.connections.remove(websocket)
+        self.capabilities.pop(websocket, None)
+        self._run_async(self.dispatcher.remove(websocket))
+
+    def set_capabilities(self, websocket: WebSocket, capabilities: SlaveCapabilities) -> None:
+        self.logger.info(f"Slave capabilities: {capabilities.capabilities}")
+        self.capabilities[websocket] = set(capabilities.capabilities)
+
+    def _supports(self, websocket: WebSocket, capability: SlaveCapability) -> bool:
+        return capability.value in self.capabilities.get(websocket, ())
 
     def remove_observer(self, websocket: WebSocket) -> None:
         logging.getLogger().info("Removing websocket observer from ConnectionManager")
-        self.observers.remove(websocket)
+        if websocket in self.observers:
+            self.observers.remove(websocket)
+        self.observer_hub.remove(websocket)
 
     """
     PRIVATE METHODS
     """
 
+    async def _cancel_slave_request(self, websocket: WebSocket, req_id: str) -> bool:
+        """
+        Tells a slave to drop a request another slave already answered
+        :return: False if the slave does not support cancelling
+        """
+        if not self._supports(websocket, SlaveCapability.Cancel):
+            return False
+        await websocket.send_text(SlaveCancelRequest(id=req_id).model_dump_json())
+        return True
+
+    def _add_pending(
+            self,
+            req_id: str,
+            callback: Callable,
+            timeout: float,
+            on_timeout: Optional[Callable[[str], None]] = None,
+            on_loop: bool = False,
+    ) -> None:
+        """
+        Registers the callback for a request, which expires after `timeout` seconds.
+        Once `MAX_PENDING_RESPONSES` are pending, the oldest expires early to make room.
+        :param req_id: id the slave will answer with
+        :param callback: Called with the response
+        :param timeout: Seconds to wait for the response
+        :param on_timeout: Called with the request id if it expires, on the callback thread
+        :param on_loop: Run the callback, or `on_timeout`, on the event loop, e.g. to resolve a future
+        """
+        while len(self.pending_responses) >= MAX_PENDING_RESPONSES:
+            oldest = next(iter(self.pending_responses), None)
+            if oldest is None:
+                break
+            self.logger.warning(f"{len(self.pending_responses)} requests pending, expiring {oldest} early")
+            self.evicted += 1
+            self.deadlines.cancel(oldest)
+            self._expire_request(oldest)
+
+        self.pending_responses[req_id] = callback
+        if on_timeout is not None:
+            self.timeout_handlers[req_id] = on_timeout
+        if on_loop:
+            self.loop_callbacks.add(req_id)
+        self.deadlines.add(req_id, timeout)
+
+    def _expire_request(self, req_id: str) -> None:
+        """
+        Drops a request that was not answered in time, and runs its timeout handler in place of the callback
+        """
+        # Popped once, so a response racing the deadline runs either the callback or the handler
+        if self.pending_responses.pop(req_id, None) is None:
+            return
+        on_timeout = self.timeout_handlers.pop(req_id, None)
+        on_loop = req_id in self.loop_callbacks
+        self.loop_callbacks.discard(req_id)
+        self.timeouts += 1
+        self.logger.warning(f"Request {req_id} timed out, {self.timeouts} so far")
+        self.observer_hub.publish("TIMEOUT", req_id)
+        self._run_async(self.dispatcher.abandon(req_id))
+        if on_timeout is not None:
+            self._submit_callback(req_id, on_timeout, req_id, on_loop)
+
+    def cancel_request(self, req_id: str) -> bool:
+        """
+        Drops a pending request without running its callback, e.g. once its caller stopped waiting
+        :return: False if it was no longer pending
+        """
+        if self.pending_responses.pop(req_id, None) is None:
+            return False
+        self.timeout_handlers.pop(req_id, None)
+        self.loop_callbacks.discard(req_id)
+        self.deadlines.cancel(req_id)
+        self._run_async(self.dispatcher.abandon(req_id))
+        return True
+
+    def pending_snapshot(self) -> dict:
+        next_deadline = self.deadlines.next_deadline()
+        return {
+            "pending": len(self.pending_responses),
+            "timeouts": self.timeouts,
+            "evicted": self.evicted,
+            "next_deadline_s": round(next_deadline, 3) if next_deadline is not None else None,
+        }
+
+    def _run_callback(self, req_id: str, response: Union[AlgoCommandResponse, CvResponse]) -> None:
+        """
+        Runs the pending callback for a response on the callback thread, so it never blocks the event loop
+        :param req_id: id of the request the response is for
+        :param response: Response from the slave
+        :return: None
+        """
+        callback = self.pending_responses.pop(req_id, None)
+        if callback is None:
+            return
+        self.timeout_handlers.pop(req_id, None)
+        on_loop = req_id in self.loop_callbacks
+        self.loop_callbacks.discard(req_id)
+        self.deadlines.cancel(req_id)
+        self._submit_callback(req_id, callback, response, on_loop)
+
+    def _submit_callback(
+            self,
+            req_id: str,
+            callback: Callable,
+            response: Union[AlgoCommandResponse, CvResponse, str],
+            on_loop: bool = False,
+    ) -> None:
+        def run():
+            try:
+                callback(response)
+            except Exception:
+                self.logger.exception(f"Callback for {req_id} failed")
+
+        if on_loop:
+            self.loop.call_soon_threadsafe(run)
+        else:
+            self._callback_executor.submit(run)
+
     # def _run_async(self, coro: Coroutine):
     #     loop = asyncio.get_event_loop()
     #     if loop.is_running():
@@ -96,13 +285,7 @@ class ConnectionManager(metaclass=Singleton):
     ALGO RELATED STUFF
     """
 
-    async def _broadcast_algo_req(
-            self, req_id: str, obstacles: List[Obstacle]
-    ) -> List[Command]:
-        if not self.connections:
-            self.logger.error("No slave connections available to process algo!")
-            return []
-
+    async def _dispatch_algo_req(self, req_id: str, obstacles: List[Obstacle]) -> None:
         req = SlaveWorkRequest(
             id=req_id,
             type=SlaveWorkRequestType.Algorithm,
@@ -111,75 +294,396 @@ class ConnectionManager(metaclass=Singleton):
             ),
         ).model_dump_json()
 
-        tasks = [asyncio.create_task(c.send_text(req)) for c in self.connections]
+        async def send(websocket: WebSocket) -> None:
+            await websocket.send_text(req)
 
-        await asyncio.gather(*tasks)
+        await self.dispatcher.dispatch(req_id, send)
 
-    def handle_algo_response_callback(self, response: AlgoCommandResponse) -> None:
+    def handle_algo_response_callback(
+            self, response: AlgoCommandResponse, websocket: Optional[WebSocket] = None
+    ) -> None:
         self.logger.info(f"Activating algo callback for {response.id}")
+        self.observer_hub.publish("ALGO_RESPONSE", response.id, commands=len(response.commands))
+        self._run_async(self.dispatcher.complete(response.id, websocket))
         if response.id in self.pending_responses.keys():
             self.logger.info(f"Running callback for {response.id}")
-            self.pending_responses[response.id](response)
-            self.pending_responses.pop(response.id, None)
+            self._run_callback(response.id, response)
             return
         self.logger.info(
             f"Matching callback no longer found for {response.id}! Has it been executed?"
         )
 
     def slave_request_algo(
-            self, obstacles: List[Obstacle], callback: Callable[[AlgoCommandResponse], None]
-    ) -> None:
+            self,
+            obstacles: List[Obstacle],
+            callback: Callable[[AlgoCommandResponse], None],
+            timeout: float = ALGO_REQUEST_TIMEOUT,
+            on_timeout: Optional[Callable[[str], None]] = None,
+            on_loop: bool = False,
+    ) -> str:
+        """
+        :param obstacles: Obstacles to plan a path around
+        :param callback: callback function that takes `AlgoCommandResponse` as the only arg, and returns None.
+        :param timeout: Seconds to wait for a slave to answer
+        :param on_timeout: Optional function called with the request id instead, if no slave answers in time
+        :param on_loop: Run the callback on the server's event loop instead of the callback thread, it must not block
+        :return: id of the request
+        """
         self.logger.info("Sending Algo request to slaves!")
         req_id = str(uuid4())
-        self.pending_responses[req_id] = callback
-        asyncio.run(self._broadcast_algo_req(req_id, obstacles))
-        # TODO implement callback logic
+        self._add_pending(req_id, callback, timeout, on_timeout, on_loop)
+        self.observer_hub.publish("ALGO_REQUEST", req_id, obstacles=len(obstacles))
+        # Sent on the server's loop, the dispatcher and slave sockets belong to it
+        self._run_async(self._dispatch_algo_req(req_id, obstacles))
+        return req_id
 
     """
     CV RELATED STUFF
     """
 
-    async def _broadcast_cv_req(self, req_id: str, image: str, ignore_bullseye: bool) -> None:
-        self.logger.info("Entering _broadcast_cv_req")
+    async def _dispatch_cv_req(
+            self,
+            req_id: str,
+            image: Union[str, bytes],
+            ignore_bullseye: bool,
+            hedge: bool = False,
+            quorum: Optional[QuorumPolicy] = None,
+    ) -> None:
+        formats: Dict[bool, Union[str, bytes]] = {}
 
-        if not self.connections:
-            self.logger.error("No slave connections available to process cv!")
-            return None
+        def build(binary: bool) -> Union[str, bytes]:
+            # Each format is built at most once, even if the request is sent again after its slave left
+            if binary not in formats:
+                if binary:
+                    jpeg = base64.b64decode(image) if isinstance(image, str) else image
+                    formats[binary] = pack_binary_request(
+                        SlaveBinaryImageHeader(id=req_id, ignore_bullseye=ignore_bullseye), jpeg
+                    )
+                else:
+                    formats[binary] = SlaveWorkRequest(
+                        id=req_id,
+                        type=SlaveWorkRequestType.ImageRecognition,
+                        payload=SlaveWorkRequestPayloadImageRecognition(
+                            image=image if isinstance(image, str) else base64.b64encode(image).decode("ascii"),
+                            ignore_bullseye=ignore_bullseye
+                        ),
+                    ).model_dump_json()
+            return formats[binary]
 
-        req = SlaveWorkRequest(
-            id=req_id,
-            type=SlaveWorkRequestType.ImageRecognition,
-            payload=SlaveWorkRequestPayloadImageRecognition(
-                image=image,
-                ignore_bullseye=ignore_bullseye
-            ),
-        ).model_dump_json()
+        async def send(websocket: WebSocket) -> None:
+            if self._supports(websocket, SlaveCapability.BinaryImages):
+                await websocket.send_bytes(build(True))
+            else:
+                await websocket.send_text(build(False))
 
-        tasks = [asyncio.create_task(c.send_text(req)) for c in self.connections]
+        if quorum is None:
+            await self.dispatcher.dispatch(req_id, send, hedge)
+            return
 
-        await asyncio.gather(*tasks)
+        collector = QuorumCollector(req_id, quorum, self._finish_quorum)
+        self.quorums[req_id] = collector
+        collector.start(await self.dispatcher.dispatch(req_id, send, replicas=quorum.n))
 
-    def handle_cv_response_callback(self, response: CvResponse) -> None:
+    def _finish_quorum(self, result: CvQuorumResponse) -> None:
+        """
+        [Event Loop] Hands a combined quorum result to the request's callback
+        """
+        self.quorums.pop(result.id, None)
+        # Whether k answered or the deadline passed, the other replicas are no longer needed, so their slaves are freed
+        self._run_async(self.dispatcher.abandon(result.id))
+        self.logger.info(
+            f"Quorum for {result.id}: {result.label}, agreed {result.agreed} of {result.responded} "
+            f"({result.requested} asked)"
+        )
+        self.observer_hub.publish(
+            "CV_QUORUM", result.id, label=result.label, agreed=result.agreed, responded=result.responded
+        )
+        self._run_callback(result.id, result)
+
+    def handle_cv_response_callback(self, response: CvResponse, websocket: Optional[WebSocket] = None) -> None:
         self.logger.info(f"Activating CV callback for {response.id}")
+        self.observer_hub.publish(
+            "CV_RESPONSE", response.id, label=response.label, confidence=response.confidence
+        )
+        # Completed before the quorum can finish and abandon the request, so this answer's latency is still recorded
+        self._run_async(self.dispatcher.complete(response.id, websocket))
+        collector = self.quorums.get(response.id)
+        if collector is not None:
+            collector.add(self.dispatcher.name_of(websocket), response)
+            return
+
+        # With hedging, only the first answer finds the callback
         if response.id in self.pending_responses.keys():
             self.logger.info(f"Running callback for {response.id}")
-            self.pending_responses[response.id](response)
-            self.pending_responses.pop(response.id, None)
+            self._run_callback(response.id, response)
             return
         self.logger.info(
             f"Matching callback no longer found for {response.id}! Has it been executed?"
         )
 
+    def _lookup_cv_cache(
+            self, image: Union[str, bytes], context: Hashable
+    ) -> Tuple[Optional[int], Optional[CvResponse]]:
+        """
+        :param image: JPEG bytes, or base64 string of the JPEG
+        :param context: Scene the image is of, None to not use the cache
+        :return: Hash of the image and the cached response of a near-duplicate, None for either if not used or missed
+        """
+        if context is None:
+            return None, None
+        image_hash = dhash(base64.b64decode(image) if isinstance(image, str) else image, CV_CACHE_HASH_SIZE)
+        return image_hash, self.cv_cache.get(image_hash, context)
+
+    @staticmethod
+    def _unknown_on_timeout(callback: Callable[[CvResponse], None]) -> Callable[[str], None]:
+        """
+        Answers a timed out CV request like a slave that recognised nothing, so callers retry or move on.
+        Not cached, so a later request for the same scene still goes to the slaves.
+        """
+        def on_timeout(req_id: str) -> None:
+            callback(CvResponse(id=req_id, label=ObstacleLabel.Unknown))
+
+        return on_timeout
+
+    @staticmethod
+    def _cacheable(response: CvResponse) -> bool:
+        """
+        Nothing recognised, or a quorum that ran out of time, is not worth reusing,
+        else a retry from the same pose would get the same failure back instead of asking a slave
+        """
+        if response.label is None or response.label in ABSTAINING_LABELS:
+            return False
+        return not isinstance(response, CvQuorumResponse) or response.reached
+
+    def _caching(
+            self, image_hash: int, context: Hashable, callback: Callable[[CvResponse], None]
+    ) -> Callable[[CvResponse], None]:
+        def store(response: CvResponse) -> None:
+            if self._cacheable(response):
+                self.cv_cache.put(image_hash, response, context)
+            callback(response)
+
+        return store
+
     def slave_request_cv(
-            self, image: str, callback: Callable[[CvResponse], None], ignore_bullseye: bool = False
-    ) -> None:
+            self,
+            image: Union[str, bytes],
+            callback: Callable[[CvResponse], None],
+            ignore_bullseye: bool = False,
+            cache_context: Hashable = None,
+            hedge: bool = False,
+            quorum: Optional[QuorumPolicy] = None,
+            timeout: float = CV_REQUEST_TIMEOUT,
+            on_loop: bool = False,
+    ) -> str:
         """
-        :param image: base64 string of image
+        :param image: JPEG bytes, or base64 string of the JPEG
         :param callback: callback function that takes `CvResponse` as the only arg, and returns None.
         :param ignore_bullseye: Specify if bullseye detections should be ignored.
-        :return: None
+        :param cache_context: Optional scene the image is of, e.g. the obstacle. If set, a near-duplicate of a
+            recent image of the same scene gets its cached response instead of going to the slaves.
+        :param hedge: For latency critical requests, also send to a second slave if the first is slow to answer
+        :param quorum: Optional policy to send the image to several slaves, and call back once with their
+            combined `CvQuorumResponse`, instead of with the first answer. Hedging is not used with a quorum.
+        :param timeout: Seconds to wait for an answer, the callback gets an UNKNOWN label after that
+        :param on_loop: Run the callback on the server's event loop instead of the callback thread, it must not block
+        :return: id of the request
         """
-        self.logger.info("Sending CV request to slaves!")
         req_id = str(uuid4())
-        self.pending_responses[req_id] = callback
-        self._run_async(self._broadcast_cv_req(req_id, image, ignore_bullseye))
+        context = (cache_context, ignore_bullseye) if cache_context is not None else None
+        image_hash, cached = self._lookup_cv_cache(image, context)
+        self.observer_hub.publish("CV_REQUEST", req_id, frames=1, cached=int(cached is not None))
+        if cached is not None:
+            self.logger.info(f"CV cache hit for {cache_context}: {cached.label}, {self.cv_cache.snapshot()}")
+            self._submit_callback(req_id, callback, cached.model_copy(update={"id": req_id}), on_loop)
+            return req_id
+
+        self.logger.info("Sending CV request to slaves!")
+        on_timeout = self._unknown_on_timeout(callback)
+        if image_hash is not None:
+            callback = self._caching(image_hash, context, callback)
+        self._add_pending(req_id, callback, timeout, on_timeout, on_loop)
+        self._run_async(self._dispatch_cv_req(req_id, image, ignore_bullseye, hedge and quorum is None, quorum))
+        return req_id
+
+    async def _dispatch_cv_burst(
+            self, req_ids: List[str], images: List[Union[str, bytes]], ignore_bullseye: bool, hedge: bool
+    ) -> None:
+        # One request per frame, so the frames of a burst are spread over the slaves
+        for req_id, image in zip(req_ids, images):
+            await self._dispatch_cv_req(req_id, image, ignore_bullseye, hedge)
+
+    def slave_request_cv_burst(
+            self,
+            images: List[Union[str, bytes]],
+            callback: Callable[[CvResponse], None],
+            ignore_bullseye: bool = False,
+            cache_context: Hashable = None,
+            hedge: bool = False,
+            timeout: float = CV_REQUEST_TIMEOUT,
+    ) -> None:
+        """
+        Sends several frames of the same scene together, and calls back once with their confidence-weighted vote.
+        :param images: JPEG bytes, or base64 strings of the JPEGs
+        :param callback: callback function that takes the voted `CvResponse` as the only arg, and returns None.
+        :param ignore_bullseye: Specify if bullseye detections should be ignored.
+        :param cache_context: Optional scene the frames are of, frames with a cached response are not sent
+        :param hedge: Hedge each frame's request, see `slave_request_cv`
+        :param timeout: Seconds to wait for each frame's answer, a frame not answered in time abstains
+        :return: None
+        """
+        burst_id = str(uuid4())
+        req_ids = [f"{burst_id}:{i}" for i in range(len(images))]
+        responses: List[CvResponse] = []
+        lock = threading.Lock()
+
+        def collect(response: CvResponse) -> None:
+            with lock:
+                responses.append(response)
+                if len(responses) < len(req_ids):
+                    return
+
+            vote = weighted_vote(
+                ((r.label, r.confidence) for r in responses), abstain=ABSTAINING_LABELS
+            )
+            self.logger.info(f"Burst {burst_id} voted {vote}")
+            self.observer_hub.publish(
+                "CV_VOTE",
+                burst_id,
+                label=vote.label if vote is not None else ObstacleLabel.Unknown,
+                confidence=vote.confidence if vote is not None else None,
+            )
+            callback(CvResponse(
+                id=burst_id,
+                label=vote.label if vote is not None else ObstacleLabel.Unknown,
+                confidence=vote.confidence if vote is not None else None,
+            ))
+
+        context = (cache_context, ignore_bullseye) if cache_context is not None else None
+        sent_ids, sent_images = [], []
+        for req_id, image in zip(req_ids, images):
+            image_hash, cached = self._lookup_cv_cache(image, context)
+            if cached is not None:
+                self._submit_callback(req_id, collect, cached.model_copy(update={"id": req_id}))
+                continue
+            self._add_pending(
+                req_id,
+                self._caching(image_hash, context, collect) if image_hash is not None else collect,
+                timeout,
+                self._unknown_on_timeout(collect),
+            )
+            sent_ids.append(req_id)
+            sent_images.append(image)
+
+        self.observer_hub.publish("CV_REQUEST", burst_id, frames=len(req_ids), cached=len(req_ids) - len(sent_ids))
+        if len(sent_ids) < len(req_ids):
+            self.logger.info(
+                f"CV cache hit for {len(req_ids) - len(sent_ids)} of {len(req_ids)} frame(s) of {cache_context}, "
+                f"{self.cv_cache.snapshot()}"
+            )
+        if sent_ids:
+            self.logger.info(f"Sending burst of {len(sent_ids)} CV requests to slaves!")
+            self._run_async(self._dispatch_cv_burst(sent_ids, sent_images, ignore_bullseye, hedge))
+
+    """
+    AWAITABLE API
+    """
+
+    @staticmethod
+    def _resolver(future: Future) -> Callable:
+        """
+        :return: Callback resolving the future with a response, or failing it with an exception.
+            Run on the server's loop, it only hops loops if the future belongs to another one.
+        """
+        def resolve(result) -> None:
+            if future.done():
+                return
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+        def callback(result) -> None:
+            loop = future.get_loop()
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                resolve(result)
+            else:
+                loop.call_soon_threadsafe(resolve, result)
+
+        return callback
+
+    async def _await_request(self, future: Future, req_id: str):
+        try:
+            return await future
+        finally:
+            # Cancelled by the caller, e.g. by asyncio.wait_for, so the slaves stop working on it
+            if not future.done() or future.cancelled():
+                self.cancel_request(req_id)
+
+    async def request_cv(
+            self,
+            image: Union[str, bytes],
+            ignore_bullseye: bool = False,
+            cache_context: Hashable = None,
+            hedge: bool = False,
+            quorum: Optional[QuorumPolicy] = None,
+            timeout: float = CV_REQUEST_TIMEOUT,
+    ) -> CvResponse:
+        """
+        Awaitable `slave_request_cv`. The response resolves a future on the server's loop,
+        so requests can be run together with `asyncio.gather`.
+        :return: Response of the slave, the combined `CvQuorumResponse` with a quorum,
+            or an UNKNOWN label if no slave answered in time
+        """
+        future = asyncio.get_running_loop().create_future()
+        req_id = self.slave_request_cv(
+            image, self._resolver(future), ignore_bullseye, cache_context, hedge, quorum, timeout, on_loop=True
+        )
+        return await self._await_request(future, req_id)
+
+    async def request_algo(
+            self, obstacles: List[Obstacle], timeout: float = ALGO_REQUEST_TIMEOUT
+    ) -> AlgoCommandResponse:
+        """
+        Awaitable `slave_request_algo`
+        :raises asyncio.TimeoutError: If no slave answered in time
+        """
+        future = asyncio.get_running_loop().create_future()
+        resolve = self._resolver(future)
+        req_id = self.slave_request_algo(
+            obstacles,
+            resolve,
+            timeout,
+            on_timeout=lambda rid: resolve(asyncio.TimeoutError(f"Algo request {rid} timed out")),
+            on_loop=True,
+        )
+        return await self._await_request(future, req_id)
+
+    def _run_blocking(self, coro: Coroutine):
+        if not self.loop.is_running():
+            coro.close()
+            raise RuntimeError("The server's event loop is not running")
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            coro.close()
+            raise RuntimeError("Blocking request made from the server's event loop, await it instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def request_cv_blocking(self, image: Union[str, bytes], **kwargs) -> CvResponse:
+        """
+        [Any Thread but the Event Loop] Sends a CV request and waits for its response, see `request_cv`
+        """
+        return self._run_blocking(self.request_cv(image, **kwargs))
+
+    def request_algo_blocking(self, obstacles: List[Obstacle], **kwargs) -> AlgoCommandResponse:
+        """
+        [Any Thread but the Event Loop] Sends an algo request and waits for its response, see `request_algo`
+        """
+        return self._run_blocking(self.request_algo(obstacles, **kwargs))
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from fastapi import WebSocket
+
+# Sends a request to the slave it was assigned to
+SendRequest = Callable[[WebSocket], Awaitable[None]]
+# Tells a slave to drop a request, returns False if the slave cannot be told
+CancelRequest = Callable[[WebSocket, str], Awaitable[bool]]
+
+
+class SlaveState:
+    """
+    Load and speed of a single slave, as seen by the dispatcher.
+    """
+
+    def __init__(self, websocket: WebSocket, window: int):
+        """
+        :param websocket: Slave's socket
+        :param window: Recent latencies kept for percentiles
+        """
+        self.websocket = websocket
+        self.name = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else str(id(websocket))
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None  # seconds, None until its first response
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.completed = 0
+
+    @property
+    def expected_wait(self) -> float:
+        """
+        Seconds until a new request would be answered, if the slave works through its requests one at a time.
+        Slaves that have not answered yet count as instant, so every new slave gets tried.
+        """
+        return (self.in_flight + 1) * (self.latency_ewma or 0.0)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        :param p: Percentile in [0, 100]
+        :return: Percentile of the recent latencies, None if there are none
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        p95 = self.percentile(95)
+        return {
+            "in_flight": self.in_flight,
+            "latency_ewma_ms": round(self.latency_ewma * 1e3, 1) if self.latency_ewma is not None else None,
+            "latency_p95_ms": round(p95 * 1e3, 1) if p95 is not None else None,
+            "completed": self.completed,
+        }
+
+
+class InFlightRequest:
+    """
+    A dispatched request and every slave working on it. Hedged and replicated requests can be on more than one.
+    """
+
+    def __init__(self, req_id: str, send: SendRequest, hedge: bool, replicas: int = 1):
+        self.req_id = req_id
+        self.send = send
+        self.hedge = hedge
+        self.replicas = replicas
+        self.attempts: Dict[WebSocket, float] = {}  # slave -> time.monotonic() it was sent
+        self.primary: Optional[WebSocket] = None  # slave it was sent to first, the others are hedges
+        self.done = False
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class SlaveDispatcher:
+    """
+    Sends each request to a single slave, the one expected to answer first, instead of to every slave.
+    Slaves take at most `max_in_flight` requests at a time, the rest wait in a queue for the first free slave.
+
+    A hedged request is also sent to a second slave if the first has not answered within its p95 latency.
+    The first answer wins, and the other slave is told to cancel if it can.
+    A replicated request is sent to several slaves at once, and every answer is wanted, e.g. for a quorum.
+    Must only be used from the event loop that owns the slave sockets.
+    """
+
+    logger = logging.getLogger("Slave Dispatcher")
+
+    def __init__(
+            self,
+            max_in_flight: int = 2,
+            alpha: float = 0.3,
+            cancel: Optional[CancelRequest] = None,
+            hedge_percentile: float = 95,
+            hedge_default_delay: float = 1.0,
+            hedge_min_delay: float = 0.05,
+            hedge_min_samples: int = 5,
+            window: int = 64,
+    ):
+        """
+        :param max_in_flight: Requests a slave works on at once
+        :param alpha: Weight of the newest latency in each slave's moving average
+        :param cancel: Optional coroutine function telling a slave to drop a request
+        :param hedge_percentile: Percentile of the first slave's latency to wait for before hedging
+        :param hedge_default_delay: Seconds to wait before hedging while the slave has too few samples
+        :param hedge_min_delay: Seconds always waited before hedging
+        :param hedge_min_samples: Latencies needed before the percentile is trusted
+        :param window: Recent latencies kept per slave
+        """
+        self.max_in_flight = max_in_flight
+        self.alpha = alpha
+        self.cancel = cancel
+        self.hedge_percentile = hedge_percentile
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.window = window
+
+        self.slaves: Dict[WebSocket, SlaveState] = {}
+        self._requests: Dict[str, InFlightRequest] = {}
+        self._queue: Deque[InFlightRequest] = deque()
+
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.abandoned = 0
+
+    async def add(self, websocket: WebSocket) -> None:
+        self.slaves[websocket] = SlaveState(websocket, self.window)
+        await self._pump()
+
+    async def remove(self, websocket: WebSocket) -> None:
+        """
+        Forgets a slave, its unanswered requests go to the others
+        """
+        slave = self.slaves.pop(websocket, None)
+        if slave is None:
+            return
+
+        orphaned = []
+        for request in list(self._requests.values()):
+            if request.attempts.pop(websocket, None) is None or request.attempts:
+                continue
+            # No other slave is working on it
+            if request.done:
+                del self._requests[request.req_id]
+            else:
+                orphaned.append(request)
+
+        if orphaned:
+            self.logger.warning(f"Slave {slave.name} left with {len(orphaned)} request(s), re-dispatching")
+            for request in orphaned:
+                self._cancel_timer(request)
+                request.primary = None
+            self._queue.extendleft(reversed(orphaned))
+        await self._pump()
+
+    def name_of(self, websocket: Optional[WebSocket]) -> str:
+        slave = self.slaves.get(websocket)
+        return slave.name if slave is not None else "unknown"
+
+    def _pick(self, exclude=()) -> Optional[SlaveState]:
+        free = [
+            s for ws, s in self.slaves.items() if s.in_flight < self.max_in_flight and ws not in exclude
+        ]
+        if not free:
+            return None
+        return min(free, key=lambda s: (s.expected_wait, s.in_flight))
+
+    async def dispatch(self, req_id: str, send: SendRequest, hedge: bool = False, replicas: int = 1) -> int:
+        """
+        Sends a request to the least loaded slave, or queues it if every slave is at its cap
+        :param req_id: id the slave will answer with
+        :param send: Coroutine function sending the request to a given slave
+        :param hedge: Also send it to a second slave if the first is slow to answer
+        :param replicas: Distinct slaves to send it to. It only waits in the queue for the first,
+            and goes to as many of the others as are free at that moment.
+        :return: Slaves it was sent to, 0 if it was queued
+        """
+        request = InFlightRequest(req_id, send, hedge, replicas)
+        self._requests[req_id] = request
+        self._queue.append(request)
+        if not self.slaves:
+            self.logger.warning(f"No slave connections available, queued {req_id}")
+        await self._pump()
+        return len(request.attempts)
+
+    async def _pump(self) -> None:
+        while self._queue:
+            slave = self._pick()
+            if slave is None:
+                self.logger.debug(f"Every slave is busy, {len(self._queue)} request(s) queued")
+                return
+            request = self._queue.popleft()
+            if not await self._send(slave, request):
+                continue
+            if request.hedge:
+                self._schedule_hedge(slave, request)
+            while len(request.attempts) < request.replicas:
+                replica = self._pick(exclude=request.attempts)
+                if replica is None:
+                    break
+                await self._send(replica, request)
+
+    async def _send(self, slave: SlaveState, request: InFlightRequest) -> bool:
+        slave.in_flight += 1
+        request.attempts[slave.websocket] = time.monotonic()
+        if request.primary is None:
+            request.primary = slave.websocket
+        try:
+            await request.send(slave.websocket)
+            return True
+        except Exception as e:
+            self.logger.warning(f"Unable to send {request.req_id} to slave {slave.name}: {e}")
+            # Its handler removes it on disconnect too, removing it now keeps the retry off it
+            await self.remove(slave.websocket)
+            return False
+
+    """
+    HEDGING
+    """
+
+    def _hedge_delay(self, slave: SlaveState) -> float:
+        if len(slave.latencies) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        return max(slave.percentile(self.hedge_percentile), self.hedge_min_delay)
+
+    def _schedule_hedge(self, slave: SlaveState, request: InFlightRequest) -> None:
+        loop = asyncio.get_running_loop()
+        request.timer = loop.call_later(
+            self._hedge_delay(slave), lambda: asyncio.ensure_future(self._hedge(request))
+        )
+
+    @staticmethod
+    def _cancel_timer(request: InFlightRequest) -> None:
+        if request.timer is not None:
+            request.timer.cancel()
+            request.timer = None
+
+    async def _hedge(self, request: InFlightRequest) -> None:
+        request.timer = None
+        if request.done or not request.attempts:
+            return
+        # Hedges are only sent to idle capacity, they never queue behind other work
+        slave = self._pick(exclude=request.attempts)
+        if slave is None:
+            return
+        self.logger.info(f"No answer to {request.req_id} yet, hedging on slave {slave.name}")
+        if await self._send(slave, request):
+            self.hedges_sent += 1
+
+    """
+    RESPONSES
+    """
+
+    async def complete(self, req_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """
+        Records the response to a request, freeing its slave for the next queued one.
+        Once a hedged request is answered, the other slave working on it is told to cancel.
+        :param req_id: id of the request answered
+        :param websocket: Slave that answered, the first one sent the request if not known
+        :return: True if this is the first answer to the request
+        """
+        request = self._requests.get(req_id)
+        if request is None or not request.attempts:
+            return False
+
+        if websocket not in request.attempts:
+            websocket = next(iter(request.attempts))
+        sent_at = request.attempts.pop(websocket)
+        slave = self.slaves.get(websocket)
+        if slave is not None:
+            latency = time.monotonic() - sent_at
+            slave.in_flight -= 1
+            slave.completed += 1
+            slave.latencies.append(latency)
+            slave.latency_ewma = (
+                latency if slave.latency_ewma is None
+                else self.alpha * latency + (1 - self.alpha) * slave.latency_ewma
+            )
+
+        first = not request.done
+        if first:
+            request.done = True
+            self._cancel_timer(request)
+            if request.hedge and websocket is not request.primary:
+                self.hedges_won += 1
+            if request.replicas == 1:
+                await self._cancel_others(request)
+
+        # Slaves that could not be cancelled stay tracked until they answer, so their load is still counted
+        if not request.attempts:
+            del self._requests[req_id]
+        await self._pump()
+        return first
+
+    async def _cancel_others(self, request: InFlightRequest) -> None:
+        if self.cancel is None:
+            return
+        for websocket in list(request.attempts):
+            try:
+                cancelled = await self.cancel(websocket, request.req_id)
+            except Exception as e:
+                self.logger.warning(f"Unable to cancel {request.req_id}: {e}")
+                continue
+            if cancelled:
+                del request.attempts[websocket]
+                slave = self.slaves.get(websocket)
+                if slave is not None:
+                    slave.in_flight -= 1
+
+    async def abandon(self, req_id: str) -> None:
+        """
+        Gives up on a request that timed out or is no longer needed, e.g. the rest of a quorum,
+        whether it is still queued or on slaves.
+        Its slaves are told to cancel if they can, and their capacity is freed either way,
+        as the answer may never come. An answer that still arrives is ignored.
+        """
+        request = self._requests.pop(req_id, None)
+        if request is None:
+            return
+        self.abandoned += 1
+        request.done = True
+        self._cancel_timer(request)
+        if request in self._queue:
+            self._queue.remove(request)
+
+        await self._cancel_others(request)
+        for websocket in request.attempts:
+            slave = self.slaves.get(websocket)
+            if slave is not None:
+                slave.in_flight -= 1
+        request.attempts.clear()
+        await self._pump()
+
+    def snapshot(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "abandoned": self.abandoned,
+            "slaves": {s.name: s.snapshot() for s in self.slaves.values()},
+        }
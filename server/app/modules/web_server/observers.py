@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Optional
+
+from fastapi import WebSocket
+
+from app_types.data.observer_models import ObserverEvent, ObserverFrameHeader
+from app_types.data.slave_models import pack_binary_request
+from modules.camera.camera import Camera, CameraFrame
+from modules.camera.encoder import JpegBuffer, default_encoder
+from modules.camera.profiles import apply_profile, get_profile
+from .configuration import PREVIEW_PROFILE, OBSERVER_EVENT_QUEUE
+
+
+class ObserverStream:
+    """
+    Sends to a single observer from its own task. Only the latest preview frame is kept,
+    so a slow observer skips frames instead of building up a backlog. Events are kept in order.
+    """
+
+    logger = logging.getLogger("Observer Stream")
+
+    def __init__(self, websocket: WebSocket, fps: float, kbps: float):
+        """
+        :param websocket: Observer's socket
+        :param fps: Max preview frames per second sent
+        :param kbps: Max preview kilobits per second sent, 0 for no cap
+        """
+        self.websocket = websocket
+        self.fps = fps
+        self._min_interval = 1 / fps
+        self._bytes_per_second = kbps * 1000 / 8
+
+        self._frame: Optional[bytes] = None
+        self._events: Deque[str] = deque(maxlen=OBSERVER_EVENT_QUEUE)
+        self._wakeup = asyncio.Event()
+
+        self._next_frame_at = 0.0
+        # Token bucket of bytes, allowed to go negative so a frame larger than a second's worth is still sent
+        self._tokens = self._bytes_per_second
+        self._refilled_at = 0.0
+
+        self.sent = 0
+        self.dropped = 0
+
+    def offer_frame(self, frame: bytes) -> None:
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._wakeup.set()
+
+    def offer_event(self, event: str) -> None:
+        self._events.append(event)
+        self._wakeup.set()
+
+    def _frame_delay(self, now: float) -> float:
+        delay = self._next_frame_at - now
+        if self._bytes_per_second > 0:
+            self._tokens = min(
+                self._tokens + (now - self._refilled_at) * self._bytes_per_second, self._bytes_per_second
+            )
+            self._refilled_at = now
+            delay = max(delay, -self._tokens / self._bytes_per_second)
+        return delay
+
+    async def run(self) -> None:
+        """
+        Sends events and frames until the observer disconnects or the task is cancelled
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._events:
+                await self.websocket.send_text(self._events.popleft())
+
+            if self._frame is None:
+                continue
+
+            delay = self._frame_delay(loop.time())
+            if delay > 0:
+                # Come back when allowed, the frame may be replaced by a newer one in the meantime
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.set()
+                continue
+
+            frame, self._frame = self._frame, None
+            await self.websocket.send_bytes(frame)
+            self._next_frame_at = loop.time() + self._min_interval
+            self._tokens -= len(frame)
+            self.sent += 1
+
+
+class ObserverHub:
+    """
+    Streams a downscaled preview of the camera and capture events to every observer.
+    Frames are taken from the camera's ring without waiting, and encoded once on a thread of their own,
+    so previewing never holds up a capture.
+    """
+
+    logger = logging.getLogger("Observer Hub")
+
+    def __init__(self):
+        self.streams: Dict[WebSocket, ObserverStream] = {}
+        self._tasks: Dict[WebSocket, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._producer: Optional[asyncio.Task] = None
+
+        self._profile = get_profile(PREVIEW_PROFILE)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Preview-Encoder")
+        self._encoder = default_encoder()
+        self._buffer = JpegBuffer(256 * 1024)
+        self._seq = 0
+
+    async def add(self, websocket: WebSocket, fps: float, kbps: float) -> ObserverStream:
+        self._loop = asyncio.get_running_loop()
+        stream = ObserverStream(websocket, fps, kbps)
+        self.streams[websocket] = stream
+        self._tasks[websocket] = asyncio.create_task(self._run_stream(stream))
+
+        if self._producer is None or self._producer.done():
+            self._producer = asyncio.create_task(self._produce())
+        return stream
+
+    def remove(self, websocket: WebSocket) -> None:
+        stream = self.streams.pop(websocket, None)
+        task = self._tasks.pop(websocket, None)
+        if task is not None:
+            task.cancel()
+        if stream is not None:
+            self.logger.info(f"Observer left after {stream.sent} frame(s), {stream.dropped} dropped")
+
+    async def _run_stream(self, stream: ObserverStream) -> None:
+        try:
+            await stream.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Disconnected, the endpoint removes it once its receive fails too
+            self.logger.info(f"Observer stream stopped: {e}")
+
+    def publish(self, event: str, id: Optional[str] = None, **data) -> None:
+        """
+        Sends an event to every observer. Safe to call from any thread.
+        :param event: Name of the event, e.g. CV_REQUEST
+        :param id: Optional id of the request the event is about
+        :param data: JSON serialisable details
+        """
+        if self._loop is None or not self.streams:
+            return
+        message = ObserverEvent(event=event, id=id, data=data).model_dump_json()
+        self._loop.call_soon_threadsafe(self._publish, message)
+
+    def _publish(self, message: str) -> None:
+        for stream in self.streams.values():
+            stream.offer_event(message)
+
+    def _render(self, frame: CameraFrame) -> bytes:
+        """
+        [Preview Encoder Thread] Downscales and encodes a frame, packed with its header
+        """
+        img = apply_profile(frame.image, self._profile)
+        jpeg = self._encoder.encode(img, self._profile.quality, self._buffer)
+        self._seq += 1
+        header = ObserverFrameHeader(
+            seq=self._seq, timestamp=frame.timestamp, width=img.shape[1], height=img.shape[0]
+        )
+        return pack_binary_request(header, jpeg)
+
+    async def _produce(self) -> None:
+        """
+        Previews new frames at the rate of the fastest observer, until the last one leaves
+        """
+        loop = asyncio.get_running_loop()
+        last_timestamp = None
+
+        while self.streams:
+            await asyncio.sleep(1 / max(s.fps for s in self.streams.values()))
+
+            # Only previews a camera something else started, creating it here would block the loop on the sensor
+            camera = Camera.running()
+            frame = camera.peek_frame() if camera is not None else None
+            if frame is None or frame.timestamp == last_timestamp:
+                continue
+            last_timestamp = frame.timestamp
+
+            try:
+                packed = await loop.run_in_executor(self._executor, self._render, frame)
+            except Exception:
+                self.logger.exception("Unable to encode preview frame")
+                continue
+
+            for stream in self.streams.values():
+                stream.offer_frame(packed)
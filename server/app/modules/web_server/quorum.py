@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from app_types.primatives.cv import CvQuorumResponse, CvResponse
+from app_types.primatives.obstacle_label import ObstacleLabel, ABSTAINING_LABELS
+from utils.voting import weighted_vote
+from .configuration import CV_QUORUM_K, CV_QUORUM_N, CV_QUORUM_DEADLINE
+
+
+class QuorumPolicy:
+    """
+    Sends an image to n slaves, and combines the first k answers, or whatever arrived by the deadline.
+    """
+
+    def __init__(self, k: int, n: int, deadline: float, by_confidence: bool = True):
+        """
+        :param k: Answers needed before combining
+        :param n: Slaves the image is sent to, fewer if fewer are free
+        :param deadline: Max seconds to wait for k answers
+        :param by_confidence: Weight each answer by its confidence, else every answer counts the same
+        """
+        assert 0 < k <= n, "Quorum must be 1 <= k <= n"
+        self.k = k
+        self.n = n
+        self.deadline = deadline
+        self.by_confidence = by_confidence
+
+    @classmethod
+    def default(cls) -> "QuorumPolicy":
+        return cls(CV_QUORUM_K, CV_QUORUM_N, CV_QUORUM_DEADLINE)
+
+    def __repr__(self) -> str:
+        return f"QuorumPolicy({self.k} of {self.n}, {self.deadline}s)"
+
+
+class QuorumCollector:
+    """
+    Collects the answers to a single quorum request on the event loop, and calls back once with the combined label.
+    """
+
+    logger = logging.getLogger("Quorum")
+
+    def __init__(
+            self,
+            req_id: str,
+            policy: QuorumPolicy,
+            on_done: Callable[[CvQuorumResponse], None],
+    ):
+        """
+        :param req_id: id of the request
+        :param policy: How many answers to wait for, and for how long
+        :param on_done: Called once on the event loop with the result, must not block
+        """
+        self.req_id = req_id
+        self.policy = policy
+        self.requested = 0
+        self._on_done = on_done
+        self._answers: List[Tuple[str, CvResponse]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.done = False
+
+    def start(self, requested: int) -> None:
+        """
+        [Event Loop] Starts the deadline, once the request has been dispatched
+        :param requested: Slaves the request went to
+        """
+        self.requested = requested
+        self._timer = asyncio.get_running_loop().call_later(self.policy.deadline, self._finish)
+
+    def add(self, slave: str, response: CvResponse) -> None:
+        """
+        [Event Loop] Records a slave's answer, and finishes once k have arrived
+        """
+        if self.done:
+            self.logger.info(f"Late answer to {self.req_id} from {slave}: {response.label}")
+            return
+        self._answers.append((slave, response))
+        if len(self._answers) >= self.policy.k:
+            self._finish()
+
+    def _finish(self) -> None:
+        if self.done:
+            return
+        self.done = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+        reached = len(self._answers) >= self.policy.k
+        vote = weighted_vote(
+            ((r.label, r.confidence if self.policy.by_confidence else None) for _, r in self._answers),
+            abstain=ABSTAINING_LABELS,
+        )
+        label = vote.label if vote is not None else ObstacleLabel.Unknown
+        result = CvQuorumResponse(
+            id=self.req_id,
+            label=label,
+            confidence=vote.confidence if vote is not None else None,
+            requested=self.requested,
+            responded=[slave for slave, _ in self._answers],
+            agreed=[slave for slave, r in self._answers if vote is not None and r.label == label],
+            reached=reached,
+        )
+        if not reached:
+            self.logger.warning(
+                f"Quorum for {self.req_id} not reached by the deadline, "
+                f"{len(self._answers)} of {self.policy.k} answer(s)"
+            )
+        self._on_done(result)
@@ -4,6 +4,8 @@ from time import strftime, localtime
 from fastapi import APIRouter
 
 from modules.gamestate.gamestate import GameState
+from modules.web_server.connection_manager import ConnectionManager
+from modules.web_server.quorum import QuorumPolicy
 
 rest_endpoints = APIRouter()
 logger = logging.getLogger("Rest Endpoint")
@@ -17,18 +19,45 @@ async def index():
 
 
 @rest_endpoints.post("/command/capture")
-async def capture():
+async def capture(quorum: bool = False):
     """
     Endpoint to trigger the GameState class to take a picture and send to slaves
+    :param quorum: Have several slaves agree on the label, with the default `QuorumPolicy`
     :return:
     """
     logger.info("Received capture command")
-    GameState().capture_and_process_image()
+    GameState().capture_and_process_image(quorum=QuorumPolicy.default() if quorum else None)
     return "Done"
 
 
+@rest_endpoints.get("/cv-cache")
+async def cv_cache():
+    """
+    Endpoint to check how many CV requests were answered from the cache
+    :return: Entries, hits, misses and hit rate
+    """
+    return ConnectionManager().cv_cache.snapshot()
+
+
+@rest_endpoints.get("/slaves")
+async def slaves():
+    """
+    Endpoint to check how requests are spread over the slaves
+    :return: Queued requests, and in flight requests and latency per slave
+    """
+    return ConnectionManager().dispatcher.snapshot()
+
+
+@rest_endpoints.get("/pending")
+async def pending():
+    """
+    Endpoint to check requests still waiting for a slave, and how many timed out
+    :return: Pending requests, timeouts, early evictions and seconds until the next deadline
+    """
+    return ConnectionManager().pending_snapshot()
+
+
 @rest_endpoints.post("/task/2")
 async def start_task_two():
     # GameState().run(2)
     return ""
-
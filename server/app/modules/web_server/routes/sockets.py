@@ -1,11 +1,13 @@
+import asyncio
 import logging
 
-from fastapi import APIRouter, WebSocket
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 from modules.web_server.connection_handler import connection_handler
+from modules.web_server.configuration import OBSERVER_MAX_FPS, OBSERVER_MAX_KBPS
 from modules.web_server.connection_manager import ConnectionManager
 
-from modules.serial.stm32 import STM
+from modules.serial.stm_async import AsyncSTM
 from modules.gamestate import GameState
 
 socket_endpoints = APIRouter()
@@ -23,13 +25,24 @@ async def connect(websocket: WebSocket):
 
 
 @socket_endpoints.websocket("/observe")
-async def observe(websocket: WebSocket):
+async def observe(websocket: WebSocket, fps: float = OBSERVER_MAX_FPS, kbps: float = OBSERVER_MAX_KBPS):
     """
-    Endpoint to add register as an observer
+    Endpoint to add register as an observer.
+    Observers get a live preview as binary frames, and capture events as JSON text.
+    :param fps: Max preview frames per second, e.g. /ws/observe?fps=2
+    :param kbps: Max preview kilobits per second, 0 for no cap
     """
     logging.getLogger().info("New WS observer")
     await websocket.accept()
-    await ConnectionManager().observer(websocket)
+    await ConnectionManager().observer(websocket, max(fps, 0.1), max(kbps, 0))
+    try:
+        # Observers only listen, so this just waits for the disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logging.getLogger().info("WS observer closed")
+    finally:
+        ConnectionManager().remove_observer(websocket)
 
 
 @socket_endpoints.websocket("/stm-command")
@@ -37,12 +50,27 @@ async def stm_command(websocket: WebSocket):
     """
     WebSocket endpoint to send commands to the STM32.
     Expects a comma-separated string format: "flag,speed,angle,val".
+    Replies from the STM are forwarded to the client as they arrive.
     """
-    stm = STM()
+    stm = AsyncSTM()
     stm.connect()
     logging.getLogger().info("New STM command connection")
     await websocket.accept()
 
+    async def forward_replies():
+        async for reply in stm.replies():
+            await websocket.send_text(f"Received: {reply.raw}")
+
+    forwarder = asyncio.create_task(forward_replies())
+    try:
+        await _stm_command_loop(websocket, stm)
+    except WebSocketDisconnect:
+        logging.getLogger().info("STM command connection closed")
+    finally:
+        forwarder.cancel()
+
+
+async def _stm_command_loop(websocket: WebSocket, stm: AsyncSTM) -> None:
     while True:
         data = await websocket.receive_text()
         logging.getLogger().info(f"Received command: {data}")
@@ -54,8 +82,10 @@ async def stm_command(websocket: WebSocket):
             angle = int(angle)
             val = int(val)
 
-            # Call the send_cmd function
-            stm.send_cmd(flag, speed, angle, val)
+            # Written on the STM writer thread, so the event loop is not blocked on the serial port
+            if not await stm.send_cmd(flag, speed, angle, val):
+                await websocket.send_text(f"Command refused, the STM is running a program: {data}")
+                continue
 
             # Send a confirmation back to the client
             await websocket.send_text(f"Command sent: {data}")
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import json
 import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Manager, Process
 from typing import Optional
 
@@ -8,11 +10,21 @@ import requests
 from logger import prepare_logger
 from modules.camera.camera import Camera
 from modules.serial.android import Android
+from modules.serial.configuration import STM_PEEPHOLE_OPTIMIZER
 from modules.serial.stm32 import STM
+from modules.serial.stm_replies import StmAck, StmStop
+from modules.web_server.configuration import CV_CACHE_SIZE, CV_CACHE_HASH_SIZE, CV_CACHE_THRESHOLD, CV_CACHE_MAX_AGE
+from utils.perceptual_cache import PerceptualCache, dhash
+from utils.voting import weighted_vote
 
 API_IP = "192.168.100.194"
 API_PORT = 8000
 
+STOP_ACK_TIMEOUT = 2.0  # seconds snap_and_rec waits for the STM to acknowledge the stop before capturing anyway
+SNAP_BURST_SIZE = 3  # frames captured and recognised together per snap, their labels are voted on
+SNAP_BURST_ATTEMPTS = 2  # bursts taken before an obstacle is marked as failed
+RIGHT_TURN_WIGGLES = 3  # servo re-centres queued after each right turn
+
 obstacle_direction = {
     "NORTH": 1,
     "SOUTH": 2,
@@ -81,6 +93,37 @@ def convert_from_br_to_bl(command):
     return command
 
 
+def fuse_moves(commands: list) -> list:
+    """
+    Groups consecutive FORWARD (or BACKWARD) moves from the algo, so each group is sent to the STM as a single move.
+    Turns and captures are groups of their own, so capture points do not change.
+    :return: Groups of commands, in order
+    """
+    groups = []
+    for command in commands:
+        prev = groups[-1][-1] if groups else None
+        if (
+            prev is not None
+            and isinstance(command["value"], dict)
+            and isinstance(prev["value"], dict)
+            and command["value"].get("move") == prev["value"].get("move")
+        ):
+            groups[-1].append(command)
+            continue
+        groups.append([command])
+    return groups
+
+
+def fused_command(group: list) -> dict:
+    """
+    Single command for a group from fuse_moves, moving the total amount and ending at the last end position
+    """
+    if len(group) == 1:
+        return group[0]
+    last = group[-1]
+    return {**last, "value": {**last["value"], "amount": sum(c["value"]["amount"] for c in group)}}
+
+
 class PiAction:
     """
     Class that represents an action that the RPi needs to take.
@@ -136,6 +179,13 @@ class Task1RPI:
 
         self.movement_lock = self.manager.Lock()
 
+        # Set by recv_stm once the STM acknowledges the stop before a capture, with its time.monotonic()
+        self.stop_acked = self.manager.Event()
+        self.stopped_at = self.manager.Value("d", 0.0)
+
+        # Image-rec results of recent frames per obstacle, only used by rpi_action, so retries skip the API
+        self.cv_cache: PerceptualCache[dict] = PerceptualCache(CV_CACHE_SIZE, CV_CACHE_THRESHOLD, CV_CACHE_MAX_AGE)
+
         self.android_queue = self.manager.Queue()  # Messages to send to Android
         # Messages that need to be processed by RPi
         self.rpi_action_queue = self.manager.Queue()
@@ -380,28 +430,20 @@ class Task1RPI:
             message = None
 
             try:
-                message = self.stm.wait_receive()
-                self.logger.info(f"Message received from STM: {message}")
+                message = self.stm.wait_reply()
+                self.logger.info(f"Message received from STM: {message.raw}")
 
-                if message.startswith("fS"):
+                if isinstance(message, StmStop):
+                    # The robot is still, so any frame from now on can be used for the capture
+                    self.stopped_at.value = message.received_at
+                    self.stop_acked.set()
                     continue
 
-                elif message[0] == "f":
+                elif isinstance(message, StmAck):
                     # Finished command, send to android
-                    message_split = message[1:].split(
-                        "|"
-                    )  # Ignore the 'f' at the start
-                    cmd_speed = message_split[0]
-                    turning_degree = message_split[1]
-                    distance = message_split[2].strip()
-
-                    cmd = cmd_speed[0]  # Command (t/T)
+                    turning_degree = message.angle
 
-                    if (
-                        turning_degree == f"-{self.drive_angle}"
-                        or turning_degree == f"{self.drive_angle}"
-                        or turning_degree == "0"
-                    ):
+                    if turning_degree in (-self.drive_angle, self.drive_angle, 0):
                         print("movement commands")
                     else:
                         # Unknown turning degree
@@ -422,27 +464,28 @@ class Task1RPI:
                         self.logger.debug(
                             "ACK from STM32 received, movement lock released."
                         )
-                        cur_location = self.path_queue.get_nowait()
-                        print("current location", cur_location)
-                        self.current_location["x"] = cur_location["x"]
-                        self.current_location["y"] = cur_location["y"]
-                        self.current_location["d"] = direction_obstacle[
-                            cur_location["d"]
-                        ]
-
-                        self.logger.info(
-                            f"self.current_location = {self.current_location}"
-                        )
-
-                        self.android_queue.put(
-                            f"ROBOT|{self.current_location['y']},{self.current_location['x']},{self.current_location['d']}"
-                        )
+                        # A fused move passes through several positions, each is reported in order
+                        for cur_location in self.path_queue.get_nowait():
+                            print("current location", cur_location)
+                            self.current_location["x"] = cur_location["x"]
+                            self.current_location["y"] = cur_location["y"]
+                            self.current_location["d"] = direction_obstacle[
+                                cur_location["d"]
+                            ]
+
+                            self.logger.info(
+                                f"self.current_location = {self.current_location}"
+                            )
+
+                            self.android_queue.put(
+                                f"ROBOT|{self.current_location['y']},{self.current_location['x']},{self.current_location['d']}"
+                            )
                     except Exception as e:
                         print(e)
                         self.logger.warning("Tried to release a released lock!")
 
                 else:
-                    self.logger.warning(f"Ignored unknown message from STM: {message}")
+                    self.logger.warning(f"Ignored unknown message from STM: {message.raw}")
             except OSError:
                 self.logger.error("Event set: STM32 dropped")
                 self.stm_dropped.set()
@@ -538,9 +581,8 @@ class Task1RPI:
                         command["value"] == "FORWARD_RIGHT"
                         or command["value"] == "BACKWARD_RIGHT"
                     ):
-                        prepend_to_queue(self.command_queue, "WIGGLE")
-                        prepend_to_queue(self.command_queue, "WIGGLE")
-                        prepend_to_queue(self.command_queue, "WIGGLE")
+                        for _ in range(RIGHT_TURN_WIGGLES):
+                            prepend_to_queue(self.command_queue, "WIGGLE")
 
                         self.stm.send_cmd(
                             flag, int(self.drive_speed), int(angle), int(val) - 3
@@ -553,6 +595,7 @@ class Task1RPI:
 
                 elif command["value"] == "CAPTURE_IMAGE":
                     flag = "S"
+                    self.stop_acked.clear()
                     self.stm.send_cmd(flag, int(self.drive_speed), int(angle), int(val))
                     self.rpi_action_queue.put(
                         PiAction(cat="snap", value=command["capture_id"])
@@ -566,6 +609,8 @@ class Task1RPI:
                     self.logger.info(
                         f"At FIN, self.current_location: {self.current_location}"
                     )
+                    self.logger.info(self.stm.metrics.report())
+                    self.stm.metrics.reset()
                     self.unpause.clear()
                     self.movement_lock.release()
                     self.logger.info("Commands queue finished.")
@@ -587,53 +632,72 @@ class Task1RPI:
             )
             # Done
             if action.cat == "obstacles":
+                # Warm the camera up while the path is planned, so the first snap is not delayed
+                Camera().start_streaming()
                 for obs in action.value:
                     self.obstacles[obs["id"]] = obs
                 self.request_algo(action.value)
             elif action.cat == "snap":
                 self.snap_and_rec(obstacle_id_with_signal=action.value)
             elif action.cat == "stitch":
+                # Run finished, no more snaps until the next set of obstacles
+                Camera().stop_streaming()
                 self.request_stitch()
 
     # Done
-    def snap_and_rec(self, obstacle_id_with_signal: str) -> None:
+    def snap_and_rec(self, obstacle_id_with_signal: str, profile: Optional[str] = None) -> None:
         """
         RPi snaps an image and calls the API for image-rec.
         The response is then forwarded back to the android
         :param obstacle_id_with_signal: the current obstacle ID followed by underscore followed by signal
+        :param profile: Optional name of the capture profile, the config's if not set
         """
+        profile = profile or getattr(self.config, "capture_profile", None)
         obstacle_id = obstacle_id_with_signal
         self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
         # self.android_queue.put(f"info, Capturing image for obstacle id: {obstacle_id}")
         url = f"http://{API_IP}:{API_PORT}/image"
-        retry_count = 0
+        attempt = 0
+
+        if self.stop_acked.wait(timeout=STOP_ACK_TIMEOUT):
+            stopped_at = self.stopped_at.value
+        else:
+            self.logger.warning("No stop acknowledgement from STM, capturing anyway")
+            stopped_at = time.monotonic()
 
         while True:
-            retry_count += 1
-            file = Camera().capture_file()
+            attempt += 1
+            # The first burst is usually already in the frame ring by the time the snap is dequeued,
+            # a retry needs new frames, not the ones that just failed
+            jpegs = Camera().capture_burst(
+                SNAP_BURST_SIZE, after=stopped_at if attempt == 1 else time.monotonic(), profile=profile
+            )
 
-            self.logger.debug("Requesting from image API")
+            self.logger.debug(f"Requesting {len(jpegs)} frames from image API")
 
-            response = requests.post(
-                url,
-                files={"file": (file)},
-                data={"obstacle_id": obstacle_id},  # Add obstacle_id to the form data
-            )
+            # Frames are posted together, so a burst costs one round trip
+            with ThreadPoolExecutor(max_workers=len(jpegs)) as pool:
+                responses = list(pool.map(lambda jpeg: self._post_image(url, jpeg, obstacle_id), jpegs))
 
-            if response.status_code != 200:
+            frame_results = [r for r in responses if r is not None]
+            if not frame_results:
                 self.logger.error(
                     "Something went wrong when requesting path from image-rec API. Please try again."
                 )
                 return
 
-            results = json.loads(response.content)
+            self.logger.info(f"Image recognition results per frame: {frame_results}")
+
+            vote = weighted_vote(
+                ((r["image_id"], r.get("confidence")) for r in frame_results), abstain=["NA"]
+            )
+            self.logger.info(f"Burst vote: {vote}")
+            results = {**frame_results[0], "image_id": vote.label if vote is not None else "NA"}
 
-            if results["image_id"] != "NA" or retry_count > 6:
+            if vote is not None or attempt >= SNAP_BURST_ATTEMPTS:
                 break
-            elif retry_count > 3:
-                self.logger.info(f"Image recognition results: {results}")
-            elif retry_count <= 3:
-                self.logger.info(f"Image recognition results: {results}")
+
+        self.logger.info(f"Image-rec cache: {self.cv_cache.snapshot()}")
 
         # release lock so that bot can continue moving
         try:
@@ -663,6 +727,31 @@ class Task1RPI:
             self.logger.info(f"self.success_obstacles: {self.success_obstacles}")
         self.android_queue.put(f"TARGET,{results['obstacle_id']},{results['image_id']}")
 
+    def _post_image(self, url: str, jpeg: bytes, obstacle_id: str) -> Optional[dict]:
+        """
+        Posts a single frame to the image-rec API, unless a near-duplicate of it was recently recognised for the obstacle
+        :return: Parsed results, None if the request failed
+        """
+        image_hash = dhash(jpeg, CV_CACHE_HASH_SIZE)
+        cached = self.cv_cache.get(image_hash, obstacle_id)
+        if cached is not None:
+            self.logger.debug(f"Image-rec cache hit for obstacle {obstacle_id}")
+            return cached
+
+        response = requests.post(
+            url,
+            files={"file": ("file", jpeg)},
+            data={"obstacle_id": obstacle_id},  # Add obstacle_id to the form data
+        )
+        if response.status_code != 200:
+            self.logger.warning(f"Image-rec API returned {response.status_code}")
+            return None
+        results = json.loads(response.content)
+        # An NA is not cached, so the retry burst from the same pose reaches the API instead of the failed result
+        if results.get("image_id") != "NA":
+            self.cv_cache.put(image_hash, results, obstacle_id)
+        return results
+
     # Done
     def request_algo(self, obstacles: list):
         """
@@ -697,15 +786,19 @@ class Task1RPI:
         commands = result["commands"]
 
         print("commands", commands)
-        # Extracting end positions from the list of commands
+        # Only the STM commands are fused, Android still gets the end position of every move
+        groups = fuse_moves(commands) if STM_PEEPHOLE_OPTIMIZER else [[c] for c in commands]
+        self.logger.info(f"Peephole optimizer saved {len(commands) - len(groups)} move command(s)")
+
+        # Extracting end positions from the list of commands, grouped by the STM command that reaches them
         end_positions = [
-            convert_from_br_to_bl(command["end_position"]) for command in commands
+            [convert_from_br_to_bl(command["end_position"]) for command in group] for group in groups
         ]
 
         # Put commands and paths into respective queues
         self.clear_queues()
-        for c in commands:
-            self.command_queue.put(c)
+        for group in groups:
+            self.command_queue.put(fused_command(group))
 
         # Print or return the extracted end positions
         print("end_positions", end_positions)
@@ -0,0 +1,45 @@
+import multiprocessing
+
+from modules.serial import STM
+from modules.serial.stm_replies import StmAck
+from modules.serial.stm_simulator import StmSimulator
+
+COMMANDS = 20
+
+
+def _send(stm: STM) -> None:
+    for _ in range(COMMANDS):
+        stm.send_cmd("T", 40, 0, 10)
+
+
+def _receive(stm: STM, acks) -> None:
+    received = 0
+    for _ in range(COMMANDS):
+        reply = stm.wait_reply(timeout=5)
+        if reply is None:
+            break
+        received += isinstance(reply, StmAck)
+    acks.put(received)
+
+
+def test_forked_writer_leaves_every_reply_to_the_reader():
+    """
+    Like Task1, the link is opened before forking, one process only writes and another consumes the replies
+    """
+    simulator = StmSimulator(time_scale=0)
+    stm = STM()
+    stm.connect(simulator.start())
+    context = multiprocessing.get_context("fork")
+    acks = context.Queue()
+    try:
+        receiver = context.Process(target=_receive, args=(stm, acks))
+        receiver.start()
+        sender = context.Process(target=_send, args=(stm,))
+        sender.start()
+
+        sender.join(timeout=10)
+        receiver.join(timeout=10)
+        assert acks.get(timeout=1) == COMMANDS
+    finally:
+        stm.disconnect()
+        simulator.stop()
@@ -0,0 +1,63 @@
+import pytest
+
+# Imported before task_two, which is otherwise reached in a circular import through modules.serial.android
+from modules.serial import STM
+from modules.serial.stm32 import StmInFlightCommand
+from modules.serial.stm_commands import StmProgram, StmStraight, StmTurn, StmWiggle, StmMove
+from modules.serial.stm_optimizer import StmPeepholeOptimizer
+from modules.serial.stm_simulator import StmSimulator
+from modules.tasks.task_two import TaskTwoRunner
+
+
+@pytest.mark.parametrize(
+    "commands",
+    [
+        [],
+        [StmStraight(distance=20, speed=40)],
+        [StmTurn(angle=-90, speed=40), StmWiggle(), StmStraight(distance=15, speed=40, forward=False)],
+        list(TaskTwoRunner.bypass_program("left", 40)),
+        [StmMove(distance=10, angle=25, speed=30, forward=True), StmWiggle()],
+    ],
+)
+def test_program_framing_matches_commands(commands):
+    program = StmProgram(*commands)
+
+    assert program.to_bytes() == b"".join(c.to_bytes() for c in commands)
+    assert program.to_serial() == "".join(c.to_serial() for c in commands)
+
+
+def test_wiggle_runs_survive_optimization():
+    # Task two re-centres the servo several times in a row on purpose
+    commands = [StmTurn(angle=90, speed=40), StmWiggle(), StmWiggle(), StmWiggle(), StmStraight(distance=10, speed=40)]
+
+    assert StmPeepholeOptimizer().optimize(commands) == commands
+    assert STM().optimizer.optimize(commands) == commands
+    assert StmPeepholeOptimizer(collapse_wiggles=True).optimize(commands) == commands[:2] + commands[-1:]
+
+
+@pytest.fixture
+def simulated_stm():
+    simulator = StmSimulator(time_scale=0)
+    port = simulator.start()
+    stm = STM()
+    stm.connect(port)
+    try:
+        yield stm
+    finally:
+        stm.disconnect()
+        simulator.stop()
+
+
+def test_bypass_program_replays_against_simulator(simulated_stm):
+    program = TaskTwoRunner.bypass_program("right", 40)
+    commands = simulated_stm.optimizer.optimize(program.commands)
+    writes_before = simulated_stm.metrics.writes
+
+    replies = simulated_stm.execute(program, timeout=5)
+
+    assert simulated_stm.metrics.writes - writes_before == 1
+    assert len(replies) == len(commands)
+    for seq, (command, reply) in enumerate(zip(commands, replies)):
+        assert reply is not None, f"No reply to {command}"
+        assert StmInFlightCommand(seq, command).matches(reply), f"{reply.raw} does not match {command}"
+    assert simulated_stm.in_flight == 0
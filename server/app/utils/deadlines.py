@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class DeadlineScheduler:
+    """
+    Expires keys once their deadline passes, e.g. requests that were never answered.
+    Deadlines are kept in a heap, with a single timer on the event loop armed for the earliest one,
+    so thousands of pending keys cost one timer. Cancelled keys are left in the heap and skipped when popped.
+    `add` and `cancel` are safe to call from any thread, `on_expire` is called on the event loop.
+    """
+
+    def __init__(self, on_expire: Callable[[Hashable], None], loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        :param on_expire: Called with each key whose deadline passed, must not block
+        :param loop: Event loop the timer runs on, can be set later with `bind`
+        """
+        self._on_expire = on_expire
+        self._loop = loop
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = {}  # Live keys, heap entries not matching are stale
+        self._seq = itertools.count()  # Breaks ties, so keys are never compared
+        self._lock = threading.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._armed_for: Optional[float] = None
+
+        self.expired = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        loop.call_soon_threadsafe(self._arm)
+
+    def add(self, key: Hashable, timeout: float) -> None:
+        """
+        :param key: Key to expire, adding it again moves its deadline
+        :param timeout: Seconds from now
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+            rearm = self._armed_for is None or deadline < self._armed_for
+        if rearm and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._arm)
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        :return: False if the key had no deadline, e.g. it already expired
+        """
+        with self._lock:
+            if self._deadlines.pop(key, None) is None:
+                return False
+            # Rebuild once stale entries dominate, so the heap stays bounded by the live keys
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._heap = [e for e in self._heap if self._deadlines.get(e[2]) == e[0]]
+                heapq.heapify(self._heap)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        :return: Seconds until the earliest deadline, None if there are none
+        """
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] - time.monotonic() if self._heap else None
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _arm(self) -> None:
+        """
+        [Event Loop] Points the timer at the earliest deadline
+        """
+        with self._lock:
+            self._drop_stale()
+            earliest = self._heap[0][0] if self._heap else None
+            if earliest == self._armed_for:
+                return
+            self._armed_for = earliest
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if earliest is not None:
+            self._timer = self._loop.call_later(max(earliest - time.monotonic(), 0), self._fire)
+
+    def _fire(self) -> None:
+        """
+        [Event Loop] Expires every key that is due, then re-arms for the next
+        """
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            self._timer = None
+            self._armed_for = None
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) == deadline:
+                    del self._deadlines[key]
+                    due.append(key)
+        self.expired += len(due)
+        for key in due:
+            self._on_expire(key)
+        self._arm()
@@ -0,0 +1,106 @@
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+import numpy as np
+from PIL import Image
+
+Value = TypeVar("Value")
+
+
+def dhash(jpeg: bytes, size: int = 16) -> int:
+    """
+    Difference hash of a JPEG: a bit per pixel of a (size, size + 1) grayscale thumbnail, set where it is
+    brighter than its right neighbour. Frames of the same scene differ in only a few bits.
+    The JPEG is decoded at 1/8 scale, so hashing a full still costs a few milliseconds.
+    :param jpeg: JPEG bytes
+    :param size: Side of the hash, 16 gives a 256 bit hash
+    :return: Hash as an int
+    """
+    img = Image.open(io.BytesIO(jpeg))
+    img.draft("L", (max(img.width // 8, size + 1), max(img.height // 8, size)))
+    thumb = np.asarray(img.convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class PerceptualCache(Generic[Value]):
+    """
+    Small LRU cache from image hashes to results, that also matches near-duplicate images.
+    A lookup hits the most recently used entry within `threshold` bits of the hash, with the same context.
+    The hash is too coarse to tell small details apart, e.g. the direction of a distant arrow,
+    so lookups should be scoped by a context that pins down the scene, like the obstacle being looked at.
+    Thread safe.
+    """
+
+    def __init__(self, capacity: int = 32, threshold: int = 10, max_age: Optional[float] = None):
+        """
+        :param capacity: Entries kept, the least recently used is evicted first
+        :param threshold: Max Hamming distance between hashes of images treated as the same
+        :param max_age: Optional seconds an entry can be used for, so results do not outlive the scene
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        self.max_age = max_age
+        self._entries: "OrderedDict[Tuple[int, Hashable], Tuple[Value, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_hash: int, context: Hashable = None) -> Optional[Value]:
+        """
+        :param image_hash: Hash of the image
+        :param context: Anything else the result depends on, e.g. request options, must match exactly
+        :return: Cached result of a near-duplicate image, None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Newest first, so the closest recent frame of a sitting robot is found in a step or two
+            for key in reversed(self._entries):
+                cached_hash, cached_context = key
+                value, stored_at = self._entries[key]
+                if self.max_age is not None and now - stored_at > self.max_age:
+                    continue
+                if cached_context == context and hamming(cached_hash, image_hash) <= self.threshold:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, image_hash: int, value: Value, context: Hashable = None) -> None:
+        with self._lock:
+            key = (image_hash, context)
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drops every entry and resets the hit counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 3),
+            }
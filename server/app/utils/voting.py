@@ -0,0 +1,63 @@
+from collections import defaultdict
+from typing import Dict, Generic, Hashable, Iterable, Optional, Tuple, TypeVar
+
+Label = TypeVar("Label", bound=Hashable)
+
+
+class VoteResult(Generic[Label]):
+    """
+    Winner of a confidence-weighted vote.
+    """
+
+    def __init__(self, label: Label, score: float, votes: int, total: float):
+        """
+        :param label: Label with the highest summed confidence
+        :param score: Summed confidence of the label
+        :param votes: Number of frames that voted for the label
+        :param total: Summed confidence of every counted vote
+        """
+        self.label = label
+        self.score = score
+        self.votes = votes
+        self.total = total
+
+    @property
+    def confidence(self) -> float:
+        """
+        :return: Share of the counted confidence held by the winner, in [0, 1]
+        """
+        return self.score / self.total if self.total else 0.0
+
+    def __repr__(self) -> str:
+        return f"VoteResult({self.label!r}, votes={self.votes}, confidence={self.confidence:.2f})"
+
+
+def weighted_vote(
+        votes: Iterable[Tuple[Optional[Label], Optional[float]]],
+        abstain: Iterable[Label] = (),
+        default_confidence: float = 1.0,
+) -> Optional[VoteResult[Label]]:
+    """
+    Combines per-frame labels by summing their confidences.
+    Ties go to the label that was voted for first, so the earliest frame wins when nothing else decides.
+    :param votes: (label, confidence) per frame, a missing confidence counts as `default_confidence`
+    :param abstain: Labels that mean nothing was recognised, e.g. "NA", and are not counted
+    :param default_confidence: Weight of a vote without a confidence
+    :return: Winning label, None if every frame abstained
+    """
+    abstain = set(abstain)
+    scores: Dict[Label, float] = defaultdict(float)
+    counts: Dict[Label, int] = defaultdict(int)
+
+    for label, confidence in votes:
+        if label is None or label in abstain:
+            continue
+        scores[label] += default_confidence if confidence is None else confidence
+        counts[label] += 1
+
+    if not scores:
+        return None
+
+    # dicts keep insertion order, and max() keeps the first of equal scores
+    winner = max(scores, key=scores.get)
+    return VoteResult(winner, scores[winner], counts[winner], sum(scores.values()))